@@ -0,0 +1,198 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code opens a folder of WRF output (wrfout_d03_* files,
+# one output time per file) as one lazy dataset indexed by time:
+#   - opening it only scans the filenames (wrf_pipeline.py) and
+#     reads the variable headers of the first file
+#   - ds['T2'][t0:t1,j,i] opens only the files in t0:t1 and
+#     reads only the spatial tiles (all levels, tile x tile
+#     cells) that contain the requested cells
+#   - a bounded pool of open file handles is kept, and decoded
+#     tiles are kept in an LRU cache (by bytes), so repeated
+#     and neighbouring queries don't touch the disk again
+#
+################################################################
+#
+#
+from collections import OrderedDict
+import numpy as np
+from netCDF4 import Dataset
+from wrf_pipeline import find_wrf_files
+
+TILE = 64 # tile size (cells) along south_north and west_east
+CACHE_BYTES = 256*1024*1024 # decoded tiles kept in memory
+
+class WRFVariable(object):
+    # one variable across all files: (time,)+(per-file shape without Time)
+    def __init__(self,dataset,name,dims,shape,dtype,attrs):
+        self.dataset,self.name,self.dims,self.dtype,self.attrs = dataset,name,dims,dtype,attrs
+        self.shape = (len(dataset.files),)+tuple(shape[1:])
+        # spatial variables are cached by tiles, others by whole fields
+        self.tiled = len(dims)>=3 and dims[-2].startswith('south_north') and dims[-1].startswith('west_east')
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getattr__(self,attr):
+        # netCDF attributes (description, units...)
+        if attr!='attrs' and attr in self.attrs:
+            return self.attrs[attr]
+        raise AttributeError(attr)
+
+    def __getitem__(self,key):
+        # ints and slices on every axis, e.g. ds['T2'][t0:t1,j,i] or ds['U'][t,:,j,i]
+        key = key if isinstance(key,tuple) else (key,)
+        if len(key)>self.ndim:
+            raise IndexError('too many indices for {0} with shape {1}'.format(self.name,self.shape))
+        key = key+(slice(None),)*(self.ndim-len(key))
+        ranges,squeeze = [],[]
+        for axis,(k,n) in enumerate(zip(key,self.shape)):
+            if isinstance(k,slice):
+                ranges.append(range(*k.indices(n)))
+            else:
+                k = int(k)+n if int(k)<0 else int(k)
+                if k<0 or k>=n:
+                    raise IndexError('index {0} is out of bounds for axis {1} with size {2}'.format(k,axis,n))
+                ranges.append(range(k,k+1))
+                squeeze.append(axis)
+        out = np.empty([len(ii) for ii in ranges],dtype=self.dataset._out_dtype(self.dtype))
+        for t_out,f_indx in enumerate(ranges[0]):
+            out[t_out] = self._read_file(f_indx,ranges[1:])
+        return out.squeeze(axis=tuple(squeeze)) if len(squeeze)>0 else out
+
+    def _read_file(self,f_indx,ranges):
+        # the selection (per-file axes) from one file, assembled from cached chunks
+        if any(len(ii)==0 for ii in ranges):
+            return np.empty([len(ii) for ii in ranges],dtype=self.dataset._out_dtype(self.dtype))
+        if not self.tiled:
+            field = self.dataset._chunk(self.name,f_indx,None)
+            return field[np.ix_(*ranges)] if len(ranges)>0 else field
+        *lead,r_j,r_i = ranges
+        j_0,j_1,i_0,i_1 = min(r_j),max(r_j)+1,min(r_i),max(r_i)+1
+        block = np.empty([len(ii) for ii in lead]+[j_1-j_0,i_1-i_0],dtype=self.dataset._out_dtype(self.dtype))
+        for t_j in range(j_0//TILE,(j_1-1)//TILE+1):
+            for t_i in range(i_0//TILE,(i_1-1)//TILE+1):
+                tile = self.dataset._chunk(self.name,f_indx,(t_j,t_i))
+                tj_0,tj_1 = max(j_0,t_j*TILE),min(j_1,(t_j+1)*TILE)
+                ti_0,ti_1 = max(i_0,t_i*TILE),min(i_1,(t_i+1)*TILE)
+                sub = tile[...,tj_0-t_j*TILE:tj_1-t_j*TILE,ti_0-t_i*TILE:ti_1-t_i*TILE]
+                block[...,tj_0-j_0:tj_1-j_0,ti_0-i_0:ti_1-i_0] = sub[np.ix_(*lead)] if len(lead)>0 else sub
+        if (r_j.step,r_i.step)!=(1,1): # strided or reversed selections
+            block = block[...,np.array(r_j)-j_0,:][...,np.array(r_i)-i_0]
+        return block
+
+class WRFDataset(object):
+    def __init__(self,wrf_dir,domain='d03',spinup_hours=0,max_open=16,cache_bytes=CACHE_BYTES):
+        # wrf_dir: a run folder, or a folder of run folders (wrf_pipeline.find_wrf_files)
+        times,self.files = find_wrf_files(wrf_dir,domain,spinup_hours)
+        if len(self.files)==0:
+            raise ValueError('No wrfout_{0} files in {1}'.format(domain,wrf_dir))
+        self.times = np.array(times,dtype='datetime64[s]')
+        self.max_open,self.cache_bytes = max_open,cache_bytes
+        self._handles = OrderedDict() # file index -> open Dataset, least recently used first
+        self._cache = OrderedDict() # (name, file index, tile) -> decoded array
+        self._cache_size = 0
+        self.hits,self.misses = 0,0
+        data = self._handle(0) # variable headers of the first file
+        if len(data.dimensions['Time'])!=1:
+            raise ValueError('Expected one output time per file in {}'.format(self.files[0]))
+        self.variables = OrderedDict()
+        for name,var in data.variables.items():
+            attrs = {ii:var.getncattr(ii) for ii in var.ncattrs()}
+            self.variables[name] = WRFVariable(self,name,var.dimensions,var.shape,var.dtype,attrs)
+
+    def __getitem__(self,name):
+        return self.variables[name]
+
+    def __contains__(self,name):
+        return name in self.variables
+
+    def keys(self):
+        return self.variables.keys()
+
+    def __len__(self):
+        return len(self.files)
+
+    def time_index(self,t):
+        # index of the first file at or after t (datetime or datetime64)
+        return int(np.searchsorted(self.times,np.datetime64(t,'s')))
+
+    #
+    # file handles and chunk cache
+    #
+    def _handle(self,f_indx):
+        # open Dataset of a file, closing the least recently used one past max_open
+        if f_indx in self._handles:
+            self._handles.move_to_end(f_indx)
+            return self._handles[f_indx]
+        while len(self._handles)>=self.max_open:
+            self._handles.popitem(last=False)[1].close()
+        self._handles[f_indx] = Dataset(self.files[f_indx])
+        return self._handles[f_indx]
+
+    def _out_dtype(self,dtype):
+        return np.float32 if np.issubdtype(dtype,np.floating) else dtype
+
+    def _chunk(self,name,f_indx,tile):
+        # decoded tile (all leading axes, TILE x TILE cells) or whole field (tile=None)
+        key = (name,f_indx,tile)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        var = self._handle(f_indx).variables[name]
+        if tile is None:
+            raw = var[0]
+        else:
+            t_j,t_i = tile
+            raw = var[0,...,t_j*TILE:(t_j+1)*TILE,t_i*TILE:(t_i+1)*TILE]
+        if np.issubdtype(var.dtype,np.floating):
+            chunk = np.ma.filled(np.ma.asarray(raw,dtype=np.float32),np.nan)
+        else:
+            chunk = np.ma.getdata(raw)
+        self._cache[key] = chunk
+        self._cache_size += chunk.nbytes
+        while self._cache_size>self.cache_bytes and len(self._cache)>1:
+            self._cache_size -= self._cache.popitem(last=False)[1].nbytes
+        return chunk
+
+    def cache_info(self):
+        return {'hits':self.hits,'misses':self.misses,'chunks':len(self._cache),'bytes':self._cache_size,
+                'open_files':len(self._handles)}
+
+    def close(self):
+        for data in self._handles.values():
+            data.close()
+        self._handles.clear()
+        self._cache.clear()
+        self._cache_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+if __name__ == '__main__':
+    import sys,time
+    wrf_folder = sys.argv[1] if len(sys.argv)>1 else './' # a WRF run folder (or folder of runs)
+    t_start = time.time()
+    ds = WRFDataset(wrf_folder,'d03',spinup_hours=6)
+    print('{0:d} files ({1} to {2}) indexed in {3:2.3f} s'.format(len(ds),ds.times[0],ds.times[-1],time.time()-t_start))
+    for name in ('T2','U','PHB'):
+        print('{0} - {1} {2}'.format(name,ds[name].description,ds[name].shape))
+    for attempt in ('cold','cached'):
+        t_start = time.time()
+        T2_series = ds['T2'][:,15,20] # one cell through time
+        U_profiles = ds['U'][:,:,15,20]
+        print('{0}: T2 series {1}, U profiles {2} in {3:2.3f} s'.format(attempt,T2_series.shape,U_profiles.shape,time.time()-t_start))
+    print(ds.cache_info())
+    ds.close()
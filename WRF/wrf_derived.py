@@ -0,0 +1,283 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code derives diagnostics from WRF output over the whole
+# domain:
+#   - a registry (DERIVED) of diagnostics, each declaring the
+#     wrfout variables it needs, so only those are read:
+#       Rn     - surface net radiation
+#       WSPD10 - 10 m wind speed
+#       WDIR10 - 10 m wind direction (earth-relative, from)
+#       RH2    - 2 m relative humidity
+#       Z      - geopotential height of the mass levels (PH+PHB)
+#   - evaluation in blocks of south_north rows, in float32, with
+#     kernels that only use in-place numpy operations on
+#     preallocated output/scratch arrays (no temporaries)
+#   - a cube on disk (one .npy per diagnostic, (time, ...)) that
+#     files are derived into by a process pool, and that later
+#     runs reuse, only deriving the times still missing; progress
+#     is checkpointed as files finish, and a file that fails is
+#     reported and left missing instead of stopping the batch
+#
+################################################################
+#
+#
+import json,os,time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor,as_completed
+import numpy as np
+from netCDF4 import Dataset
+
+ROW_CHUNK = 64 # south_north rows evaluated at a time
+SIGMA = np.float32(5.670374419e-8) # Stefan-Boltzmann constant
+GRAVITY = 9.81
+DERIVED_JSON = 'derived.json'
+
+########################################
+# registry
+########################################
+#
+class Derived(object):
+    def __init__(self,name,inputs,kernel,units,description,n_scratch=0,shape=None):
+        # kernel(fields, out, scratch): fields {input: float32 array}, out and
+        # scratch arrays are preallocated; shape maps the first input's
+        # per-file shape to the output's (same shape by default)
+        self.name,self.inputs,self.kernel = name,list(inputs),kernel
+        self.units,self.description,self.n_scratch = units,description,n_scratch
+        self.shape = (lambda in_shape:tuple(in_shape)) if shape is None else shape
+
+    def evaluate(self,fields,out=None,scratch=None):
+        # the diagnostic for arrays in memory (e.g. site columns)
+        in_shape = np.shape(fields[self.inputs[0]])
+        out = np.empty(self.shape(in_shape),dtype=np.float32) if out is None else out
+        scratch = [np.empty(in_shape,dtype=np.float32) for _ in range(self.n_scratch)] if scratch is None else scratch
+        self.kernel(fields,out,scratch)
+        return out
+
+DERIVED = OrderedDict() # name -> Derived
+
+def register(derived):
+    DERIVED[derived.name] = derived
+    return derived
+
+def _net_radiation(f,out,scratch):
+    # (SW_IN - SW_OUT) + (LW_IN - LW_OUT), with TSK^4 as two squares
+    np.multiply(f['TSK'],f['TSK'],out=out)
+    np.multiply(out,out,out=out)
+    np.multiply(out,f['EMISS'],out=out)
+    np.multiply(out,SIGMA,out=out) # outgoing longwave
+    np.subtract(f['GLW'],out,out=out)
+    np.subtract(np.float32(1.0),f['ALBEDO'],out=scratch[0])
+    np.multiply(scratch[0],f['SWDOWN'],out=scratch[0]) # net shortwave
+    np.add(out,scratch[0],out=out)
+
+def _wind_speed(f,out,scratch):
+    np.multiply(f['U10'],f['U10'],out=out)
+    np.multiply(f['V10'],f['V10'],out=scratch[0])
+    np.add(out,scratch[0],out=out)
+    np.sqrt(out,out=out)
+
+def _wind_direction(f,out,scratch):
+    # grid-relative U10/V10 rotated to earth-relative, then the direction
+    # the wind blows from in degrees clockwise from north
+    u_e,tmp = scratch
+    np.multiply(f['U10'],f['COSALPHA'],out=u_e)
+    np.multiply(f['V10'],f['SINALPHA'],out=tmp)
+    np.subtract(u_e,tmp,out=u_e)
+    np.multiply(f['V10'],f['COSALPHA'],out=out)
+    np.multiply(f['U10'],f['SINALPHA'],out=tmp)
+    np.add(out,tmp,out=out) # earth-relative v
+    np.arctan2(u_e,out,out=out)
+    np.multiply(out,np.float32(180.0/np.pi),out=out)
+    np.add(out,np.float32(180.0),out=out)
+    np.mod(out,np.float32(360.0),out=out)
+
+def _relative_humidity(f,out,scratch):
+    # Q2 (mixing ratio) over the saturation mixing ratio at T2 and PSFC,
+    # with Bolton's saturation vapor pressure
+    np.subtract(f['T2'],np.float32(273.15),out=out)
+    np.subtract(f['T2'],np.float32(29.65),out=scratch[0])
+    np.divide(out,scratch[0],out=out)
+    np.multiply(out,np.float32(17.67),out=out)
+    np.exp(out,out=out)
+    np.multiply(out,np.float32(611.2),out=out) # saturation vapor pressure [Pa]
+    np.subtract(f['PSFC'],out,out=scratch[0])
+    np.divide(out,scratch[0],out=out)
+    np.multiply(out,np.float32(0.622),out=out) # saturation mixing ratio
+    np.divide(f['Q2'],out,out=out)
+    np.multiply(out,np.float32(100.0),out=out)
+    np.clip(out,np.float32(0.0),np.float32(100.0),out=out)
+
+def _geopotential_height(f,out,scratch):
+    # (PH+PHB) on the staggered levels, averaged onto the mass levels, over g
+    np.add(f['PH'],f['PHB'],out=scratch[0])
+    np.add(scratch[0][1:],scratch[0][:-1],out=out)
+    np.multiply(out,np.float32(0.5/GRAVITY),out=out)
+
+register(Derived('Rn',['SWDOWN','ALBEDO','GLW','EMISS','TSK'],_net_radiation,'W m-2','surface net radiation',1))
+register(Derived('WSPD10',['U10','V10'],_wind_speed,'m s-1','wind speed at 10 M',1))
+register(Derived('WDIR10',['U10','V10','COSALPHA','SINALPHA'],_wind_direction,'degrees',
+                 'wind direction at 10 M (from, clockwise from north)',2))
+register(Derived('RH2',['Q2','T2','PSFC'],_relative_humidity,'%','relative humidity at 2 M',1))
+register(Derived('Z',['PH','PHB'],_geopotential_height,'m','geopotential height of the mass levels',1,
+                 shape=lambda in_shape:(in_shape[0]-1,)+tuple(in_shape[1:])))
+
+#
+########################################
+# chunked evaluation
+########################################
+#
+def _read_rows(var,r_0,r_1):
+    # rows r_0:r_1 of a variable's first time, float32 with NaN fill
+    return np.ma.filled(np.ma.asarray(var[0,...,r_0:r_1,:],dtype=np.float32),np.nan)
+
+def derive_fields(data,names,out=None,row_chunk=ROW_CHUNK):
+    # whole-domain diagnostics {name: float32 array} for an open wrfout Dataset.
+    # out may hold arrays (e.g. cube slots) to write the diagnostics into
+    out = {} if out is None else out
+    n_y = len(data.dimensions['south_north'])
+    inputs = []
+    for name in names:
+        inputs += [ii for ii in DERIVED[name].inputs if ii not in inputs]
+    for name in names:
+        if name not in out:
+            in_shape = data.variables[DERIVED[name].inputs[0]].shape[1:]
+            out[name] = np.empty(DERIVED[name].shape(in_shape),dtype=np.float32)
+    scratch = {} # per diagnostic, allocated for the first (largest) block
+    for r_0 in range(0,n_y,row_chunk):
+        r_1 = min(r_0+row_chunk,n_y)
+        fields = {ii:_read_rows(data.variables[ii],r_0,r_1) for ii in inputs}
+        for name in names:
+            derived = DERIVED[name]
+            in_shape = np.shape(fields[derived.inputs[0]])
+            if name not in scratch:
+                scratch[name] = [np.empty(in_shape,dtype=np.float32) for _ in range(derived.n_scratch)]
+            derived.kernel(fields,out[name][...,r_0:r_1,:],[ii[...,0:r_1-r_0,:] for ii in scratch[name]])
+    return out
+
+#
+########################################
+# derived cube on disk
+########################################
+#
+def _derive_file(args):
+    # worker: derive one file's missing diagnostics straight into the cube's slots
+    cube_dir,t_index,wrf_file,names,row_chunk = args
+    cubes = {ii:np.load(os.path.join(cube_dir,ii+'.npy'),mmap_mode='r+') for ii in names}
+    with Dataset(wrf_file) as data:
+        derive_fields(data,names,{ii:cubes[ii][t_index] for ii in names},row_chunk)
+    for ii in names:
+        cubes[ii].flush()
+    return t_index,names
+
+class DerivedCube(object):
+    def __init__(self,cube_dir):
+        # open an existing cube (see DerivedCube.create)
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir,DERIVED_JSON),'r') as json_file:
+            self.meta = json.load(json_file)
+
+    @classmethod
+    def create(cls,cube_dir,wrf_files,times,names=('Rn',)):
+        # new cube for wrf_files (valid times in times), one (time, ...) .npy per
+        # diagnostic, shaped from the first file
+        meta = {'names':list(names),'files':[os.path.abspath(ii) for ii in wrf_files],
+                'times':[str(np.datetime64(ii,'s')) for ii in times],'units':{},'descriptions':{},
+                'shapes':{},'done':{}}
+        if os.path.isdir(cube_dir)==False:
+            os.makedirs(cube_dir)
+        with Dataset(wrf_files[0]) as data:
+            for name in names:
+                derived = DERIVED[name]
+                shape = derived.shape(data.variables[derived.inputs[0]].shape[1:])
+                cube = np.lib.format.open_memmap(os.path.join(cube_dir,name+'.npy'),mode='w+',dtype=np.float32,
+                                                 shape=(len(wrf_files),)+tuple(shape))
+                cube.fill(np.nan) # slots not derived yet read as missing, not as 0.0
+                cube.flush()
+                del cube
+                meta['units'][name],meta['descriptions'][name] = derived.units,derived.description
+                meta['shapes'][name],meta['done'][name] = list(shape),[False]*len(wrf_files)
+        cls._save_meta(cube_dir,meta)
+        return cls(cube_dir)
+
+    @staticmethod
+    def _save_meta(cube_dir,meta):
+        tmp_file = os.path.join(cube_dir,DERIVED_JSON+'.tmp')
+        with open(tmp_file,'w') as json_file:
+            json.dump(meta,json_file)
+        os.replace(tmp_file,os.path.join(cube_dir,DERIVED_JSON))
+
+    @property
+    def times(self):
+        return np.array(self.meta['times'],dtype='datetime64[s]')
+
+    def compute(self,n_workers=None,row_chunk=ROW_CHUNK,save_every=20):
+        # derive every (file, diagnostic) not yet in the cube, returns the
+        # number of files derived (failures are kept in self.failed)
+        jobs = []
+        for t_index,wrf_file in enumerate(self.meta['files']):
+            missing = [ii for ii in self.meta['names'] if not self.meta['done'][ii][t_index]]
+            if len(missing)>0:
+                jobs.append((self.cube_dir,t_index,wrf_file,missing,row_chunk))
+        self.failed = {} # wrf file -> error
+        if len(jobs)==0:
+            return 0
+        n_done = 0
+        if n_workers is not None and n_workers<=1:
+            for indx,job in enumerate(jobs):
+                n_done += self._collect(job,lambda:_derive_file(job))
+                if (indx+1)%save_every==0:
+                    self._save_meta(self.cube_dir,self.meta)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(_derive_file,ii):ii for ii in jobs}
+                for indx,future in enumerate(as_completed(futures)): # in the order they finish
+                    n_done += self._collect(futures[future],future.result)
+                    if (indx+1)%save_every==0:
+                        self._save_meta(self.cube_dir,self.meta)
+        self._save_meta(self.cube_dir,self.meta)
+        return n_done
+
+    def _collect(self,job,get_result):
+        # mark a finished file's diagnostics done (its slots are already on disk),
+        # or record why it failed; returns 1 if it was derived
+        try:
+            t_index,names = get_result()
+        except Exception as error:
+            self.failed[job[2]] = repr(error)
+            print('Failed to derive {0}: {1}'.format(job[2],error))
+            return 0
+        for ii in names:
+            self.meta['done'][ii][t_index] = True
+        return 1
+
+    def read(self,name,*key):
+        # a (time, ...) selection of one diagnostic, e.g. cube.read('Rn',slice(0,24),j,i);
+        # times whose file hasn't been derived (or failed) are NaN
+        cube = np.load(os.path.join(self.cube_dir,name+'.npy'),mmap_mode='r')
+        vals = np.array(cube[key] if len(key)>0 else cube)
+        missing = ~np.array(self.meta['done'][name],dtype=bool)[key[0] if len(key)>0 else slice(None)]
+        if np.ndim(missing)==0:
+            if missing:
+                vals[...] = np.nan
+        elif np.any(missing):
+            vals[missing] = np.nan
+        return vals
+
+if __name__ == '__main__':
+    import sys
+    from wrf_pipeline import find_wrf_files
+    wrf_folder = sys.argv[1] if len(sys.argv)>1 else './' # a WRF run folder (or folder of runs)
+    cube_dir = './wrf_derived/'
+    wrf_times,wrf_files = find_wrf_files(wrf_folder,'d03',spinup_hours=6)
+    t_start = time.time()
+    cube = DerivedCube(cube_dir) if os.path.isfile(os.path.join(cube_dir,DERIVED_JSON)) else \
+           DerivedCube.create(cube_dir,wrf_files,wrf_times,['Rn','WSPD10','RH2','Z'])
+    n_files = cube.compute()
+    print('derived {0:d} files in {1:2.2f} s ({2:d} failed)'.format(n_files,time.time()-t_start,len(cube.failed)))
+    for name in cube.meta['names']:
+        field = cube.read(name,0)
+        print('{0} [{1}] - {2}: {3}, {4:2.2f} to {5:2.2f}'.format(name,cube.meta['units'][name],cube.meta['descriptions'][name],
+                                                                np.shape(field),np.nanmin(field),np.nanmax(field)))
@@ -0,0 +1,91 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code extracts WRF values at many named sites (towers,
+# stations, city centers) from wrfout files, reading only the
+# hyperslabs it needs:
+#   - the grid cell of every site is resolved once per domain
+#     (d01/d02/d03), not once per file, from the domain's cached
+#     grid index (wrf_grid_index.py)
+#   - for each variable only the (time, level, j, i) columns at the
+#     sites are read - or one small window around all of them
+#     when the sites are close together - instead of the full
+#     3D/2D arrays
+# Results come back as one array per variable with the sites
+# along the first axis: (n_sites,) for 2D fields and
+# (n_sites, n_levels) for 3D fields
+#
+################################################################
+#
+#
+import numpy as np
+from netCDF4 import Dataset
+from wrf_grid_index import cached_grid_index,grid_hash
+
+########################################
+# site -> grid cell
+########################################
+#
+class WRFSites(object):
+    def __init__(self,sites):
+        # sites: {name: (lon, lat)}
+        self.names = list(sites)
+        self.lons = np.array([sites[ii][0] for ii in self.names],dtype=np.float64)
+        self.lats = np.array([sites[ii][1] for ii in self.names],dtype=np.float64)
+        self.cells = {} # grid hash -> (j, i)
+
+    def resolve(self,data):
+        # (j, i) arrays of the sites on this file's domain, looked up in the
+        # domain's grid index (wrf_grid_index.py) the first time it is seen
+        key = grid_hash(data)
+        if key not in self.cells:
+            _,j_s,i_s = cached_grid_index(data).nearest(self.lats,self.lons)
+            self.cells[key] = (j_s,i_s)
+        return self.cells[key]
+
+    #
+    # hyperslab reads
+    #
+    def _read_var(self,var,t_index,j_s,i_s,window_factor):
+        # values of one variable at the sites: (n_sites,) or (n_sites, n_levels)
+        dims = var.dimensions
+        vertical = len(dims)==4
+        j_0,j_1,i_0,i_1 = j_s.min(),j_s.max()+1,i_s.min(),i_s.max()+1
+        if (j_1-j_0)*(i_1-i_0)<=window_factor*len(j_s):
+            # sites are clustered: one small window read for all of them
+            window = var[t_index,:,j_0:j_1,i_0:i_1] if vertical else var[t_index,j_0:j_1,i_0:i_1]
+            window = np.ma.filled(np.ma.asarray(window,dtype=np.float32),np.nan)
+            vals = window[...,j_s-j_0,i_s-i_0]
+            return vals.T if vertical else vals
+        cols = [var[t_index,:,j,i] if vertical else var[t_index,j,i] for j,i in zip(j_s,i_s)]
+        return np.array([np.ma.filled(np.ma.asarray(ii,dtype=np.float32),np.nan) for ii in cols])
+
+    def extract(self,data,var_names,t_index=0,window_factor=16):
+        # {var name: values at the sites} for an open wrfout Dataset;
+        # staggered variables (U, V, PH, PHB...) are indexed at the site's
+        # (j, i) on their own grid, as in WRF_output_plotter.py
+        j_s,i_s = self.resolve(data)
+        extracted = {}
+        for name in var_names:
+            var = data.variables[name]
+            extracted[name] = self._read_var(var,t_index,j_s,i_s,window_factor)
+        return extracted
+
+def extract_file(wrf_file,sites,var_names,t_index=0):
+    # WRFSites.extract for a wrfout filename
+    with Dataset(wrf_file) as data:
+        return sites.extract(data,var_names,t_index)
+
+if __name__ == '__main__':
+    import os,sys,time
+    wrf_folder = sys.argv[1] if len(sys.argv)>1 else './' # folder with wrfout_d03_* files
+    wrf_files = sorted([os.path.join(wrf_folder,ii) for ii in os.listdir(wrf_folder) if ii.startswith('wrfout_d03')])
+    sites = WRFSites({'CCNY':(-73.949256,40.819156),'Central Park':(-73.9654,40.7829),'JFK':(-73.7781,40.6413)})
+    t_start = time.time()
+    for wrf_file in wrf_files:
+        site_vals = extract_file(wrf_file,sites,['T2','SWDOWN','U','PHB'])
+    print('{0:d} files, {1:d} sites in {2:2.2f} s'.format(len(wrf_files),len(sites.names),time.time()-t_start))
+    for ii,name in enumerate(sites.names):
+        print('{0}: T2 = {1:2.2f} K, U profile {2}'.format(name,site_vals['T2'][ii],np.round(site_vals['U'][ii],1)))
@@ -0,0 +1,188 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code builds a geolocation index for each WRF domain
+# (d01/d02/d03) from its XLAT/XLONG arrays, so site lookups
+# don't scan the whole grid for every wrfout file:
+#   - the grid is keyed by a hash of its shape, corner
+#     coordinates and projection attributes (a few small reads)
+#   - the first file of a domain builds the index (a KD-tree over
+#     the cell centers as unit vectors, as in asos_stations.py),
+#     which is saved to disk (next to this module by default) and
+#     reused by every later file/run
+#   - queries are vectorized: nearest cell, bilinear weights
+#     (inverse bilinear on the curvilinear grid) and the cells
+#     inside a polygon
+#
+################################################################
+#
+#
+import hashlib,json,os,sys
+import numpy as np
+from scipy.spatial import cKDTree
+from matplotlib.path import Path
+
+PROJ_ATTRS = ('MAP_PROJ','DX','DY','CEN_LAT','CEN_LON','TRUELAT1','TRUELAT2','STAND_LON') # WRF global attributes
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius
+GRID_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'wrf_grid_index') # same folder from any working directory
+
+########################################
+# unit-vector geometry
+########################################
+#
+# same as asos_stations.py, kept here so WRF/ doesn't depend on web_scraping/
+#
+def lonlat_to_xyz(lats,lons):
+    # degrees -> unit vectors on the sphere (..., 3)
+    lats,lons = np.radians(np.asarray(lats,dtype=np.float64)),np.radians(np.asarray(lons,dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.stack((cos_lat*np.cos(lons),cos_lat*np.sin(lons),np.sin(lats)),axis=-1)
+
+def chord_to_km(chord):
+    return 2.0*EARTH_RADIUS_KM*np.arcsin(np.clip(chord/2.0,0.0,1.0))
+
+#
+########################################
+# grid keys
+########################################
+#
+def domain_key(data):
+    # identifies a WRF domain grid (shape and corner coordinates)
+    lat_var,lon_var = data.variables['XLAT'],data.variables['XLONG']
+    n_y,n_x = lat_var.shape[-2:]
+    corners = [float(lat_var[0,0,0]),float(lon_var[0,0,0]),float(lat_var[0,n_y-1,n_x-1]),float(lon_var[0,n_y-1,n_x-1])]
+    return '{0:d}x{1:d}_'.format(n_y,n_x)+'_'.join(['{0:.5f}'.format(ii) for ii in corners])
+
+def grid_hash(data):
+    # domain key + projection attributes -> short hex key for the cache
+    attrs = {ii:float(getattr(data,ii)) for ii in PROJ_ATTRS if ii in data.ncattrs()}
+    sha = hashlib.sha1(json.dumps(attrs,sort_keys=True).encode())
+    sha.update(domain_key(data).encode())
+    return sha.hexdigest()[0:20]
+
+#
+########################################
+# grid index
+########################################
+#
+class WRFGridIndex(object):
+    def __init__(self,lat_wrf,lon_wrf):
+        # lat_wrf/lon_wrf: (south_north, west_east) cell centers
+        self.lat = np.asarray(lat_wrf,dtype=np.float64)
+        self.lon = np.asarray(lon_wrf,dtype=np.float64)
+        self.shape = np.shape(self.lat)
+        self.tree = cKDTree(lonlat_to_xyz(self.lat,self.lon).reshape(-1,3))
+
+    def nearest(self,lats,lons):
+        # closest cell to every point -> (distances [km], j, i), each np.shape(lats)
+        chord,indx = self.tree.query(lonlat_to_xyz(lats,lons).reshape(-1,3))
+        j,i = np.unravel_index(indx,self.shape)
+        return chord_to_km(chord).reshape(np.shape(lats)),j.reshape(np.shape(lats)),i.reshape(np.shape(lats))
+
+    def fractional(self,lats,lons,n_iter=4):
+        # fractional (j, i) grid position of every point, by Newton steps on the
+        # bilinear interpolation of the cell centers, started at the nearest cell.
+        # Positions outside the grid extrapolate past 0 / n-1
+        _,j,i = self.nearest(lats,lons)
+        lats,lons = np.asarray(lats,dtype=np.float64),np.asarray(lons,dtype=np.float64)
+        j_f,i_f = j.astype(np.float64),i.astype(np.float64)
+        n_y,n_x = self.shape
+        for _ in range(n_iter):
+            j_0 = np.clip(np.floor(j_f),0,n_y-2).astype(np.intp)
+            i_0 = np.clip(np.floor(i_f),0,n_x-2).astype(np.intp)
+            f_j,f_i = j_f-j_0,i_f-i_0
+            step = []
+            for grid,target in ((self.lat,lats),(self.lon,lons)):
+                c_00,c_01,c_10,c_11 = grid[j_0,i_0],grid[j_0,i_0+1],grid[j_0+1,i_0],grid[j_0+1,i_0+1]
+                val = (1-f_j)*((1-f_i)*c_00+f_i*c_01)+f_j*((1-f_i)*c_10+f_i*c_11)
+                d_i = (1-f_j)*(c_01-c_00)+f_j*(c_11-c_10)
+                d_j = (1-f_i)*(c_10-c_00)+f_i*(c_11-c_01)
+                step.append((target-val,d_j,d_i))
+            (r_a,a_j,a_i),(r_b,b_j,b_i) = step
+            det = a_j*b_i-a_i*b_j # 2x2 solve of the linearized lat/lon residuals
+            with np.errstate(invalid='ignore',divide='ignore'):
+                j_f = j_f+(r_a*b_i-a_i*r_b)/det
+                i_f = i_f+(a_j*r_b-r_a*b_j)/det
+        return j_f,i_f
+
+    def bilinear(self,lats,lons):
+        # bilinear interpolation corners and weights for every point:
+        # (j, i) indices (..., 4) and weights (..., 4), -1/0 outside the grid
+        j_f,i_f = self.fractional(lats,lons)
+        n_y,n_x = self.shape
+        good = np.isfinite(j_f) & np.isfinite(i_f) & (j_f>=0) & (j_f<=n_y-1) & (i_f>=0) & (i_f<=n_x-1)
+        j_0 = np.where(good,np.clip(np.floor(j_f),0,n_y-2),0).astype(np.intp)
+        i_0 = np.where(good,np.clip(np.floor(i_f),0,n_x-2),0).astype(np.intp)
+        f_j,f_i = np.where(good,j_f-j_0,0.0),np.where(good,i_f-i_0,0.0)
+        j_s = np.stack((j_0,j_0,j_0+1,j_0+1),axis=-1)
+        i_s = np.stack((i_0,i_0+1,i_0,i_0+1),axis=-1)
+        weights = np.stack(((1-f_j)*(1-f_i),(1-f_j)*f_i,f_j*(1-f_i),f_j*f_i),axis=-1)
+        j_s[~good],i_s[~good],weights[~good] = -1,-1,0.0
+        return j_s,i_s,weights.astype(np.float32)
+
+    def in_polygon(self,polygon):
+        # (j, i) of the cells whose centers are inside a polygon: an (n,2)
+        # lon/lat ring, or a list of parts [[exterior, hole...],...] as
+        # returned by goes_cities.read_city_polygons
+        parts = [[polygon]] if isinstance(polygon,np.ndarray) else polygon
+        rings = np.concatenate([np.asarray(ii[0]) for ii in parts])
+        near = (self.lon>=np.min(rings[:,0])) & (self.lon<=np.max(rings[:,0])) &\
+               (self.lat>=np.min(rings[:,1])) & (self.lat<=np.max(rings[:,1])) # bbox prefilter
+        j,i = np.nonzero(near)
+        points = np.column_stack((self.lon[j,i],self.lat[j,i]))
+        inside = np.zeros(len(points),dtype=bool)
+        for part in parts:
+            in_part = Path(part[0]).contains_points(points)
+            for hole in part[1:]:
+                in_part &= ~Path(hole).contains_points(points)
+            inside |= in_part
+        return j[inside],i[inside]
+
+    def save(self,index_file):
+        tmp_file = index_file+'.tmp-{}.npz'.format(os.getpid())
+        np.savez(tmp_file,lat=self.lat,lon=self.lon)
+        os.replace(tmp_file,index_file)
+
+    @classmethod
+    def load(cls,index_file):
+        with np.load(index_file) as saved:
+            return cls(saved['lat'],saved['lon'])
+
+_indexes = {} # grid hash -> WRFGridIndex, per process
+
+def cached_grid_index(data,cache_dir=GRID_INDEX_DIR):
+    # WRFGridIndex for an open wrfout Dataset's domain: from memory, then from
+    # the disk cache, and built from XLAT/XLONG the first time a grid is seen
+    key = grid_hash(data)
+    if key in _indexes:
+        return _indexes[key]
+    index_file = os.path.join(cache_dir,key+'.npz')
+    if os.path.isfile(index_file):
+        _indexes[key] = WRFGridIndex.load(index_file)
+        return _indexes[key]
+    index = WRFGridIndex(data.variables['XLAT'][0],data.variables['XLONG'][0])
+    if os.path.isdir(cache_dir)==False:
+        os.makedirs(cache_dir,exist_ok=True)
+    index.save(index_file)
+    _indexes[key] = index
+    return index
+
+if __name__ == '__main__':
+    import time
+    from netCDF4 import Dataset
+    wrf_file = sys.argv[1] if len(sys.argv)>1 else 'wrfout_d03_2019-06-01_00:00:00'
+    with Dataset(wrf_file) as data:
+        t_start = time.time()
+        index = cached_grid_index(data)
+        print('{0} grid index in {1:2.3f} s'.format(index.shape,time.time()-t_start))
+    lats,lons = np.random.uniform(40.6,40.9,10000),np.random.uniform(-74.1,-73.8,10000)
+    t_start = time.time()
+    dists,j,i = index.nearest(lats,lons)
+    t_near = time.time()-t_start
+    t_start = time.time()
+    j_s,i_s,weights = index.bilinear(lats,lons)
+    t_bilin = time.time()-t_start
+    print('10000 points: nearest {0:2.1f} us/point, bilinear {1:2.1f} us/point'.format(1e6*t_near/len(lats),1e6*t_bilin/len(lats)))
+    print('CCNY tower cell: {}'.format(index.nearest(np.array([40.819156]),np.array([-73.949256]))[1:]))
@@ -0,0 +1,164 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code builds time series from folders of WRF output
+# (wrfout_d0X_YYYY-mm-dd_HH:MM:SS files) with a process pool:
+#   - files are found per run folder and ordered by the valid
+#     time in their names; the spin-up hours at the start of each
+#     run are skipped by rule, and where runs overlap the file of
+#     the latest run is kept
+#   - every worker returns a compact result per file: values at
+#     the sites, vertical profiles at the sites and domain
+#     aggregates (mean, min, max) - never the full fields
+#   - results are written by time index into arrays allocated up
+#     front, with a progress/throughput report along the way
+# Diagnostics registered in wrf_derived.py (e.g. 'Rn', 'Z') can
+# be asked for like any wrfout variable
+#
+################################################################
+#
+#
+import datetime,os,time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from netCDF4 import Dataset
+from wrf_extract import WRFSites
+from wrf_derived import DERIVED,derive_fields
+
+########################################
+# finding files
+########################################
+#
+def wrf_file_time(wrf_file):
+    # valid time from a wrfout filename (wrfout_d03_2019-06-01_06:00:00)
+    return datetime.datetime.strptime(os.path.basename(wrf_file).split('_',2)[2],'%Y-%m-%d_%H:%M:%S')
+
+def find_run_files(run_folder,domain='d03',spinup_hours=6):
+    # (times, paths) of one run's files for a domain, in time order, without
+    # the files in the first spinup_hours of the run
+    names = [ii for ii in os.listdir(run_folder) if ii.startswith('wrfout_{}_'.format(domain))]
+    if len(names)==0:
+        return [],[]
+    times = [wrf_file_time(ii) for ii in names]
+    t_valid = min(times)+datetime.timedelta(hours=spinup_hours) # spin-up: run start + spinup_hours
+    kept = sorted([(t_file,os.path.join(run_folder,name)) for t_file,name in zip(times,names) if t_file>=t_valid])
+    return [ii[0] for ii in kept],[ii[1] for ii in kept]
+
+def find_wrf_files(wrf_dir,domain='d03',spinup_hours=6):
+    # (times, paths) over every run folder in wrf_dir (or wrf_dir itself);
+    # where runs overlap, the file from the latest run wins
+    run_folders = sorted([os.path.join(wrf_dir,ii) for ii in os.listdir(wrf_dir) if os.path.isdir(os.path.join(wrf_dir,ii))])
+    by_time = {}
+    for run_folder in (run_folders if len(run_folders)>0 else [wrf_dir]):
+        for t_file,path in zip(*find_run_files(run_folder,domain,spinup_hours)):
+            by_time[t_file] = path # later runs are sorted last
+    times = sorted(by_time)
+    return times,[by_time[ii] for ii in times]
+
+#
+########################################
+# per-file results
+########################################
+#
+class WRFPipeline(object):
+    def __init__(self,sites,site_vars=('T2','Rn'),profile_vars=('U','Z'),domain_vars=('T2','Rn')):
+        # sites: WRFSites or {name: (lon, lat)}; site_vars and domain_vars are
+        # 2D variables, profile_vars are 3D variables (wrfout variables or
+        # diagnostics in wrf_derived.DERIVED)
+        self.sites = sites if isinstance(sites,WRFSites) else WRFSites(sites)
+        self.site_vars,self.profile_vars,self.domain_vars = list(site_vars),list(profile_vars),list(domain_vars)
+
+    def _inputs(self,var_names):
+        # file variables needed for a list of output variables
+        inputs = []
+        for name in var_names:
+            for ii in (DERIVED[name].inputs if name in DERIVED else [name]):
+                if ii not in inputs:
+                    inputs.append(ii)
+        return inputs
+
+    def process_file(self,wrf_file):
+        # compact result of one file: ({var: (n_sites,)}, {var: (n_sites, n_levels)},
+        # {var: [mean, min, max]})
+        with Dataset(wrf_file) as data:
+            at_sites = self.sites.extract(data,self._inputs(self.site_vars+self.profile_vars))
+            site_vals = {ii:(DERIVED[ii].evaluate(at_sites) if ii in DERIVED else at_sites[ii]) for ii in self.site_vars}
+            profiles = {}
+            for ii in self.profile_vars: # levels first for the kernels, sites first in the output
+                profiles[ii] = DERIVED[ii].evaluate({jj:at_sites[jj].T for jj in DERIVED[ii].inputs}).T \
+                               if ii in DERIVED else at_sites[ii]
+            derived = derive_fields(data,[ii for ii in self.domain_vars if ii in DERIVED]) # chunked, float32
+            domain = {}
+            for ii in self.domain_vars:
+                field = derived[ii] if ii in DERIVED else np.ma.filled(np.ma.asarray(data.variables[ii][0],dtype=np.float32),np.nan)
+                domain[ii] = [np.nanmean(field),np.nanmin(field),np.nanmax(field)]
+        return site_vals,profiles,domain
+
+    #
+    # all files
+    #
+    def _allocate(self,wrf_file,n_files):
+        # output arrays, sized from the first file's levels
+        n_sites = len(self.sites.names)
+        with Dataset(wrf_file) as data:
+            n_levels = {ii:(DERIVED[ii].shape(data.variables[DERIVED[ii].inputs[0]].shape[1:])[0] if ii in DERIVED
+                            else data.variables[ii].shape[1]) for ii in self.profile_vars}
+        return {'sites':{ii:np.full((n_files,n_sites),np.nan,dtype=np.float32) for ii in self.site_vars},
+                'profiles':{ii:np.full((n_files,n_sites,n_levels[ii]),np.nan,dtype=np.float32) for ii in self.profile_vars},
+                'domain':{ii:np.full((n_files,3),np.nan,dtype=np.float32) for ii in self.domain_vars}}
+
+    def run(self,wrf_files,times=None,n_workers=None,chunksize=4,report_every=100):
+        # time series over wrf_files: dict with times (N,) datetime64[s], files,
+        # sites {var: (N, n_sites)}, profiles {var: (N, n_sites, n_levels)},
+        # domain {var: (N, 3) [mean, min, max]} and timing stats
+        if len(wrf_files)==0:
+            raise ValueError('No WRF files to process (are they all within the spin-up hours?)')
+        times = [wrf_file_time(ii) for ii in wrf_files] if times is None else times
+        order = np.argsort(np.array(times,dtype='datetime64[s]'),kind='stable')
+        wrf_files = [wrf_files[ii] for ii in order]
+        series = self._allocate(wrf_files[0],len(wrf_files))
+        series['times'] = np.array(times,dtype='datetime64[s]')[order]
+        series['files'] = wrf_files
+        t_start = time.time()
+        if n_workers is not None and n_workers<=1:
+            self._collect(series,map(self.process_file,wrf_files),t_start,report_every)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers,initializer=_init_worker,initargs=(self,)) as executor:
+                self._collect(series,executor.map(_process_file,wrf_files,chunksize=chunksize),t_start,report_every)
+        t_total = time.time()-t_start
+        series['stats'] = {'files':len(wrf_files),'seconds':t_total,'files_per_s':len(wrf_files)/t_total if t_total>0 else 0.0}
+        print('{0:d} files in {1:2.1f} s ({2:2.1f} files/s)'.format(len(wrf_files),t_total,series['stats']['files_per_s']))
+        return series
+
+    def _collect(self,series,results,t_start,report_every):
+        # write per-file results (in file order) into the series, reporting progress
+        n_files = len(series['files'])
+        for indx,(site_vals,profiles,domain) in enumerate(results):
+            for key,result in (('sites',site_vals),('profiles',profiles),('domain',domain)):
+                for ii in result:
+                    series[key][ii][indx] = result[ii]
+            if (indx+1)%report_every==0 and indx+1<n_files:
+                t_elapsed = time.time()-t_start
+                print('{0:d}/{1:d} files, {2:2.1f} files/s, {3:2.0f} s left'.\
+                      format(indx+1,n_files,(indx+1)/t_elapsed,t_elapsed*(n_files/(indx+1)-1)))
+
+_worker = {} # per-process pipeline (its sites keep their grid cells between files)
+
+def _init_worker(pipeline):
+    _worker['pipeline'] = pipeline
+
+def _process_file(wrf_file):
+    return _worker['pipeline'].process_file(wrf_file)
+
+if __name__ == '__main__':
+    import sys
+    wrf_dir = sys.argv[1] if len(sys.argv)>1 else './' # folder of WRF run folders
+    wrf_times,wrf_files = find_wrf_files(wrf_dir,'d03',spinup_hours=6)
+    pipeline = WRFPipeline({'CCNY':(-73.949256,40.819156),'Central Park':(-73.9654,40.7829)})
+    series = pipeline.run(wrf_files,wrf_times)
+    for ii,name in enumerate(pipeline.sites.names):
+        print('{0}: mean T2 {1:2.2f} K, max Rn {2:2.1f} W/m^2'.\
+              format(name,np.nanmean(series['sites']['T2'][:,ii]),np.nanmax(series['sites']['Rn'][:,ii])))
+    print('domain mean T2 from {0:2.2f} to {1:2.2f} K'.format(np.min(series['domain']['T2'][:,0]),np.max(series['domain']['T2'][:,0])))
@@ -0,0 +1,197 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code renders animation frames of GOES scans (or WRF
+# fields) in batches, headless (Agg). Instead of rebuilding the
+# figure, the cartopy axes and the NaturalEarth features for
+# every frame, each worker process:
+#   - sets the map up once, and keeps the static layers (land,
+#     colorbar) as a saved background
+#   - per frame, only swaps the image data and the title, and
+#     redraws the image, coastlines/states and title over the
+#     background
+# Frames are spread across a process pool, and are either saved
+# as a PNG sequence or piped (in order) to an encoder such as
+# ffmpeg. The frames-per-second is reported at the end
+#
+################################################################
+#
+#
+import os,subprocess,time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.image as mpimg
+
+########################################
+# frame sources
+########################################
+#
+# a frame source is a picklable callable: spec -> (2D grid, extent, title),
+# with the grid on a regular lon/lat extent [lon_min, lon_max, lat_min, lat_max]
+#
+class GOESFrames(object):
+    # GOES files -> regridded scans (goes_regrid.py), tables are loaded once per worker
+    def __init__(self,bbox,res=0.02,var_name='LST',quality=None,method='nearest'):
+        self.bbox,self.res,self.var_name = bbox,res,var_name
+        self.quality,self.method = quality,method
+        self.regridder = None
+
+    def __call__(self,source):
+        from netCDF4 import Dataset
+        from goes_packed import read_packed
+        from goes_regrid import cached_regridder
+        if self.regridder is None:
+            with Dataset(source) as netcdf_file:
+                self.regridder = cached_regridder(netcdf_file,self.bbox,self.res,self.method)
+        field = read_packed(source,self.var_name)
+        with Dataset(source) as netcdf_file:
+            t_0 = netcdf_file.time_coverage_start
+        title = '{0} on {1} {2}'.format(field.long_name,t_0.split('T')[0],t_0.split('T')[1][0:8])
+        return self.regridder.regrid(field,self.quality),self.regridder.extent,title
+
+class WRFFrames(object):
+    # WRF output files -> a 2D field (e.g. T2), on the lon/lat extent of
+    # the domain (the d03 Lambert grid is close to regular in lon/lat)
+    def __init__(self,var_name='T2',level=None):
+        self.var_name,self.level = var_name,level
+
+    def __call__(self,wrf_file):
+        from netCDF4 import Dataset
+        with Dataset(wrf_file) as data:
+            var = data.variables[self.var_name]
+            field = var[0] if self.level is None else var[0,self.level]
+            lons,lats = data.variables['XLONG'][0],data.variables['XLAT'][0]
+            extent = [float(np.min(lons)),float(np.max(lons)),float(np.min(lats)),float(np.max(lats))]
+            title = '{0} [{1}] at {2}'.format(getattr(var,'description',self.var_name),getattr(var,'units',''),
+                                              os.path.basename(wrf_file).split('_',2)[-1])
+        return np.ma.filled(np.ma.asarray(field,dtype=np.float32)[::-1],np.nan),extent,title # north up
+
+#
+########################################
+# renderer (one per worker)
+########################################
+#
+class FrameRenderer(object):
+    def __init__(self,bbox,cmap='inferno',vmin=None,vmax=None,label='',figsize=(14,8),dpi=100,basemap=True):
+        self.bbox,self.cmap,self.vmin,self.vmax = bbox,cmap,vmin,vmax
+        self.label,self.figsize,self.dpi,self.basemap = label,figsize,dpi,basemap
+        self.fig = None
+
+    def setup(self,grid,extent):
+        # figure, map axes, features and colorbar - done once. Without
+        # vmin/vmax the color range comes from the first frame (set them
+        # for animations, so every worker uses the same range)
+        vmin = np.nanpercentile(grid,2) if self.vmin is None else self.vmin
+        vmax = np.nanpercentile(grid,98) if self.vmax is None else self.vmax
+        self.fig = plt.figure(figsize=self.figsize,dpi=self.dpi)
+        self.overlays = []
+        if self.basemap:
+            import cartopy.crs as ccrs
+            import cartopy.feature as cfeature
+            self.ax = self.fig.add_subplot(1,1,1,projection=ccrs.PlateCarree())
+            self.ax.set_extent([self.bbox[0],self.bbox[2],self.bbox[1],self.bbox[3]],crs=ccrs.PlateCarree())
+            self.ax.add_feature(cfeature.LAND,facecolor='#ECECEC',zorder=0)
+            states_provinces = cfeature.NaturalEarthFeature(category='cultural',name='admin_1_states_provinces_lines',
+                                                            scale='10m',facecolor='None')
+            self.overlays.append(self.ax.add_feature(cfeature.COASTLINE,zorder=2))
+            self.overlays.append(self.ax.add_feature(states_provinces,edgecolor='k',zorder=2))
+            transform = {'transform':ccrs.PlateCarree()}
+        else:
+            self.ax = self.fig.add_subplot(1,1,1)
+            transform = {}
+        self.ax.set_axis_off()
+        self.image = self.ax.imshow(np.full((2,2),np.nan,dtype=np.float32),extent=extent,origin='upper',
+                                    cmap=self.cmap,vmin=vmin,vmax=vmax,interpolation='nearest',
+                                    zorder=1,**transform)
+        if self.basemap==False:
+            # after imshow, so its autoscaling doesn't replace the bbox (and stays off for set_extent)
+            self.ax.set_xlim(self.bbox[0],self.bbox[2])
+            self.ax.set_ylim(self.bbox[1],self.bbox[3])
+        cbar = self.fig.colorbar(self.image,fraction=0.025,pad=0.04)
+        cbar.ax.set_ylabel(self.label,fontsize=16)
+        self.title = self.ax.set_title(' ',fontsize=16) # blank, so it is placed but leaves no trace
+        # static background: everything except the image, overlays and title
+        for artist in [self.image]+self.overlays:
+            artist.set_visible(False)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in [self.image,self.title]+self.overlays:
+            artist.set_visible(True)
+            artist.set_animated(True) # only drawn explicitly, in render()
+
+    def render(self,grid,extent,title):
+        # RGBA (h, w, 4) uint8 of one frame
+        if self.fig is None:
+            self.setup(grid,extent)
+        self.image.set_data(grid)
+        self.image.set_extent(extent)
+        self.title.set_text(title)
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+        self.ax.draw_artist(self.title)
+        return np.asarray(canvas.buffer_rgba()).copy()
+
+#
+########################################
+# batch rendering
+########################################
+#
+_worker = {} # per-process renderer and frame source
+
+def _init_worker(renderer,frame_source):
+    _worker['renderer'],_worker['source'] = renderer,frame_source
+
+def _render_frame(args):
+    # render one frame; write it as a PNG when png_file is given, and return
+    # the RGBA only when asked for (e.g. to feed an encoder), else png_file
+    spec,png_file,want_rgba = args
+    grid,extent,title = _worker['source'](spec)
+    rgba = _worker['renderer'].render(grid,extent,title)
+    if png_file is not None:
+        mpimg.imsave(png_file,rgba)
+    return rgba if want_rgba else png_file # frames nobody uses aren't sent back
+
+def render_frames(specs,frame_source,renderer,out_dir=None,encoder_cmd=None,n_workers=None,chunksize=4):
+    # render every spec (e.g. GOES files) with a process pool, to
+    # out_dir/frame_00000.png... and/or, with encoder_cmd, piped as raw RGBA
+    # frames in order, e.g. for ffmpeg:
+    #   ['ffmpeg','-y','-f','rawvideo','-pix_fmt','rgba','-s','{w}x{h}','-r','10','-i','-','out.mp4']
+    # ({w}/{h} are filled in from the first frame). Returns timing stats
+    if out_dir is not None and os.path.isdir(out_dir)==False:
+        os.makedirs(out_dir)
+    png_files = [None]*len(specs) if out_dir is None else \
+                [os.path.join(out_dir,'frame_{0:05d}.png'.format(ii)) for ii in range(len(specs))]
+    jobs = [(spec,png_file,encoder_cmd is not None) for spec,png_file in zip(specs,png_files)]
+    t_start = time.time()
+    encoder = None
+    with ProcessPoolExecutor(max_workers=n_workers,initializer=_init_worker,
+                             initargs=(renderer,frame_source)) as executor:
+        for result in executor.map(_render_frame,jobs,chunksize=chunksize):
+            if encoder_cmd is not None:
+                if encoder is None:
+                    h,w = np.shape(result)[0:2]
+                    encoder = subprocess.Popen([ii.format(w=w,h=h) for ii in encoder_cmd],stdin=subprocess.PIPE)
+                encoder.stdin.write(result.tobytes())
+    if encoder is not None:
+        encoder.stdin.close()
+        encoder.wait()
+    t_total = time.time()-t_start
+    stats = {'frames':len(specs),'seconds':t_total,'fps':len(specs)/t_total if t_total>0 else 0.0}
+    print('rendered {0:d} frames in {1:2.1f} s ({2:2.2f} frames/s)'.format(stats['frames'],t_total,stats['fps']))
+    return stats
+
+if __name__ == '__main__':
+    sat_folder = './' # local GOES cache folder (ABI-L2-LSTC...nc files)
+    sat_files = sorted([os.path.join(sat_folder,ii) for ii in os.listdir(sat_folder)
+                        if ii.startswith('ABI-L2-LSTC') and ii.endswith('.nc')])
+    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
+    renderer = FrameRenderer(bbox,vmin=270.0,vmax=330.0,label='LST [K]')
+    render_frames(sat_files,GOESFrames(bbox),renderer,out_dir='./LST_frames/')
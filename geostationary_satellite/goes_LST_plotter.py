@@ -17,36 +17,26 @@ import cartopy.crs as ccrs
 import matplotlib.ticker as mticker
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 import cartopy.feature as cfeature
-import pyproj,datetime
+import datetime
+from goes_regrid import cached_regridder
+from goes_packed import read_packed
 #
 ###########################
 # introductory GOES codes
 ###########################
 #
 
-def lat_lon_reproj(netcdf_file):
+def lat_lon_regrid(netcdf_file,bbox,res=0.02):
     # list all netCDF variables in the GOES file
     print('Data Indices:')
     for ii,dats in enumerate(netcdf_file.variables): # list all variables from the sat file
         print('{0:1d} - {1}'.format(ii,dats))
 
-    h = netcdf_file.variables['goes_imager_projection'].perspective_point_height # height of satellite
-    r_eq = netcdf_file.variables['goes_imager_projection'].semi_major_axis # equator radius
-    r_pol = netcdf_file.variables['goes_imager_projection'].semi_minor_axis # polar radius
-    lambda_0 = netcdf_file.variables['goes_imager_projection'].longitude_of_projection_origin # longitude point of sat
-    lat_0 =  netcdf_file.variables['goes_imager_projection'].latitude_of_projection_origin # latitude point of sat
-
-    goes_proj = pyproj.Proj('+proj=geos +h={0:08.1f} +a= {1:08.1f} +b= {2:08.1f}'.format(h,r_eq,r_pol)+\
-                            ' +lon_0={0:08.1f} +lat_0={1:08.1f} +units=m sweep=x +no_defs'.format(lambda_0,lat_0)) # GOES projection
-    lonlat_proj = pyproj.Proj("EPSG:4326") # to lat/lon
-    xs = h*netcdf_file.variables['x'][:] # x-vals from GOES
-    ys = h*netcdf_file.variables['y'][:] # y-vals from GOES
-    rows,cols = np.meshgrid(xs,ys) # mesh for x/y vals
-    tfmr = pyproj.transformer.Transformer.from_proj(goes_proj,lonlat_proj) # the projection from GOES -> lat/lon
-    lats,lons = tfmr.transform(rows,cols) # lat/lon values from projection
-    lons[lons==np.inf] = 0.0 # must remove infinite values for plotting, otherwise an error is raised
-    lats[lats==np.inf] = 0.0 # must remove infinite values for plotting, otherwise an error is raised
-    return lons,lats
+    # table from the fixed grid to a regular lat/lon grid over the bbox (res in degrees),
+    # computed once per grid/bbox and then loaded from the local cache - each scan is
+    # regridded with one gather and drawn with imshow (no pcolormesh, no fake (0,0) cells)
+    regridder = cached_regridder(netcdf_file,bbox,res,method='nearest')
+    return regridder
 #
 ###########################
 # Grabbing actual data
@@ -56,7 +46,10 @@ def data_grabber(netcdf_file):
     print('Data Variable: {0} [{1}] ({2})'.format(goes_vars[data_indx],
                                                   netcdf_file.variables[goes_vars[data_indx]].units,
                                                   netcdf_file.variables[goes_vars[data_indx]].long_name)) # print info
-    data = (netcdf_file.variables[goes_vars[data_indx]])[:] # this grabs the data, which is a masked array
+    # the data is kept packed (int16 + DQF) and decoded to float32 only here,
+    # pass quality= (DQF bits or flag meanings) to drop flagged pixels
+    field = read_packed(netcdf_file.filepath(),goes_vars[data_indx])
+    data = np.ma.masked_invalid(field.decode(quality=None)) # masked array, as netCDF4 would return
     return data
 
 #
@@ -86,7 +79,8 @@ def geo_plotter():
     # gl.xformatter = LONGITUDE_FORMATTER
     # gl.yformatter = LATITUDE_FORMATTER
     ax.set_axis_off() # turn off the frame
-    p1 = ax.pcolormesh(lons,lats,data,transform=ccrs.PlateCarree()) # PLOT DATA - this plots the data with colormap
+    p1 = ax.imshow(regridder.regrid(data),extent=regridder.extent,origin='upper',
+                   transform=ccrs.PlateCarree(),interpolation='nearest') # PLOT DATA - this plots the data with colormap
     cbar = fig.colorbar(p1,fraction=0.025, pad=0.04)
     cbar.ax.set_ylabel('{0} [{1}]'.format(goes_vars[data_indx],
                                           netcdf_file.variables[goes_vars[data_indx]].units),fontsize=16)
@@ -103,9 +97,9 @@ if __name__ == '__main__':
     # below is the local GOES file in netcdf format
     sat_file = 'ABI-L2-LSTC_2020_153_17_OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc'
     netcdf_file = Dataset(sat_file) # read netCDF file from GOES satellite
-    lons,lats = lat_lon_reproj(netcdf_file) # get longitude/latitude from netcdf
+    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
+    regridder = lat_lon_regrid(netcdf_file,bbox) # fixed grid -> regular lat/lon grid over the bbox
     data_indx = 0 # select variable based on printed-out index (first index, 0, is usually the data)
     goes_vars = [ii for ii in netcdf_file.variables] # get variables from netcdf file
     data = data_grabber(netcdf_file) # grab the data
-    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
     geo_plotter() # plot the data
@@ -0,0 +1,195 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code computes GOES-16/17 statistics per city (LST mean,
+# std, min, max and valid-pixel counts for each of the 500 cities
+# in CityBoundaries_correct_CRS) for every scan, without any
+# point-in-polygon tests per scan.
+#
+# Once per fixed grid, every city polygon is mapped to the pixels
+# it covers: the polygon's bbox is turned into a window of the
+# fixed grid by inverse navigation, and the window's pixel centers
+# (or sub-pixel samples, for area weights) are navigated and
+# tested against the polygon. The result is a sparse CSR matrix
+# (cities x pixels) of covered fractions, cached to disk. Per-scan
+# stats are then a sparse mat-vec over the packed data (decoded
+# only at the covered pixels), plus a grouped min/max
+#
+################################################################
+#
+#
+import json,os,time
+import numpy as np
+import scipy.sparse
+from matplotlib.path import Path
+from goes_navigation import lonlat_to_scan,grid_to_lonlat,projection_from_attrs
+from goes_geolocation import projection_attrs,scan_angles,grid_key
+
+CITY_SHAPEFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','rasters_and_shapefiles',
+                              '500cities_shapefiles','CityBoundaries_correct_CRS.shp')
+CITIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'goes_cities') # same folder from any working directory
+
+########################################
+# city polygons
+########################################
+#
+def read_city_polygons(shapefile_loc=CITY_SHAPEFILE,name_field='NAME'):
+    # (names, polygons), with each polygon a list of parts and each part
+    # a list of rings [exterior, hole, hole...] as (n,2) lon/lat arrays
+    import cartopy.io.shapereader as shpreader
+    names,polygons = [],[]
+    for record in shpreader.Reader(shapefile_loc).records():
+        geom = record.geometry
+        parts = list(geom.geoms) if hasattr(geom,'geoms') else [geom] # MultiPolygon or Polygon
+        polygons.append([[np.asarray(part.exterior.coords)]+[np.asarray(ii.coords) for ii in part.interiors]
+                         for part in parts])
+        names.append(record.attributes[name_field])
+    return names,polygons
+
+def _inside(polygon,lons,lats):
+    # points inside any part of the polygon (and outside that part's holes)
+    points = np.column_stack((np.ravel(lons),np.ravel(lats)))
+    inside = np.zeros(len(points),dtype=bool)
+    for rings in polygon:
+        in_part = Path(rings[0]).contains_points(points)
+        for hole in rings[1:]:
+            in_part &= ~Path(hole).contains_points(points)
+        inside |= in_part
+    return inside.reshape(np.shape(lons))
+
+#
+########################################
+# city x pixel matrix
+########################################
+#
+def _window(proj,xs,ys,polygon,pad=1):
+    # row/col slices of the fixed grid around the polygon's bbox
+    rings = np.concatenate([ii[0] for ii in polygon])
+    lon_s = np.linspace(np.min(rings[:,0]),np.max(rings[:,0]),16)
+    lat_s = np.linspace(np.min(rings[:,1]),np.max(rings[:,1]),16)
+    x_s,y_s = lonlat_to_scan(proj,*np.meshgrid(lon_s,lat_s))
+    if not np.any(np.isfinite(x_s)):
+        return None
+    dx,dy = (xs[-1]-xs[0])/(len(xs)-1),(ys[-1]-ys[0])/(len(ys)-1)
+    cols = (np.array([np.nanmin(x_s),np.nanmax(x_s)])-xs[0])/dx
+    rows = (np.array([np.nanmin(y_s),np.nanmax(y_s)])-ys[0])/dy
+    c_0,c_1 = int(max(np.floor(np.min(cols))-pad,0)),int(min(np.ceil(np.max(cols))+pad+1,len(xs)))
+    r_0,r_1 = int(max(np.floor(np.min(rows))-pad,0)),int(min(np.ceil(np.max(rows))+pad+1,len(ys)))
+    if c_1<=c_0 or r_1<=r_0:
+        return None # outside of the file's sector
+    return slice(r_0,r_1),slice(c_0,c_1)
+
+def city_pixel_matrix(proj,xs,ys,polygons,subsample=1):
+    # CSR matrix (n_cities, ny*nx) of the fraction of each pixel inside each
+    # city: subsample=1 tests pixel centers (0/1), subsample=s tests s x s
+    # samples per pixel, which gives area weights along the boundaries
+    xs,ys = np.asarray(xs,dtype=np.float64),np.asarray(ys,dtype=np.float64)
+    dx,dy = (xs[-1]-xs[0])/(len(xs)-1),(ys[-1]-ys[0])/(len(ys)-1)
+    offsets = ((np.arange(subsample)+0.5)/subsample-0.5)
+    rows_all,cols_all,vals_all = [],[],[]
+    for city,polygon in enumerate(polygons):
+        window = _window(proj,xs,ys,polygon)
+        if window is None:
+            continue
+        row_sl,col_sl = window
+        x_sub = (xs[col_sl][:,None]+offsets[None,:]*dx).ravel() # samples within each pixel
+        y_sub = (ys[row_sl][:,None]+offsets[None,:]*dy).ravel()
+        lons,lats = grid_to_lonlat(proj,x_sub,y_sub,dtype=np.float64)
+        inside = _inside(polygon,lons,lats) & np.isfinite(lons)
+        n_r,n_c = row_sl.stop-row_sl.start,col_sl.stop-col_sl.start
+        frac = inside.reshape(n_r,subsample,n_c,subsample).mean(axis=(1,3))
+        r_i,c_i = np.nonzero(frac)
+        rows_all.append(np.full(len(r_i),city))
+        cols_all.append((r_i+row_sl.start)*len(xs)+c_i+col_sl.start)
+        vals_all.append(frac[r_i,c_i].astype(np.float32))
+    cat = lambda arrs,dtype:np.concatenate(arrs).astype(dtype) if len(arrs)>0 else np.zeros(0,dtype=dtype)
+    return scipy.sparse.csr_matrix((cat(vals_all,np.float32),(cat(rows_all,np.int64),cat(cols_all,np.int64))),
+                                   shape=(len(polygons),len(ys)*len(xs)))
+
+def cached_city_matrix(netcdf_file,shapefile_loc=CITY_SHAPEFILE,subsample=1,cache_dir=CITIES_DIR):
+    # (names, CityPixels) for the file's fixed grid, from the cache when possible
+    proj_attrs = projection_attrs(netcdf_file)
+    xs,ys = scan_angles(netcdf_file)
+    stat = os.stat(shapefile_loc)
+    key = '{0}_{1}_{2:d}_{3:d}_s{4:d}'.format(grid_key(proj_attrs,xs,ys),os.path.basename(shapefile_loc).split('.')[0],
+                                               stat.st_size,int(stat.st_mtime),subsample)
+    matrix_file,names_file = os.path.join(cache_dir,key+'.npz'),os.path.join(cache_dir,key+'.json')
+    if os.path.isfile(matrix_file) and os.path.isfile(names_file):
+        with open(names_file,'r') as json_file:
+            names = json.load(json_file)
+        return names,CityPixels(scipy.sparse.load_npz(matrix_file))
+    names,polygons = read_city_polygons(shapefile_loc)
+    matrix = city_pixel_matrix(projection_from_attrs(proj_attrs),xs,ys,polygons,subsample)
+    if os.path.isdir(cache_dir)==False:
+        os.makedirs(cache_dir,exist_ok=True)
+    scipy.sparse.save_npz(matrix_file+'.tmp.npz',matrix)
+    os.replace(matrix_file+'.tmp.npz',matrix_file)
+    with open(names_file,'w') as json_file:
+        json.dump(names,json_file)
+    return names,CityPixels(matrix)
+
+#
+########################################
+# per-scan city stats
+########################################
+#
+class CityPixels(object):
+    def __init__(self,matrix):
+        # keep only the pixels any city touches, so a scan is decoded there only
+        self.matrix = matrix.tocsr()
+        self.pixels = np.unique(self.matrix.indices) # flat indices into the fixed grid
+        self.sub = scipy.sparse.csr_matrix((self.matrix.data,np.searchsorted(self.pixels,self.matrix.indices),
+                                            self.matrix.indptr),shape=(self.matrix.shape[0],len(self.pixels)))
+        self.ones = self.sub.copy()
+        self.ones.data[:] = 1.0
+        self.n_pixels = np.diff(self.matrix.indptr)
+
+    def values(self,data,quality=None):
+        # scan values at the covered pixels (float64, NaN where missing) from a
+        # PackedField (decoded only there) or a (masked) array
+        if hasattr(data,'raw'):
+            raw = data.raw.ravel()[self.pixels]
+            vals = raw*data.scale+data.offset
+            vals[~data.quality_mask(quality=quality).ravel()[self.pixels]] = np.nan
+            return vals
+        return np.ma.filled(np.ma.asarray(data,dtype=np.float64).ravel()[self.pixels],np.nan)
+
+    def stats(self,data,quality=None):
+        # per-city mean, std, min, max (area weighted where the matrix is),
+        # number of valid pixels and valid fraction of the city's pixels
+        vals = self.values(data,quality)
+        valid = np.isfinite(vals)
+        v_0 = np.where(valid,vals,0.0)
+        w_sum = self.sub@valid.astype(np.float64)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = (self.sub@v_0)/w_sum
+            std = np.sqrt(np.maximum((self.sub@(v_0*v_0))/w_sum-mean*mean,0.0))
+        n_valid = (self.ones@valid.astype(np.float64)).astype(np.int64)
+        # grouped min/max over each city's pixels (CSR rows are contiguous)
+        per_entry = vals[np.searchsorted(self.pixels,self.matrix.indices)]
+        v_min,v_max = np.full(self.matrix.shape[0],np.nan),np.full(self.matrix.shape[0],np.nan)
+        has = np.flatnonzero(self.n_pixels>0)
+        if len(has)>0:
+            starts = self.matrix.indptr[has]
+            with np.errstate(invalid='ignore'):
+                v_min[has] = np.fmin.reduceat(per_entry,starts)
+                v_max[has] = np.fmax.reduceat(per_entry,starts)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            valid_frac = n_valid/self.n_pixels
+        return {'mean':mean,'std':std,'min':v_min,'max':v_max,'n_valid':n_valid,'valid_frac':valid_frac}
+
+if __name__ == '__main__':
+    from netCDF4 import Dataset
+    from goes_packed import read_packed
+    sat_file = 'ABI-L2-LSTC_2020_153_17_OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc'
+    t_start = time.time()
+    names,cities = cached_city_matrix(Dataset(sat_file),subsample=4)
+    print('{0:d} cities -> {1:d} pixels in {2:2.1f} s'.format(len(names),len(cities.pixels),time.time()-t_start))
+    t_start = time.time()
+    city_lst = cities.stats(read_packed(sat_file),quality=['valid_clear_conditions_qf'])
+    print('per-scan stats in {0:2.4f} s'.format(time.time()-t_start))
+    for ii in np.argsort(-np.nan_to_num(city_lst['mean'],nan=-1.0))[0:10]:
+        print('{0}: mean LST {1:2.2f} K (max {2:2.2f} K), {3:d} clear pixels'.\
+              format(names[ii],city_lst['mean'][ii],city_lst['max'][ii],city_lst['n_valid'][ii]))
@@ -0,0 +1,271 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code builds temporal composites of GOES-16/17 scans (daily
+# max LST, mean LST at a given hour over a month, clear-sky
+# counts, percentiles) without stacking the scans. Every scan is
+# decoded from its packed form (goes_packed.py), masked by its DQF
+# and folded into per-pixel accumulators:
+#   - count, sum, min and max
+#   - a small t-digest style sketch for percentiles: each pixel
+#     keeps a fixed number of sorted centroids (mean, weight), and
+#     when a value arrives the two neighbouring centroids that are
+#     cheapest to merge (weighted by q*(1-q), so the tails stay
+#     sharp) are merged into one; the update runs over blocks of
+#     pixels with preallocated scratch arrays, so a full scan
+#     never builds (pixels x centroids) temporaries
+# Partitions of the files can be composited in parallel processes
+# and merged at the end
+#
+################################################################
+#
+#
+import datetime,os,time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+from goes_packed import read_packed
+from goes_points import scan_time
+
+SKETCH_BLOCK = 65536 # pixels per block of the sketch update (bounds its scratch memory)
+
+########################################
+# per-pixel centroid sketch
+########################################
+#
+def _merge_cheapest(means,weights):
+    # merge the cheapest adjacent pair in every row of (n, k+1) centroids -> (n, k)
+    n_pix,n_cent = np.shape(means)
+    total = np.sum(weights,axis=1,keepdims=True)
+    cum = np.cumsum(weights,axis=1)
+    pair_w = weights[:,:-1]+weights[:,1:]
+    q_mid = (cum[:,:-1]-weights[:,:-1]/2.0+weights[:,1:]/2.0)/np.maximum(total,1.0)
+    cost = pair_w/(q_mid*(1.0-q_mid)+1e-3)
+    cost[(weights[:,:-1]==0) | (weights[:,1:]==0)] = -1.0 # empty slots are dropped first
+    pick = np.argmin(cost,axis=1)
+    rows = np.arange(n_pix)
+    w_a,w_b = weights[rows,pick],weights[rows,pick+1]
+    m_a,m_b = means[rows,pick],means[rows,pick+1]
+    with np.errstate(invalid='ignore'):
+        merged = np.where(w_b==0,m_a,np.where(w_a==0,m_b,(w_a*m_a+w_b*m_b)/np.maximum(w_a+w_b,1.0)))
+    keep = np.ones((n_pix,n_cent),dtype=bool)
+    keep[rows,pick+1] = False # the pair collapses onto its first slot
+    means[rows,pick],weights[rows,pick] = merged,w_a+w_b
+    return means[keep].reshape(n_pix,n_cent-1),weights[keep].reshape(n_pix,n_cent-1)
+
+def _insert_merge(means,weights,vals,scratch):
+    # insert one value per row of (n, k) sorted centroids and merge the cheapest
+    # adjacent pair, in place, back to (n, k) - using only the preallocated
+    # (>=n, k+1) scratch arrays instead of (n, k+1) temporaries
+    n_pix,n_cent = np.shape(means)
+    m,w,cum,cost,mask = [scratch[ii][0:n_pix] for ii in ('means','weights','cum','cost','mask')]
+    rows = np.arange(n_pix)
+    slot = np.arange(n_cent+1)
+    # insert: centroids above the value move one slot right (empty slots hold +inf, so stay last)
+    np.less(means,vals[:,None],out=mask[:,0:n_cent])
+    pos = np.count_nonzero(mask[:,0:n_cent],axis=1)
+    m[:,0:n_cent],w[:,0:n_cent],m[:,n_cent],w[:,n_cent] = means,weights,np.inf,0.0
+    np.greater(slot[None,1:],pos[:,None],out=mask[:,1:])
+    np.copyto(m[:,1:],means,where=mask[:,1:])
+    np.copyto(w[:,1:],weights,where=mask[:,1:])
+    m[rows,pos],w[rows,pos] = vals,1.0
+    # merge: cost of every adjacent pair, weighted by q*(1-q) at its midpoint
+    total = np.maximum(np.sum(w,axis=1),1.0)
+    np.cumsum(w,axis=1,out=cum)
+    q_mid,q_var = cost[:,0:n_cent],cum[:,0:n_cent]
+    np.subtract(w[:,1:],w[:,:-1],out=q_mid)
+    q_mid *= 0.5
+    q_mid += cum[:,:-1]
+    q_mid /= total[:,None]
+    np.subtract(1.0,q_mid,out=q_var)
+    q_var *= q_mid
+    q_var += 1e-3
+    pair_cost = q_mid # q_mid is no longer needed
+    np.add(w[:,:-1],w[:,1:],out=pair_cost)
+    pair_cost /= q_var
+    np.minimum(w[:,:-1],w[:,1:],out=q_var)
+    np.less_equal(q_var,0.0,out=mask[:,0:n_cent])
+    np.copyto(pair_cost,-1.0,where=mask[:,0:n_cent]) # empty slots are dropped first
+    pick = np.argmin(pair_cost,axis=1)
+    w_a,w_b = w[rows,pick],w[rows,pick+1]
+    m_a,m_b = m[rows,pick],m[rows,pick+1]
+    with np.errstate(invalid='ignore'):
+        merged = np.where(w_b==0,m_a,np.where(w_a==0,m_b,(w_a*m_a+w_b*m_b)/np.maximum(w_a+w_b,1.0)))
+    m[rows,pick],w[rows,pick] = merged,w_a+w_b
+    # the pair collapses onto its first slot, slots after it move one left
+    np.greater(slot[None,0:n_cent],pick[:,None],out=mask[:,0:n_cent])
+    means[:],weights[:] = m[:,0:n_cent],w[:,0:n_cent]
+    np.copyto(means,m[:,1:],where=mask[:,0:n_cent])
+    np.copyto(weights,w[:,1:],where=mask[:,0:n_cent])
+
+def sketch_quantiles(means,weights,q):
+    # quantile q (0-1) of every row of centroids, NaN where empty
+    total = np.sum(weights,axis=1)
+    cum = np.cumsum(weights,axis=1)-weights/2.0 # centroid centers in rank space
+    target = q*total
+    upper = np.clip(np.sum(cum<target[:,None],axis=1),1,np.shape(means)[1]-1)
+    lower = upper-1
+    rows = np.arange(np.shape(means)[0])
+    c_0,c_1 = cum[rows,lower],cum[rows,upper]
+    m_0,m_1 = means[rows,lower],means[rows,upper]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        frac = np.clip((target-c_0)/(c_1-c_0),0.0,1.0)
+        vals = np.where(weights[rows,upper]==0,m_0,m_0+frac*(m_1-m_0))
+    n_used = np.sum(weights>0,axis=1)
+    vals = np.where(n_used==1,means[:,0],vals)
+    return np.where(total>0,vals,np.nan).astype(np.float32)
+
+#
+########################################
+# compositor
+########################################
+#
+class Compositor(object):
+    def __init__(self,shape,sketch_size=16):
+        self.shape,self.sketch_size = tuple(shape),sketch_size
+        n_pix = self.shape[0]*self.shape[1]
+        self.count = np.zeros(n_pix,dtype=np.uint32)
+        self.sum = np.zeros(n_pix,dtype=np.float64)
+        self.vmin = np.full(n_pix,np.inf,dtype=np.float32)
+        self.vmax = np.full(n_pix,-np.inf,dtype=np.float32)
+        self.means = np.full((n_pix,sketch_size),np.inf,dtype=np.float32)
+        self.weights = np.zeros((n_pix,sketch_size),dtype=np.float32)
+        self.n_scans = 0
+
+    def update(self,vals):
+        # fold one (y, x) scan in, NaN pixels are skipped
+        vals = np.ravel(vals)
+        good = np.flatnonzero(np.isfinite(vals))
+        v_good = vals[good]
+        self.count[good] += 1
+        self.sum[good] += v_good
+        self.vmin[good] = np.minimum(self.vmin[good],v_good)
+        self.vmax[good] = np.maximum(self.vmax[good],v_good)
+        if self.sketch_size>0 and len(good)>0:
+            # in blocks of pixels, with scratch allocated once per scan
+            n_block,n_cent = min(SKETCH_BLOCK,len(good)),self.sketch_size+1
+            scratch = {ii:np.empty((n_block,n_cent),dtype=np.float32) for ii in ('means','weights','cum','cost')}
+            scratch['mask'] = np.empty((n_block,n_cent),dtype=bool)
+            for b_0 in range(0,len(good),n_block):
+                indx = good[b_0:b_0+n_block]
+                means,weights = self.means[indx],self.weights[indx]
+                _insert_merge(means,weights,v_good[b_0:b_0+n_block],scratch)
+                self.means[indx],self.weights[indx] = means,weights
+        self.n_scans += 1
+
+    def merge(self,other):
+        # fold another compositor (e.g. from a parallel partition) in
+        self.count += other.count
+        self.sum += other.sum
+        self.vmin = np.minimum(self.vmin,other.vmin)
+        self.vmax = np.maximum(self.vmax,other.vmax)
+        if self.sketch_size>0:
+            good = np.flatnonzero(other.count>0)
+            means = np.concatenate((self.means[good],other.means[good]),axis=1)
+            weights = np.concatenate((self.weights[good],other.weights[good]),axis=1)
+            order = np.argsort(means,axis=1,kind='stable')
+            means,weights = np.take_along_axis(means,order,1),np.take_along_axis(weights,order,1)
+            for _ in range(other.sketch_size):
+                means,weights = _merge_cheapest(means,weights)
+            self.means[good],self.weights[good] = means,weights
+        self.n_scans += other.n_scans
+
+    def _grid(self,arr,empty=np.nan):
+        return np.where(self.count>0,arr,empty).reshape(self.shape).astype(np.float32)
+
+    def counts(self):
+        return self.count.reshape(self.shape)
+
+    def mean(self):
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return self._grid(self.sum/self.count)
+
+    def minimum(self):
+        return self._grid(self.vmin)
+
+    def maximum(self):
+        return self._grid(self.vmax)
+
+    def quantile(self,q):
+        # approximate per-pixel quantile (0-1) from the sketch
+        return sketch_quantiles(self.means,self.weights,q).reshape(self.shape)
+
+    def save(self,filename,quantiles=(0.1,0.5,0.9)):
+        # composite grids (not the accumulators) to an .npz
+        grids = {'count':self.counts(),'mean':self.mean(),'min':self.minimum(),'max':self.maximum()}
+        if self.sketch_size>0:
+            for q in quantiles:
+                grids['q{0:02d}'.format(int(round(q*100)))] = self.quantile(q)
+        np.savez_compressed(filename,n_scans=self.n_scans,**grids)
+
+#
+########################################
+# compositing files
+########################################
+#
+def _file_time(source):
+    with h5py.File(source,'r') as h5:
+        return scan_time(h5).astype(datetime.datetime)
+
+def select_files(sources,hours=None,dates=None):
+    # files whose scan starts in the given UTC hours (e.g. [17]) and/or dates
+    picked = []
+    for source in sources:
+        t_scan = _file_time(source)
+        if hours is not None and t_scan.hour not in hours:
+            continue
+        if dates is not None and t_scan.date() not in dates:
+            continue
+        picked.append(source)
+    return picked
+
+def composite_files(sources,var_name='LST',quality=None,rows=slice(None),cols=slice(None),sketch_size=16):
+    # composite scans one at a time over the rows/cols window
+    comp = None
+    for source in sources:
+        vals = read_packed(source,var_name,rows,cols).decode(quality=quality)
+        comp = Compositor(np.shape(vals),sketch_size) if comp is None else comp
+        comp.update(vals)
+    return comp
+
+def _composite_partition(args):
+    return composite_files(*args)
+
+def composite_parallel(sources,var_name='LST',quality=None,rows=slice(None),cols=slice(None),
+                       sketch_size=16,n_workers=None):
+    # split the files across worker processes and merge their compositors
+    if len(sources)==0:
+        raise ValueError('No files to composite') # the grid shape comes from the files
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    parts = [sources[ii::n_workers] for ii in range(n_workers) if len(sources[ii::n_workers])>0]
+    comp = None
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for partial in executor.map(_composite_partition,[(ii,var_name,quality,rows,cols,sketch_size) for ii in parts]):
+            if comp is None:
+                comp = partial
+            else:
+                comp.merge(partial)
+    return comp
+
+def daily_composites(sources,**kwargs):
+    # {date: Compositor} with one composite per UTC day
+    days = {}
+    for source in sources:
+        days.setdefault(_file_time(source).date(),[]).append(source)
+    return {day:composite_files(days[day],**kwargs) for day in sorted(days)}
+
+if __name__ == '__main__':
+    sat_folder = './' # local GOES cache folder (ABI-L2-LSTC...nc files)
+    sat_files = sorted([os.path.join(sat_folder,ii) for ii in os.listdir(sat_folder)
+                        if ii.startswith('ABI-L2-LSTC') and ii.endswith('.nc')])
+    quality = ['valid_clear_conditions_qf'] # clear-sky pixels only
+    t_start = time.time()
+    for day,comp in daily_composites(sat_files,quality=quality).items():
+        comp.save('LST_composite_{}.npz'.format(day.strftime('%Y%m%d')))
+        print('{0}: {1:d} scans, NYC daily max {2:2.2f} K, clear-sky count {3:d}'.\
+              format(day,comp.n_scans,comp.maximum()[318,1849],comp.counts()[318,1849]))
+    overpass = composite_parallel(select_files(sat_files,hours=[17]),quality=quality)
+    print('17 UTC mean over {0:d} scans in {1:2.1f} s, NYC median {2:2.2f} K'.\
+          format(overpass.n_scans,time.time()-t_start,overpass.quantile(0.5)[318,1849]))
@@ -0,0 +1,241 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code builds (time, y, x) cubes of a GOES-16/17 variable
+# (e.g. daily or monthly LST stacks) from files in the local cache.
+#
+# The cube is a folder with:
+#   - data.bin   - float32 values, stored as (time, y, x) chunks
+#   - cube.json  - grid, chunk layout, time coordinate and the
+#                  metadata of every scan
+#   - x.npy/y.npy - scan angles of the fixed grid
+#
+# Files are decoded in a process pool, and every worker writes its
+# scans straight into the memory-mapped data file. New scans can
+# be appended later, since the file grows one time chunk at a time.
+# The chunk shape sets the read pattern: (1, ny, nx) makes map
+# reads contiguous, while e.g. (64, 32, 32) keeps pixel time
+# series within a few chunks
+#
+################################################################
+#
+#
+import json,os,time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import h5py
+from goes_subset import _attr,goes_projection,unpack
+from goes_packed import read_packed
+from goes_points import scan_time
+
+CUBE_JSON = 'cube.json'
+DATA_NAME = 'data.bin'
+
+########################################
+# chunked memmap helpers
+########################################
+#
+def _n_chunks(size,chunk):
+    return -(-size//chunk)
+
+def _open_data(cube_dir,meta,mode='r'):
+    # data.bin as (time chunk, y chunk, x chunk, ct, cy, cx)
+    c_t,c_y,c_x = meta['chunks']
+    n_y,n_x = meta['shape']
+    shape = (meta['capacity']//c_t,_n_chunks(n_y,c_y),_n_chunks(n_x,c_x),c_t,c_y,c_x)
+    if meta['capacity']==0:
+        return np.empty(shape,dtype=np.float32) # fresh cube, data.bin is still empty (can't be mapped)
+    return np.memmap(os.path.join(cube_dir,DATA_NAME),dtype=np.float32,mode=mode,shape=shape)
+
+def _write_scan(data,meta,t_index,vals):
+    # scatter one (y, x) scan into its chunks
+    c_t,c_y,c_x = meta['chunks']
+    t_c,t_i = divmod(t_index,c_t)
+    for y_c in range(data.shape[1]):
+        y_0 = y_c*c_y
+        for x_c in range(data.shape[2]):
+            x_0 = x_c*c_x
+            block = vals[y_0:y_0+c_y,x_0:x_0+c_x]
+            data[t_c,y_c,x_c,t_i,0:block.shape[0],0:block.shape[1]] = block
+
+def _scan_info(h5):
+    # per-scan metadata kept in cube.json
+    return {'time':str(scan_time(h5)),'end':_attr(h5,'time_coverage_end'),
+            'platform':_attr(h5,'platform_ID'),'scene':_attr(h5,'scene_id'),
+            'mode':_attr(h5,'timeline_id')}
+
+def _decode_scan(args):
+    # worker: decode one file and write it into its time slot
+    cube_dir,meta,t_index,source = args
+    field = read_packed(source,meta['var_name'])
+    vals = field.decode(quality=meta['quality'])
+    data = _open_data(cube_dir,meta,'r+')
+    _write_scan(data,meta,t_index,vals)
+    data.flush()
+    with h5py.File(source,'r') as h5:
+        info = _scan_info(h5)
+    info['source'] = os.path.basename(source)
+    info['n_valid'] = int(np.sum(np.isfinite(vals)))
+    return info
+
+#
+########################################
+# time cube
+########################################
+#
+class GOESCube(object):
+    def __init__(self,cube_dir):
+        # open an existing cube (see GOESCube.create)
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir,CUBE_JSON),'r') as json_file:
+            self.meta = json.load(json_file)
+        self.xs = np.load(os.path.join(cube_dir,'x.npy'))
+        self.ys = np.load(os.path.join(cube_dir,'y.npy'))
+
+    @classmethod
+    def create(cls,cube_dir,template_file,var_name='LST',chunks=(1,None,None),quality=None):
+        # new, empty cube on the fixed grid of template_file. chunks is
+        # (time, y, x), None meaning the full grid along that axis.
+        # quality is applied when decoding (see PackedField.quality_mask)
+        with h5py.File(template_file,'r') as h5:
+            xs = unpack(h5['x'],h5['x'][:]).filled(np.nan)
+            ys = unpack(h5['y'],h5['y'][:]).filled(np.nan)
+            var = h5[var_name]
+            meta = {'var_name':var_name,'units':_attr(var,'units',''),'long_name':_attr(var,'long_name',''),
+                    'projection':goes_projection(h5),'shape':[len(ys),len(xs)],
+                    'chunks':[chunks[0],len(ys) if chunks[1] is None else chunks[1],
+                              len(xs) if chunks[2] is None else chunks[2]],
+                    'quality':quality,'capacity':0,'times':[],'scans':[]}
+        if os.path.isdir(cube_dir)==False:
+            os.makedirs(cube_dir)
+        np.save(os.path.join(cube_dir,'x.npy'),xs)
+        np.save(os.path.join(cube_dir,'y.npy'),ys)
+        open(os.path.join(cube_dir,DATA_NAME),'wb').close()
+        cls._save_meta(cube_dir,meta)
+        return cls(cube_dir)
+
+    @staticmethod
+    def _save_meta(cube_dir,meta):
+        tmp_file = os.path.join(cube_dir,CUBE_JSON+'.tmp')
+        with open(tmp_file,'w') as json_file:
+            json.dump(meta,json_file)
+        os.replace(tmp_file,os.path.join(cube_dir,CUBE_JSON))
+
+    @property
+    def n_times(self):
+        return len(self.meta['times'])
+
+    @property
+    def shape(self):
+        return (self.n_times,self.meta['shape'][0],self.meta['shape'][1])
+
+    @property
+    def times(self):
+        return np.array(self.meta['times'],dtype=np.int64).astype('datetime64[ms]')
+
+    def _check_grid(self,h5):
+        if len(h5['x'])!=len(self.xs) or len(h5['y'])!=len(self.ys):
+            return False
+        xs = unpack(h5['x'],h5['x'][[0,-1]]).filled(np.nan)
+        ys = unpack(h5['y'],h5['y'][[0,-1]]).filled(np.nan)
+        return np.allclose(xs,self.xs[[0,-1]]) and np.allclose(ys,self.ys[[0,-1]])
+
+    def _grow(self,n_times):
+        # extend data.bin by whole time chunks to hold n_times scans
+        c_t = self.meta['chunks'][0]
+        capacity = _n_chunks(n_times,c_t)*c_t
+        if capacity<=self.meta['capacity']:
+            return
+        n_y,n_x = self.meta['shape']
+        chunk_bytes = c_t*self.meta['chunks'][1]*self.meta['chunks'][2]*4
+        n_bytes = (capacity//c_t)*_n_chunks(n_y,self.meta['chunks'][1])*_n_chunks(n_x,self.meta['chunks'][2])*chunk_bytes
+        with open(os.path.join(self.cube_dir,DATA_NAME),'r+b') as fp:
+            fp.truncate(n_bytes)
+        self.meta['capacity'] = capacity
+
+    def append(self,sources,n_workers=None):
+        # decode new scans into the cube, in time order after the scans it
+        # already holds. Scans already in the cube are skipped, returns the
+        # number of scans added
+        known = set(self.meta['times'])
+        new_scans = []
+        for source in sources:
+            with h5py.File(source,'r') as h5:
+                if not self._check_grid(h5):
+                    raise ValueError('{} is not on the cube\'s fixed grid'.format(source))
+                t_ms = int(scan_time(h5).astype(np.int64))
+            if t_ms not in known:
+                known.add(t_ms)
+                new_scans.append((t_ms,source))
+        if len(new_scans)==0:
+            return 0
+        new_scans.sort()
+        if self.n_times>0 and new_scans[0][0]<self.meta['times'][-1]:
+            raise ValueError('Scans must be appended in time order (cube ends at {})'.format(self.times[-1]))
+        self._grow(self.n_times+len(new_scans))
+        layout = {ii:self.meta[ii] for ii in ('var_name','quality','shape','chunks','capacity')} # what the workers need
+        jobs = [(self.cube_dir,layout,self.n_times+ii,source) for ii,(_,source) in enumerate(new_scans)]
+        if n_workers is not None and n_workers<=1:
+            infos = list(map(_decode_scan,jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                infos = list(executor.map(_decode_scan,jobs))
+        # the time coordinate only grows once every scan is on disk
+        self.meta['times'] += [ii[0] for ii in new_scans]
+        self.meta['scans'] += infos
+        self._save_meta(self.cube_dir,self.meta)
+        return len(new_scans)
+
+    #
+    # reads
+    #
+    def read(self,t_sl=slice(None),y_sl=slice(None),x_sl=slice(None)):
+        # (time, y, x) block assembled from the chunks it overlaps
+        data = _open_data(self.cube_dir,self.meta)
+        (t_0,t_1,_),(y_0,y_1,_),(x_0,x_1,_) = t_sl.indices(self.n_times),y_sl.indices(self.shape[1]),\
+                                              x_sl.indices(self.shape[2])
+        c_t,c_y,c_x = self.meta['chunks']
+        out = np.empty((max(t_1-t_0,0),max(y_1-y_0,0),max(x_1-x_0,0)),dtype=np.float32)
+        for t_c in range(t_0//c_t,_n_chunks(t_1,c_t)):
+            ct_0,ct_1 = max(t_0,t_c*c_t),min(t_1,(t_c+1)*c_t)
+            for y_c in range(y_0//c_y,_n_chunks(y_1,c_y)):
+                cy_0,cy_1 = max(y_0,y_c*c_y),min(y_1,(y_c+1)*c_y)
+                for x_c in range(x_0//c_x,_n_chunks(x_1,c_x)):
+                    cx_0,cx_1 = max(x_0,x_c*c_x),min(x_1,(x_c+1)*c_x)
+                    out[ct_0-t_0:ct_1-t_0,cy_0-y_0:cy_1-y_0,cx_0-x_0:cx_1-x_0] = \
+                        data[t_c,y_c,x_c,ct_0-t_c*c_t:ct_1-t_c*c_t,cy_0-y_c*c_y:cy_1-y_c*c_y,
+                             cx_0-x_c*c_x:cx_1-x_c*c_x]
+        return out
+
+    def read_map(self,t_index):
+        # one scan as a (y, x) grid
+        return self.read(slice(t_index,t_index+1))[0]
+
+    def read_pixels(self,rows,cols):
+        # full time series at pixels (rows, cols), shape (time, n_pixels)
+        data = _open_data(self.cube_dir,self.meta)
+        c_t,c_y,c_x = self.meta['chunks']
+        rows,cols = np.atleast_1d(rows),np.atleast_1d(cols)
+        series = data[:,rows//c_y,cols//c_x,:,rows%c_y,cols%c_x] # (n_pixels, time chunks, c_t)
+        return np.reshape(series,(len(rows),-1))[:,0:self.n_times].T
+
+if __name__ == '__main__':
+    sat_folder = './' # local GOES cache folder (ABI-L2-LSTC...nc files)
+    sat_files = sorted([os.path.join(sat_folder,ii) for ii in os.listdir(sat_folder)
+                        if ii.startswith('ABI-L2-LSTC') and ii.endswith('.nc')])
+    # same scans in two layouts: map-major and pixel-time-series friendly
+    for cube_dir,chunks in (('./goes_cube_maps/',(1,None,None)),('./goes_cube_series/',(32,125,125))):
+        t_start = time.time()
+        cube = GOESCube(cube_dir) if os.path.isfile(os.path.join(cube_dir,CUBE_JSON)) else \
+               GOESCube.create(cube_dir,sat_files[0],'LST',chunks)
+        n_added = cube.append(sat_files)
+        print('{0}: added {1:d} scans in {2:2.2f} s, cube shape {3}'.format(cube_dir,n_added,time.time()-t_start,cube.shape))
+        t_start = time.time()
+        lst_map = cube.read_map(cube.n_times-1)
+        t_map = time.time()-t_start
+        t_start = time.time()
+        nyc_series = cube.read_pixels([318],[1849]) # NYC pixel
+        t_series = time.time()-t_start
+        print('   map read {0:2.4f} s, NYC time series read {1:2.4f} s'.format(t_map,t_series))
@@ -0,0 +1,92 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code caches the latitude/longitude grids of GOES-16/17
+# fixed-grid files. The fixed grid is identical for every scan of
+# a given product and sector, so the grids are computed once and
+# stored as float32 .npy files (NaN off the earth's disk), keyed by
+# the goes_imager_projection attributes and a hash of the x/y scan
+# angles. Later files with the same grid get memory-mapped arrays
+# back without any reprojection
+#
+################################################################
+#
+#
+import hashlib,json,os,shutil
+import numpy as np
+from goes_navigation import grid_to_lonlat,projection_from_attrs
+
+PROJ_ATTRS = ('perspective_point_height','semi_major_axis','semi_minor_axis',
+              'longitude_of_projection_origin','latitude_of_projection_origin','sweep_angle_axis')
+ROW_CHUNK = 256 # rows navigated at a time
+GEOLOCATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'goes_geolocation') # same folder from any working directory
+
+########################################
+# grid keys
+########################################
+#
+def projection_attrs(netcdf_file):
+    # goes_imager_projection attributes as plain python values
+    proj_var = netcdf_file.variables['goes_imager_projection']
+    attrs = {}
+    for name in PROJ_ATTRS:
+        if name in proj_var.ncattrs():
+            val = proj_var.getncattr(name)
+            attrs[name] = val if isinstance(val,str) else float(np.ravel(val)[0])
+    return attrs
+
+def scan_angles(netcdf_file):
+    # x/y scan angles [rad] as float64 (netCDF4 applies scale/offset)
+    xs = np.ma.filled(netcdf_file.variables['x'][:],np.nan).astype(np.float64)
+    ys = np.ma.filled(netcdf_file.variables['y'][:],np.nan).astype(np.float64)
+    return xs,ys
+
+def grid_key(proj_attrs,xs,ys):
+    # projection attributes + x/y hash -> short hex key for the cache
+    sha = hashlib.sha1(json.dumps(proj_attrs,sort_keys=True).encode())
+    sha.update(np.ascontiguousarray(xs,dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(ys,dtype=np.float64).tobytes())
+    return sha.hexdigest()[0:20]
+
+#
+########################################
+# reprojection (row chunks, float32 out)
+########################################
+#
+def compute_lat_lon(proj_attrs,xs,ys,lats_out,lons_out,row_chunk=ROW_CHUNK):
+    # fill lats_out/lons_out (ny,nx) chunk by chunk, NaN off the disk
+    # (closed-form navigation, see goes_navigation.py)
+    grid_to_lonlat(projection_from_attrs(proj_attrs),xs,ys,row_chunk=row_chunk,
+                   lons_out=lons_out,lats_out=lats_out)
+
+#
+########################################
+# on-disk cache
+########################################
+#
+def cached_lat_lon(netcdf_file,cache_dir=GEOLOCATION_DIR):
+    # (lons, lats) float32 grids for the file's fixed grid, memory-mapped
+    # from the cache (computed and saved the first time a grid is seen)
+    proj_attrs = projection_attrs(netcdf_file)
+    xs,ys = scan_angles(netcdf_file)
+    grid_dir = os.path.join(cache_dir,grid_key(proj_attrs,xs,ys))
+    lats_file,lons_file = os.path.join(grid_dir,'lats.npy'),os.path.join(grid_dir,'lons.npy')
+    if not (os.path.isfile(lats_file) and os.path.isfile(lons_file)):
+        tmp_dir = grid_dir+'.tmp-{}'.format(os.getpid())
+        os.makedirs(tmp_dir,exist_ok=True)
+        lats_out = np.lib.format.open_memmap(os.path.join(tmp_dir,'lats.npy'),mode='w+',
+                                             dtype=np.float32,shape=(len(ys),len(xs)))
+        lons_out = np.lib.format.open_memmap(os.path.join(tmp_dir,'lons.npy'),mode='w+',
+                                             dtype=np.float32,shape=(len(ys),len(xs)))
+        compute_lat_lon(proj_attrs,xs,ys,lats_out,lons_out)
+        lats_out.flush(),lons_out.flush()
+        del lats_out,lons_out
+        with open(os.path.join(tmp_dir,'grid.json'),'w') as json_file:
+            json.dump({'projection':proj_attrs,'shape':[len(ys),len(xs)]},json_file)
+        try:
+            os.replace(tmp_dir,grid_dir) # another process may have won the race
+        except OSError:
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+    return np.load(lons_file,mmap_mode='r'),np.load(lats_file,mmap_mode='r')
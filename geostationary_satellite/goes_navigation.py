@@ -0,0 +1,168 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code is a numpy implementation of the GOES-R fixed grid
+# navigation equations (GOES-R Product User Guide, section 4.2.8),
+# which are also walked through in the tutorial:
+# https://makersportal.com/blog/2018/11/25/goes-r-satellite-latitude-and-longitude-grid-projection-algorithm
+#
+#   - scan angles (x,y) -> lat/lon   (forward navigation)
+#   - lat/lon -> scan angles (x,y)   (inverse navigation)
+#
+# Full grids are processed in row chunks, with the 1D x and y
+# terms broadcast against each other so the 2D meshgrid is never
+# built. The math runs in float64 (the quadratic for the line of
+# sight cancels badly in float32) and results can be stored as
+# float32. Run this file directly to check it against pyproj and
+# to benchmark it on a full-disk grid
+#
+################################################################
+#
+#
+import sys,time
+import numpy as np
+
+ROW_CHUNK = 256 # rows navigated at a time
+
+########################################
+# projection parameters
+########################################
+#
+def projection_from_attrs(attrs):
+    # goes_imager_projection attributes (see goes_geolocation.projection_attrs)
+    # -> the projection dict used here and in goes_subset.goes_projection
+    return {'h':float(attrs['perspective_point_height']),
+            'r_eq':float(attrs['semi_major_axis']),
+            'r_pol':float(attrs['semi_minor_axis']),
+            'lambda_0':float(attrs['longitude_of_projection_origin']),
+            'sweep':attrs.get('sweep_angle_axis','x')}
+
+def _constants(proj):
+    if proj.get('sweep','x')!='x':
+        raise ValueError('Only the GOES-R sweep-x geometry is supported')
+    H = proj['h']+proj['r_eq'] # distance from the satellite to the earth's center
+    return H,proj['r_eq'],proj['r_pol'],np.radians(proj['lambda_0'])
+
+#
+########################################
+# forward navigation: x/y -> lat/lon
+########################################
+#
+def _forward(proj,cos_x,sin_x,cos_y,sin_y):
+    # inputs broadcast against each other (e.g. (1,nx) and (ny,1))
+    H,r_eq,r_pol,lambda_0 = _constants(proj)
+    ratio = (r_eq*r_eq)/(r_pol*r_pol)
+    a = sin_x*sin_x+cos_x*cos_x*(cos_y*cos_y+ratio*sin_y*sin_y)
+    b = -2.0*H*cos_x*cos_y
+    c = H*H-r_eq*r_eq
+    disc = b*b-4.0*a*c
+    off_disk = disc<0.0 # line of sight misses the earth
+    r_s = (-b-np.sqrt(np.where(off_disk,0.0,disc)))/(2.0*a) # satellite -> surface distance
+    s_x = r_s*cos_x*cos_y
+    s_y = -r_s*sin_x
+    s_z = r_s*cos_x*sin_y
+    lats = np.degrees(np.arctan(ratio*s_z/np.sqrt((H-s_x)*(H-s_x)+s_y*s_y)))
+    lons = np.degrees(lambda_0-np.arctan(s_y/(H-s_x)))
+    lons = (lons+180.0)%360.0-180.0 # wrap to [-180, 180)
+    return np.where(off_disk,np.nan,lons),np.where(off_disk,np.nan,lats)
+
+def scan_to_lonlat(proj,x,y):
+    # element-wise navigation of scan angle pairs [rad] -> (lons, lats) [deg]
+    x,y = np.asarray(x,dtype=np.float64),np.asarray(y,dtype=np.float64)
+    return _forward(proj,np.cos(x),np.sin(x),np.cos(y),np.sin(y))
+
+def grid_to_lonlat(proj,xs,ys,dtype=np.float32,row_chunk=ROW_CHUNK,lons_out=None,lats_out=None):
+    # navigate the full fixed grid defined by 1D xs (columns) and ys (rows),
+    # writing row chunks into lons_out/lats_out (e.g. memmaps) if given
+    xs,ys = np.asarray(xs,dtype=np.float64),np.asarray(ys,dtype=np.float64)
+    shape = (len(ys),len(xs))
+    lons_out = np.empty(shape,dtype=dtype) if lons_out is None else lons_out
+    lats_out = np.empty(shape,dtype=dtype) if lats_out is None else lats_out
+    cos_x,sin_x = np.cos(xs)[None,:],np.sin(xs)[None,:] # computed once for all rows
+    for r_0 in range(0,len(ys),row_chunk):
+        y_chunk = ys[r_0:r_0+row_chunk,None]
+        lons,lats = _forward(proj,cos_x,sin_x,np.cos(y_chunk),np.sin(y_chunk))
+        lons_out[r_0:r_0+row_chunk] = lons
+        lats_out[r_0:r_0+row_chunk] = lats
+    return lons_out,lats_out
+
+#
+########################################
+# inverse navigation: lat/lon -> x/y
+########################################
+#
+def lonlat_to_scan(proj,lons,lats):
+    # lat/lon [deg] -> scan angles x/y [rad], NaN where not visible
+    H,r_eq,r_pol,lambda_0 = _constants(proj)
+    lats = np.radians(np.asarray(lats,dtype=np.float64))
+    lons = np.radians(np.asarray(lons,dtype=np.float64))
+    lat_c = np.arctan((r_pol*r_pol)/(r_eq*r_eq)*np.tan(lats)) # geocentric latitude
+    e_sq = (r_eq*r_eq-r_pol*r_pol)/(r_eq*r_eq)
+    r_c = r_pol/np.sqrt(1.0-e_sq*np.cos(lat_c)**2) # geocentric distance to the point
+    s_x = H-r_c*np.cos(lat_c)*np.cos(lons-lambda_0)
+    s_y = -r_c*np.cos(lat_c)*np.sin(lons-lambda_0)
+    s_z = r_c*np.sin(lat_c)
+    hidden = H*(H-s_x)<(s_y*s_y+(r_eq*r_eq)/(r_pol*r_pol)*s_z*s_z) # behind the earth's limb
+    x = np.arcsin(-s_y/np.sqrt(s_x*s_x+s_y*s_y+s_z*s_z))
+    y = np.arctan(s_z/s_x)
+    return np.where(hidden,np.nan,x),np.where(hidden,np.nan,y)
+
+def lonlat_to_rowcol(proj,xs,ys,lons,lats):
+    # lat/lon -> nearest (row, col) on the fixed grid with 1D xs/ys,
+    # -1 for points that are not visible or fall outside the grid
+    x,y = lonlat_to_scan(proj,lons,lats)
+    xs,ys = np.asarray(xs,dtype=np.float64),np.asarray(ys,dtype=np.float64)
+    dx,dy = (xs[-1]-xs[0])/(len(xs)-1),(ys[-1]-ys[0])/(len(ys)-1) # the fixed grid is uniform
+    cols = np.rint((x-xs[0])/dx)
+    rows = np.rint((y-ys[0])/dy)
+    good = np.isfinite(cols) & np.isfinite(rows) & (cols>=0) & (cols<len(xs)) & (rows>=0) & (rows<len(ys))
+    return np.where(good,rows,-1).astype(np.int64),np.where(good,cols,-1).astype(np.int64)
+
+#
+########################################
+# pyproj check and benchmark
+########################################
+#
+def full_disk_grid(n_pix=5424,spacing=56e-6):
+    # scan angles of a 2 km full-disk ABI grid
+    half = spacing*(n_pix-1)/2.0
+    return np.linspace(-half,half,n_pix),np.linspace(half,-half,n_pix)
+
+def check_against_pyproj(proj,xs,ys,step=7):
+    # max difference to pyproj on a subsample of the grid, in pixels
+    import pyproj
+    goes_proj = pyproj.Proj(proj='geos',h=proj['h'],a=proj['r_eq'],b=proj['r_pol'],
+                            lon_0=proj['lambda_0'],sweep='x',units='m')
+    x_sub,y_sub = xs[::step],ys[::step]
+    lons,lats = grid_to_lonlat(proj,x_sub,y_sub,dtype=np.float64)
+    x_m,y_m = np.meshgrid(x_sub*proj['h'],y_sub*proj['h'])
+    ref_lons,ref_lats = goes_proj(x_m,y_m,inverse=True)
+    ref_lons,ref_lats = np.asarray(ref_lons),np.asarray(ref_lats)
+    on_disk = np.isfinite(lons) & (np.abs(ref_lons)<=360.0)
+    # compare in scan-angle space by inverse-navigating pyproj's answer
+    x_back,y_back = lonlat_to_scan(proj,ref_lons[on_disk],ref_lats[on_disk])
+    pix = np.abs(xs[1]-xs[0])
+    err_x = np.nanmax(np.abs(x_back-np.broadcast_to(x_sub,np.shape(lons))[on_disk]))/pix
+    err_y = np.nanmax(np.abs(y_back-np.broadcast_to(y_sub[:,None],np.shape(lons))[on_disk]))/pix
+    err_deg = np.nanmax(np.hypot(lons[on_disk]-ref_lons[on_disk],lats[on_disk]-ref_lats[on_disk]))
+    agree = np.mean(np.isfinite(lons)==(np.abs(ref_lons)<=360.0)) # on/off disk agreement
+    return max(err_x,err_y),err_deg,agree
+
+if __name__ == '__main__':
+    proj = {'h':35786023.0,'r_eq':6378137.0,'r_pol':6356752.31414,'lambda_0':-75.0,'sweep':'x'} # GOES-16
+    n_pix = int(sys.argv[1]) if len(sys.argv)>1 else 5424
+    xs,ys = full_disk_grid(n_pix)
+    err_pix,err_deg,agree = check_against_pyproj(proj,xs,ys)
+    print('vs. pyproj: max error {0:2.2e} pixels ({1:2.2e} deg), on/off-disk agreement {2:2.4f}'.\
+          format(err_pix,err_deg,agree))
+    for dtype in (np.float64,np.float32):
+        t_start = time.perf_counter()
+        lons,lats = grid_to_lonlat(proj,xs,ys,dtype=dtype)
+        t_nav = time.perf_counter()-t_start
+        print('{0:d}x{0:d} full disk ({1}): {2:2.2f} s, {3:2.1f} Mpix/s'.\
+              format(n_pix,np.dtype(dtype).name,t_nav,n_pix*n_pix/t_nav/1e6))
+    x_back,y_back = lonlat_to_scan(proj,lons,lats)
+    print('round trip (float32 storage): max {0:2.2e} pixels'.\
+          format(np.nanmax(np.abs(x_back-xs[None,:]))/np.abs(xs[1]-xs[0])))
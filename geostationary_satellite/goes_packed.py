@@ -0,0 +1,148 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code keeps GOES-16/17 data in its packed form. The L2
+# products store their values as 16-bit integers plus a
+# scale_factor/add_offset/_FillValue, but reading them with
+# netCDF4 returns a float masked array (4 or 8 bytes per value
+# plus 1 byte of mask). PackedField keeps the int16 values (2 bytes)
+# and the DQF as uint8 (1 byte), and only decodes to float when
+# asked - for a slice, or chunk by chunk. Quality control uses the
+# DQF flag_masks/flag_values as bitmasks, so masks are built with
+# integer ops on the packed flags
+#
+################################################################
+#
+#
+import numpy as np
+from goes_subset import open_goes,_attr
+
+ROW_CHUNK = 250 # rows decoded at a time (one HDF5 chunk row on CONUS)
+
+########################################
+# packed field
+########################################
+#
+def _packed_attrs(var):
+    # packing metadata of a variable, with _Unsigned applied to the dtype
+    unsigned = _attr(var,'_Unsigned')=='true' and var.dtype.kind=='i'
+    dtype = np.dtype(var.dtype.str.replace('i','u')) if unsigned else var.dtype
+    fill = _attr(var,'_FillValue')
+    if fill is not None:
+        fill = np.array(fill).astype(var.dtype).view(dtype)[()] # e.g. -1 -> 65535
+    return {'dtype':dtype,'fill':fill,'scale':float(_attr(var,'scale_factor',1.0)),
+            'offset':float(_attr(var,'add_offset',0.0))}
+
+def _pack_dqf(dqf_var,raw):
+    # DQF as uint8 when its flags fit (fill -> 255), otherwise unsigned 16-bit
+    attrs = _packed_attrs(dqf_var)
+    raw = raw.view(attrs['dtype'])
+    valid_range = _attr(dqf_var,'valid_range')
+    if valid_range is not None and np.max(valid_range)<255:
+        packed = raw.astype(np.uint8)
+        if attrs['fill'] is not None:
+            packed[raw==attrs['fill']] = 255
+        return packed,np.uint8(255)
+    return raw,attrs['fill']
+
+def _dqf_flags(dqf_var):
+    # flag meaning -> (mask, value), from the DQF's flag attributes
+    meanings = _attr(dqf_var,'flag_meanings','').split()
+    values = np.atleast_1d(_attr(dqf_var,'flag_values',[]))
+    masks = _attr(dqf_var,'flag_masks')
+    masks = np.full(len(values),-1) if masks is None else np.atleast_1d(masks) # plain values (no bit fields)
+    return {name:(int(mask),int(val)) for name,mask,val in zip(meanings,masks,values)}
+
+class PackedField(object):
+    def __init__(self,raw,attrs,dqf=None,dqf_fill=None,flags=None,name='',units='',long_name=''):
+        self.raw = raw # packed values, e.g. uint16 for LST
+        self.fill,self.scale,self.offset = attrs['fill'],attrs['scale'],attrs['offset']
+        self.dqf,self.dqf_fill = dqf,dqf_fill
+        self.flags = {} if flags is None else flags
+        self.name,self.units,self.long_name = name,units,long_name
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes+(0 if self.dqf is None else self.dqf.nbytes)
+
+    def quality_mask(self,rows=slice(None),cols=slice(None),quality=None):
+        # boolean 'good' mask over a slice. quality can be:
+        #   None - only the fill value is masked
+        #   int  - DQF bits that must be clear (e.g. 0b11111 drops any flagged pixel)
+        #   str or list of flag meanings that must hold (e.g. 'good_retrieval_qf')
+        good = self.raw[rows,cols]!=self.fill if self.fill is not None else \
+               np.ones(np.shape(self.raw[rows,cols]),dtype=bool)
+        if quality is None or self.dqf is None:
+            return good
+        dqf = self.dqf[rows,cols]
+        good &= dqf!=self.dqf_fill
+        if isinstance(quality,(int,np.integer)):
+            good &= (dqf & dqf.dtype.type(quality))==0
+            return good
+        for meaning in ([quality] if isinstance(quality,str) else quality):
+            if meaning not in self.flags:
+                raise KeyError('No DQF flag named {0} (flags: {1})'.format(meaning,', '.join(self.flags)))
+            mask,val = self.flags[meaning]
+            good &= ((dqf & dqf.dtype.type(mask)) if mask>=0 else dqf)==val
+        return good
+
+    def decode(self,rows=slice(None),cols=slice(None),quality=None,dtype=np.float32):
+        # physical values over a slice, NaN where filled or failing quality
+        vals = self.raw[rows,cols].astype(dtype)
+        vals *= dtype(self.scale)
+        vals += dtype(self.offset)
+        vals[~self.quality_mask(rows,cols,quality)] = np.nan
+        return vals
+
+    def iter_chunks(self,row_chunk=ROW_CHUNK,quality=None,dtype=np.float32):
+        # (row slice, decoded rows) pairs, so a full scan never needs to be
+        # decoded all at once
+        for r_0 in range(0,self.shape[0],row_chunk):
+            row_sl = slice(r_0,min(r_0+row_chunk,self.shape[0]))
+            yield row_sl,self.decode(row_sl,slice(None),quality,dtype)
+
+#
+########################################
+# readers
+########################################
+#
+def read_packed(source,var_name='LST',rows=slice(None),cols=slice(None),with_dqf=True,bucket=None):
+    # PackedField for var_name (optionally a row/col hyperslab) from a local
+    # file or, with bucket, a remote blob (see goes_subset.open_goes)
+    with open_goes(source,bucket) as h5:
+        var = h5[var_name]
+        attrs = _packed_attrs(var)
+        raw = var[rows,cols].view(attrs['dtype'])
+        dqf,dqf_fill,flags = None,None,None
+        if with_dqf and 'DQF' in h5:
+            dqf,dqf_fill = _pack_dqf(h5['DQF'],h5['DQF'][rows,cols])
+            flags = _dqf_flags(h5['DQF'])
+        return PackedField(raw,attrs,dqf,dqf_fill,flags,var_name,
+                           _attr(var,'units',''),_attr(var,'long_name',''))
+
+if __name__ == '__main__':
+    import time
+    from netCDF4 import Dataset
+    sat_file = 'ABI-L2-LSTC_2020_153_17_OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc'
+    t_start = time.time()
+    field = read_packed(sat_file)
+    t_packed = time.time()-t_start
+    t_start = time.time()
+    masked = Dataset(sat_file).variables['LST'][:] # netCDF4's auto-scaled masked array
+    t_masked = time.time()-t_start
+    masked_bytes = masked.data.nbytes+np.ma.getmaskarray(masked).nbytes
+    print('packed LST+DQF: {0:2.1f} MB ({1:2.2f} s), netCDF4 masked LST: {2:2.1f} MB ({3:2.2f} s)'.\
+          format(field.nbytes/1e6,t_packed,masked_bytes/1e6,t_masked))
+    print('a day of 5-minute scans: {0:2.1f} GB packed vs. {1:2.1f} GB masked'.\
+          format(288*field.nbytes/1e9,288*masked_bytes/1e9))
+    decoded = field.decode()
+    print('max decode difference: {0:2.2e} K'.format(np.nanmax(np.abs(decoded-masked.filled(np.nan)))))
+    for quality in (None,'good_retrieval_qf',['valid_clear_conditions_qf','valid_LZA_qf']):
+        n_good = sum([np.sum(np.isfinite(vals)) for _,vals in field.iter_chunks(quality=quality)])
+        print('quality {0}: {1:d} good pixels'.format(quality,n_good))
@@ -0,0 +1,150 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code extracts GOES-16/17 values at many lat/lon points
+# (towers, ASOS stations, cities) from many files at once:
+#   - each point's row/column on the fixed grid is found once by
+#     inverse navigation (goes_navigation.py), instead of decoding
+#     a full lat/lon grid and searching it
+#   - only the pixels at those points (and their DQF) are read,
+#     grouped by HDF5 chunk so each chunk is read at most once
+#   - files are split across a process pool, and the result is an
+#     M files x N points array plus the scan times
+#
+################################################################
+#
+#
+import os,time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from goes_navigation import lonlat_to_rowcol
+from goes_subset import open_goes,unpack,_attr,goes_projection
+
+########################################
+# point -> pixel indices
+########################################
+#
+def _grid(h5):
+    # 1D scan angles of the file's fixed grid [rad]
+    return unpack(h5['x'],h5['x'][:]).filled(np.nan),unpack(h5['y'],h5['y'][:]).filled(np.nan)
+
+def point_pixels(source,lons,lats,bucket=None):
+    # (rows, cols) of each lat/lon point on a file's fixed grid, -1 where
+    # the point is off the disk or outside the file's sector
+    with open_goes(source,bucket) as h5:
+        xs,ys = _grid(h5)
+        return lonlat_to_rowcol(goes_projection(h5),xs,ys,lons,lats)
+
+def _grid_signature(h5):
+    # enough of the grid to tell whether cached row/col indices still apply
+    x_var,y_var = h5['x'],h5['y']
+    return (len(x_var),len(y_var),int(x_var[0]),int(y_var[0]),
+            goes_projection(h5)['lambda_0'])
+
+def _read_pixels(var,rows,cols):
+    # raw (packed) values at rows/cols, one hyperslab read per HDF5 chunk
+    # touched by the points (fill value where rows/cols are -1)
+    fill = _attr(var,'_FillValue',0)
+    raw = np.full(len(rows),fill,dtype=var.dtype)
+    good = np.flatnonzero((rows>=0) & (cols>=0))
+    if len(good)==0:
+        return raw
+    chunk_rows,chunk_cols = var.chunks if var.chunks is not None else var.shape
+    chunk_id = (rows[good]//chunk_rows)*(var.shape[1]//chunk_cols+1)+cols[good]//chunk_cols
+    order = np.argsort(chunk_id,kind='stable')
+    bounds = np.flatnonzero(np.diff(chunk_id[order]))+1
+    for group in np.split(good[order],bounds):
+        r_0,r_1 = rows[group].min(),rows[group].max()+1
+        c_0,c_1 = cols[group].min(),cols[group].max()+1
+        block = var[r_0:r_1,c_0:c_1] # at most one chunk
+        raw[group] = block[rows[group]-r_0,cols[group]-c_0]
+    return raw
+
+#
+########################################
+# per-file extraction (runs in the workers)
+########################################
+#
+def scan_time(h5):
+    # scan start time as datetime64[ms]
+    t_str = _attr(h5,'time_coverage_start')
+    return np.datetime64(t_str.rstrip('Z'),'ms') if t_str is not None else np.datetime64('NaT','ms')
+
+def extract_file(source,lons,lats,rows,cols,signature,var_name='LST',bucket=None,with_dqf=True):
+    # values (float32, NaN when missing) and DQF (-1 when missing) at the
+    # points for one file; indices are recomputed only if its grid differs
+    with open_goes(source,bucket) as h5:
+        if _grid_signature(h5)!=signature:
+            xs,ys = _grid(h5)
+            rows,cols = lonlat_to_rowcol(goes_projection(h5),xs,ys,lons,lats)
+        var = h5[var_name]
+        vals = unpack(var,_read_pixels(var,rows,cols)).filled(np.nan)
+        vals[rows<0] = np.nan
+        dqf = np.full(len(rows),-1,dtype=np.int16)
+        if with_dqf and 'DQF' in h5:
+            dqf_var = h5['DQF']
+            dqf_raw = _read_pixels(dqf_var,rows,cols)
+            dqf_fill = _attr(dqf_var,'_FillValue')
+            dqf = np.where((rows<0) | (dqf_raw==dqf_fill),-1,dqf_raw).astype(np.int16)
+        return scan_time(h5),vals,dqf
+
+def _extract_batch(args):
+    sources,lons,lats,rows,cols,signature,var_name,bucket,with_dqf = args
+    return [extract_file(ii,lons,lats,rows,cols,signature,var_name,bucket,with_dqf) for ii in sources]
+
+#
+########################################
+# M files x N points
+########################################
+#
+def extract_points(sources,lons,lats,var_name='LST',bucket=None,with_dqf=True,n_workers=None):
+    # values at N lat/lon points from M files (local paths, or blob names
+    # with a picklable bucket such as LocalBucket), returns a dict:
+    #   times (M,) datetime64[ms], values (M,N) float32, dqf (M,N) int16,
+    #   rows/cols (N,) indices on the first file's grid
+    # rows of the output are sorted by scan time
+    lons = np.atleast_1d(np.asarray(lons,dtype=np.float64))
+    lats = np.atleast_1d(np.asarray(lats,dtype=np.float64))
+    sources = list(sources)
+    if len(sources)==0:
+        raise ValueError('No files to extract points from') # the grid comes from the first file
+    with open_goes(sources[0],bucket) as h5:
+        xs,ys = _grid(h5)
+        rows,cols = lonlat_to_rowcol(goes_projection(h5),xs,ys,lons,lats) # once for all files
+        signature = _grid_signature(h5)
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_batches = min(len(sources),n_workers*4) # a few batches per worker to balance the load
+    batches = [list(range(ii,len(sources),n_batches)) for ii in range(n_batches)]
+    jobs = [([sources[jj] for jj in ii],lons,lats,rows,cols,signature,var_name,bucket,with_dqf) for ii in batches]
+    times = np.empty(len(sources),dtype='datetime64[ms]')
+    values = np.empty((len(sources),len(lons)),dtype=np.float32)
+    dqf = np.empty((len(sources),len(lons)),dtype=np.int16)
+    if n_workers<=1:
+        results = list(map(_extract_batch,jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor: # shut down even if a batch fails
+            results = list(executor.map(_extract_batch,jobs))
+    for indx,batch in zip(batches,results):
+        for jj,(t_scan,vals,flags) in zip(indx,batch):
+            times[jj],values[jj],dqf[jj] = t_scan,vals,flags
+    order = np.argsort(times,kind='stable')
+    return {'times':times[order],'values':values[order],'dqf':dqf[order],
+            'rows':rows,'cols':cols,'sources':[sources[ii] for ii in order]}
+
+if __name__ == '__main__':
+    sat_folder = './' # folder with GOES files (ABI-L2-...nc)
+    sat_files = sorted([os.path.join(sat_folder,ii) for ii in os.listdir(sat_folder)
+                        if ii.startswith('ABI-') and ii.endswith('.nc')])
+    # point name: (lon, lat)
+    points = {'NYC':(-74.0171,40.70202),'Central Park':(-73.9654,40.7829),
+              'Los Angeles':(-118.2437,34.0522),'Denver':(-104.9903,39.7392)}
+    names = list(points)
+    t_start = time.time()
+    extracted = extract_points(sat_files,[points[ii][0] for ii in names],[points[ii][1] for ii in names])
+    print('{0:d} files x {1:d} points in {2:2.2f} s'.format(len(sat_files),len(names),time.time()-t_start))
+    for ii,name in enumerate(names):
+        print('{0}: pixel [{1:d},{2:d}], first scan {3} -> {4:2.2f} (DQF {5:d})'.\
+              format(name,extracted['rows'][ii],extracted['cols'][ii],extracted['times'][0],
+                     extracted['values'][0,ii],extracted['dqf'][0,ii]))
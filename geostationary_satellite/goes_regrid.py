@@ -0,0 +1,156 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code regrids GOES-16/17 fixed-grid data onto a regular
+# lat/lon grid (a bbox at a given resolution), so scans can be
+# drawn with imshow instead of pcolormesh on the 3.75M-cell
+# curvilinear mesh.
+#
+# The center of every target cell is inverse-navigated once
+# (goes_navigation.py) onto the fixed grid, which gives a table
+# of source pixels (nearest) or of 4 pixels and weights
+# (bilinear). The tables are cached on disk, keyed by the
+# fixed grid and the target grid, so regridding a scan is a
+# single fancy-indexing gather
+#
+################################################################
+#
+#
+import hashlib,json,os
+import numpy as np
+from goes_navigation import lonlat_to_scan,projection_from_attrs
+from goes_geolocation import projection_attrs,scan_angles,grid_key
+
+ROW_CHUNK = 256 # target rows navigated at a time
+REGRID_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),'goes_regrid') # same folder from any working directory
+
+########################################
+# index tables
+########################################
+#
+def target_grid(bbox,res):
+    # cell centers of a regular grid over [lon_min, lat_min, lon_max, lat_max],
+    # rows run north to south (imshow's origin='upper')
+    n_lon = int(np.ceil((bbox[2]-bbox[0])/res))
+    n_lat = int(np.ceil((bbox[3]-bbox[1])/res))
+    lons = bbox[0]+res*(np.arange(n_lon)+0.5)
+    lats = bbox[3]-res*(np.arange(n_lat)+0.5)
+    return lons,lats
+
+def build_table(proj,xs,ys,bbox,res,method='nearest',row_chunk=ROW_CHUNK):
+    # (indices, weights) into the flattened fixed grid, -1 where the cell
+    # falls off the disk or outside the file's grid.
+    # nearest: indices (n_lat, n_lon), weights None
+    # bilinear: indices and weights (n_lat, n_lon, 4)
+    lons,lats = target_grid(bbox,res)
+    n_y,n_x = len(ys),len(xs)
+    dx,dy = (xs[-1]-xs[0])/(n_x-1),(ys[-1]-ys[0])/(n_y-1) # the fixed grid is uniform
+    n_corner = 1 if method=='nearest' else 4
+    indices = np.full((len(lats),len(lons),n_corner),-1,dtype=np.int32)
+    weights = None if method=='nearest' else np.zeros((len(lats),len(lons),4),dtype=np.float32)
+    for r_0 in range(0,len(lats),row_chunk):
+        lat_chunk = lats[r_0:r_0+row_chunk,None]
+        x,y = lonlat_to_scan(proj,np.broadcast_to(lons[None,:],(len(lat_chunk),len(lons))),
+                             np.broadcast_to(lat_chunk,(len(lat_chunk),len(lons))))
+        col_f,row_f = (x-xs[0])/dx,(y-ys[0])/dy # fractional pixel position
+        if method=='nearest':
+            cols,rows = np.rint(col_f),np.rint(row_f)
+            good = np.isfinite(cols) & (cols>=0) & (cols<n_x) & (rows>=0) & (rows<n_y)
+            indices[r_0:r_0+row_chunk,:,0] = np.where(good,rows*n_x+cols,-1)
+        elif method=='bilinear':
+            col_0,row_0 = np.floor(col_f),np.floor(row_f)
+            f_c,f_r = col_f-col_0,row_f-row_0
+            good = np.isfinite(col_0) & (col_0>=0) & (col_0<n_x-1) & (row_0>=0) & (row_0<n_y-1)
+            for ii,(d_r,d_c,w) in enumerate(((0,0,(1-f_r)*(1-f_c)),(0,1,(1-f_r)*f_c),
+                                             (1,0,f_r*(1-f_c)),(1,1,f_r*f_c))):
+                indices[r_0:r_0+row_chunk,:,ii] = np.where(good,(row_0+d_r)*n_x+col_0+d_c,-1)
+                weights[r_0:r_0+row_chunk,:,ii] = np.where(good,w,0.0)
+        else:
+            raise ValueError('Unknown regridding method: {}'.format(method))
+    return (indices[:,:,0] if method=='nearest' else indices),weights
+
+#
+########################################
+# regridder
+########################################
+#
+class Regridder(object):
+    def __init__(self,indices,weights,bbox,res,method):
+        self.indices,self.weights = indices,weights
+        self.bbox,self.res,self.method = list(bbox),res,method
+        self.valid = indices>=0
+        self.safe = np.where(self.valid,indices,0) # gather index, masked afterwards
+
+    @property
+    def shape(self):
+        return np.shape(self.indices)[0:2]
+
+    @property
+    def extent(self):
+        # imshow extent [lon_min, lon_max, lat_min, lat_max] of the target cells
+        n_lat,n_lon = self.shape
+        return [self.bbox[0],self.bbox[0]+n_lon*self.res,self.bbox[3]-n_lat*self.res,self.bbox[3]]
+
+    def _gather(self,flat):
+        # source values (float32, NaN = missing) at the table's pixels
+        vals = flat[self.safe].astype(np.float32)
+        vals[~self.valid] = np.nan
+        return vals
+
+    def regrid(self,data,quality=None):
+        # regrid a (y, x) scan - a (masked) array, or a PackedField, which
+        # is only decoded at the pixels in the table - onto the target grid
+        if hasattr(data,'raw'):
+            vals = self._gather(data.raw.ravel())
+            vals = vals*np.float32(data.scale)+np.float32(data.offset)
+            vals[~data.quality_mask(quality=quality).ravel()[self.safe]] = np.nan
+        else:
+            vals = self._gather(np.ma.filled(np.ma.asarray(data,dtype=np.float32),np.nan).ravel())
+        if self.method=='nearest':
+            return vals
+        # bilinear: weights are renormalized over the valid corners
+        w = np.where(np.isfinite(vals),self.weights,0.0)
+        w_sum = np.sum(w,axis=2)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            out = np.sum(np.where(w>0,vals,0.0)*w,axis=2)/w_sum
+        return np.where(w_sum>0.25,out,np.nan).astype(np.float32) # need most of the cell covered
+
+def cached_regridder(netcdf_file,bbox,res,method='nearest',cache_dir=REGRID_DIR):
+    # Regridder for the file's fixed grid onto the bbox at res degrees, loaded
+    # from the cache (built and saved the first time a grid/target is seen)
+    proj_attrs = projection_attrs(netcdf_file)
+    xs,ys = scan_angles(netcdf_file)
+    target = json.dumps({'bbox':[float(ii) for ii in bbox],'res':float(res),'method':method},sort_keys=True)
+    key = grid_key(proj_attrs,xs,ys)+'_'+hashlib.sha1(target.encode()).hexdigest()[0:12]
+    table_file = os.path.join(cache_dir,key+'.npz')
+    if os.path.isfile(table_file):
+        with np.load(table_file) as saved:
+            weights = saved['weights'] if method=='bilinear' else None
+            return Regridder(saved['indices'],weights,bbox,res,method)
+    indices,weights = build_table(projection_from_attrs(proj_attrs),xs,ys,bbox,res,method)
+    if os.path.isdir(cache_dir)==False:
+        os.makedirs(cache_dir,exist_ok=True)
+    tmp_file = table_file+'.tmp-{}.npz'.format(os.getpid())
+    np.savez(tmp_file,indices=indices,weights=np.zeros(0) if weights is None else weights,target=target)
+    os.replace(tmp_file,table_file)
+    return Regridder(indices,weights,bbox,res,method)
+
+if __name__ == '__main__':
+    import time
+    from netCDF4 import Dataset
+    from goes_packed import read_packed
+    sat_file = 'ABI-L2-LSTC_2020_153_17_OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc'
+    netcdf_file = Dataset(sat_file)
+    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
+    field = read_packed(sat_file)
+    for method in ('nearest','bilinear'):
+        t_start = time.time()
+        regridder = cached_regridder(netcdf_file,bbox,0.02,method)
+        t_table = time.time()-t_start
+        t_start = time.time()
+        lst_grid = regridder.regrid(field)
+        t_regrid = time.time()-t_start
+        print('{0}: {1} grid, table {2:2.2f} s, regrid {3:2.3f} s, {4:d} cells with data'.\
+              format(method,regridder.shape,t_table,t_regrid,int(np.sum(np.isfinite(lst_grid)))))
@@ -0,0 +1,178 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code reads only a lat/lon bounding box out of a GOES-16/17
+# fixed-grid file, instead of decoding the full 1500x2500 CONUS
+# grid. The bbox is mapped onto row/column slices of the fixed
+# grid, and only those hyperslabs of the data variable, its DQF
+# and the x/y scan angles are read.
+#
+# Files are opened with h5py, either from a local path or from a
+# remote blob through RangeFile, which turns h5py's reads into
+# byte-range requests - so only the HDF5 metadata and the chunks
+# covering the bbox are ever transferred
+#
+################################################################
+#
+#
+import io
+from collections import OrderedDict
+import numpy as np
+import h5py
+from goes_navigation import lonlat_to_scan
+
+########################################
+# byte-range file object for remote blobs
+########################################
+#
+class RangeFile(io.RawIOBase):
+    # read-only file object over any bucket with read_range(name,start,end)
+    # (see web_scraping/goes_fetch.py), blocks are cached in a small LRU
+    def __init__(self,bucket,name,size,block_size=1024*1024,max_blocks=64):
+        self.bucket,self.name,self.size = bucket,name,size
+        self.block_size,self.max_blocks = block_size,max_blocks
+        self.pos = 0
+        self.blocks = OrderedDict()
+        self.bytes_read = 0 # bytes actually requested from the bucket
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self,offset,whence=io.SEEK_SET):
+        if whence==io.SEEK_SET:
+            self.pos = offset
+        elif whence==io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.size+offset
+        return self.pos
+
+    def _block(self,block_indx):
+        if block_indx in self.blocks:
+            self.blocks.move_to_end(block_indx)
+            return self.blocks[block_indx]
+        start = block_indx*self.block_size
+        data = self.bucket.read_range(self.name,start,min(start+self.block_size,self.size))
+        self.bytes_read += len(data)
+        self.blocks[block_indx] = data
+        if len(self.blocks)>self.max_blocks:
+            self.blocks.popitem(last=False)
+        return data
+
+    def readinto(self,buf):
+        view = memoryview(buf).cast('B')
+        n_bytes = max(0,min(len(view),self.size-self.pos))
+        done = 0
+        while done<n_bytes:
+            block_indx,block_off = divmod(self.pos+done,self.block_size)
+            data = self._block(block_indx)[block_off:block_off+n_bytes-done]
+            view[done:done+len(data)] = data
+            done += len(data)
+        self.pos += done
+        return done
+
+    def read(self,n_bytes=-1):
+        n_bytes = self.size-self.pos if n_bytes is None or n_bytes<0 else n_bytes
+        buf = bytearray(max(0,min(n_bytes,self.size-self.pos)))
+        self.readinto(buf)
+        return bytes(buf)
+
+def open_goes(source,bucket=None,size=None):
+    # h5py file for a local path, or for a blob name in a bucket
+    if bucket is None:
+        return h5py.File(source,'r')
+    if size is None:
+        size = [ii['size'] for ii in bucket.list_blobs(source) if ii['name']==source][0]
+    return h5py.File(RangeFile(bucket,source,size),'r')
+
+#
+########################################
+# fixed grid helpers
+########################################
+#
+def _attr(var,name,default=None):
+    if name not in var.attrs:
+        return default
+    val = var.attrs[name]
+    if isinstance(val,bytes):
+        return val.decode()
+    return np.ravel(val)[0] if np.size(val)==1 else val
+
+def unpack(var,raw):
+    # apply _Unsigned/_FillValue/scale_factor/add_offset to raw values
+    # read with h5py, returns a float32 masked array
+    fill = _attr(var,'_FillValue')
+    if _attr(var,'_Unsigned')=='true' and raw.dtype.kind=='i':
+        raw = raw.view(raw.dtype.str.replace('i','u'))
+        fill = None if fill is None else np.array(fill).astype(raw.dtype.str.replace('u','i')).view(raw.dtype)
+    mask = np.zeros(np.shape(raw),dtype=bool) if fill is None else raw==fill
+    vals = raw.astype(np.float32)*np.float32(_attr(var,'scale_factor',1.0))+np.float32(_attr(var,'add_offset',0.0))
+    return np.ma.masked_array(vals,mask=mask)
+
+def goes_projection(h5):
+    # projection parameters from goes_imager_projection
+    proj_var = h5['goes_imager_projection']
+    return {'h':float(_attr(proj_var,'perspective_point_height')),
+            'r_eq':float(_attr(proj_var,'semi_major_axis')),
+            'r_pol':float(_attr(proj_var,'semi_minor_axis')),
+            'lambda_0':float(_attr(proj_var,'longitude_of_projection_origin')),
+            'sweep':_attr(proj_var,'sweep_angle_axis','x')}
+
+def bbox_slices(h5,bbox,pad=1,n_edge=64):
+    # [lon_min, lat_min, lon_max, lat_max] -> (row slice, col slice) of the
+    # fixed grid covering the bbox (the bbox is curved in scan-angle space,
+    # so its edges and interior are sampled before taking the extremes)
+    lon_s = np.linspace(bbox[0],bbox[2],n_edge)
+    lat_s = np.linspace(bbox[1],bbox[3],n_edge)
+    lons,lats = np.meshgrid(lon_s,lat_s)
+    x_s,y_s = lonlat_to_scan(goes_projection(h5),lons,lats)
+    if not np.any(np.isfinite(x_s)):
+        raise ValueError('Bounding box {} is not visible from the satellite'.format(bbox))
+    x_vals = unpack(h5['x'],h5['x'][:]).filled(np.nan)
+    y_vals = unpack(h5['y'],h5['y'][:]).filled(np.nan)
+    dx,dy = np.abs(np.nanmedian(np.diff(x_vals))),np.abs(np.nanmedian(np.diff(y_vals)))
+    cols = np.flatnonzero((x_vals>=np.nanmin(x_s)-dx/2.0) & (x_vals<=np.nanmax(x_s)+dx/2.0))
+    rows = np.flatnonzero((y_vals>=np.nanmin(y_s)-dy/2.0) & (y_vals<=np.nanmax(y_s)+dy/2.0))
+    if len(cols)==0 or len(rows)==0:
+        raise ValueError('Bounding box {} is outside of the file grid'.format(bbox))
+    row_sl = slice(max(rows.min()-pad,0),min(rows.max()+1+pad,len(y_vals)))
+    col_sl = slice(max(cols.min()-pad,0),min(cols.max()+1+pad,len(x_vals)))
+    return row_sl,col_sl
+
+#
+########################################
+# subset reader
+########################################
+#
+def read_subset(source,bbox,var_name='LST',bucket=None,with_dqf=True):
+    # read var_name (plus DQF and x/y) over the bbox only, from a local file
+    # or (with bucket) a remote blob, returns a dict of arrays and slices
+    with open_goes(source,bucket) as h5:
+        row_sl,col_sl = bbox_slices(h5,bbox)
+        var = h5[var_name]
+        subset = {'rows':row_sl,'cols':col_sl,'projection':goes_projection(h5),
+                  'data':unpack(var,var[row_sl,col_sl]), # only this hyperslab is read
+                  'x':unpack(h5['x'],h5['x'][col_sl]).filled(np.nan),
+                  'y':unpack(h5['y'],h5['y'][row_sl]).filled(np.nan),
+                  'units':_attr(var,'units'),'long_name':_attr(var,'long_name')}
+        if with_dqf and 'DQF' in h5:
+            subset['dqf'] = h5['DQF'][row_sl,col_sl]
+    return subset
+
+if __name__ == '__main__':
+    sat_file = 'ABI-L2-LSTC_2020_153_17_OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc'
+    bbox = [-74.2591,40.4774,-73.7004,40.9176] # New York City bounding box
+    subset = read_subset(sat_file,bbox)
+    print('rows {0}-{1}, cols {2}-{3}: {4} pixels of {5} [{6}]'.format(subset['rows'].start,subset['rows'].stop,
+                                                                    subset['cols'].start,subset['cols'].stop,
+                                                                    np.size(subset['data']),subset['long_name'],
+                                                                    subset['units']))
+    print('mean over the bbox: {0:2.2f}'.format(np.ma.mean(subset['data'])))
@@ -0,0 +1,360 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code watches a local folder for new GOES-16/17 files and
+# processes each scan as soon as it is complete, instead of
+# re-running the plotting scripts by hand:
+#   - new files are detected with inotify (through ctypes, on
+#     Linux), or by polling when inotify isn't available, and only
+#     complete files are queued (closed/renamed into place, or with
+#     a stable size, and with an HDF5 signature)
+#   - each file runs through a chain of stages in a worker pool
+#     (subset, navigate, point extraction, render), then through
+#     'sinks' in the main process, which hold state (composites,
+#     time series files)
+#   - the latency of every stage, and end to end, is recorded
+#     and written to a metrics .json
+#   - at most max_in_flight files are in the pool at once, and
+#     the queue of waiting files is capped, so a burst after an
+#     outage can't exhaust the memory: past max_queue, files are
+#     left on disk (and picked up by a rescan of the folder once
+#     the queue has drained) or, with drop_oldest, the oldest
+#     waiting files are dropped
+#
+################################################################
+#
+#
+import collections,ctypes,ctypes.util,json,os,select,struct,sys,time
+from concurrent.futures import ProcessPoolExecutor,wait,FIRST_COMPLETED
+import numpy as np
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+IN_CLOSE_WRITE,IN_MOVED_TO = 0x00000008,0x00000080
+
+########################################
+# file detection
+########################################
+#
+def is_complete(path):
+    # finished netCDF4/HDF5 file (not a partial download)
+    name = os.path.basename(path)
+    if name.endswith(('.part','.tmp')) or name.startswith(('tmp-','.')):
+        return False
+    try:
+        with open(path,'rb') as fp:
+            return fp.read(8)==HDF5_SIGNATURE
+    except IOError:
+        return False
+
+class InotifyWatch(object):
+    # files closed after writing, or moved into watch_dir (Linux only)
+    def __init__(self,watch_dir):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK|getattr(os,'O_CLOEXEC',0))
+        if self.fd<0 or libc.inotify_add_watch(self.fd,watch_dir.encode(),IN_CLOSE_WRITE|IN_MOVED_TO)<0:
+            raise OSError(ctypes.get_errno(),'inotify is not available')
+        self.watch_dir = watch_dir
+
+    def poll(self,timeout):
+        ready,_,_ = select.select([self.fd],[],[],timeout)
+        if len(ready)==0:
+            return []
+        buf = os.read(self.fd,65536)
+        names,pos = [],0
+        while pos+16<=len(buf):
+            _,mask,_,name_len = struct.unpack_from('iIII',buf,pos)
+            names.append(buf[pos+16:pos+16+name_len].rstrip(b'\0').decode())
+            pos += 16+name_len
+        return [os.path.join(self.watch_dir,ii) for ii in names if ii!='']
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatch(object):
+    # files whose size and mtime haven't changed for settle seconds
+    def __init__(self,watch_dir,settle=2.0):
+        self.watch_dir,self.settle = watch_dir,settle
+        self.seen = {} # path -> (size, mtime, first time it looked like this)
+
+    def poll(self,timeout):
+        time.sleep(timeout)
+        now,stable,present = time.time(),[],set()
+        for entry in os.scandir(self.watch_dir):
+            if not entry.is_file():
+                continue
+            present.add(entry.path)
+            stat = entry.stat()
+            key = (stat.st_size,stat.st_mtime)
+            if self.seen.get(entry.path,(None,None,None))[0:2]!=key:
+                self.seen[entry.path] = key+(now,)
+            elif now-self.seen[entry.path][2]>=self.settle:
+                stable.append(entry.path)
+        for path in set(self.seen)-present: # deleted or moved away
+            del self.seen[path]
+        return stable
+
+    def close(self):
+        pass
+
+#
+########################################
+# stages (run in the workers) and sinks (main process)
+########################################
+#
+# a stage is a picklable callable (path, ctx) -> ctx, where ctx is a dict
+# of small results passed along the chain; stages may keep per-worker state
+#
+class SubsetStage(object):
+    name = 'subset'
+    def __init__(self,bbox,var_name='LST'):
+        self.bbox,self.var_name = bbox,var_name
+
+    def __call__(self,path,ctx):
+        from goes_subset import read_subset
+        ctx['subset'] = read_subset(path,self.bbox,self.var_name)
+        return ctx
+
+class NavigateStage(object):
+    name = 'navigate'
+    def __call__(self,path,ctx):
+        # lat/lon of the subset's pixels (closed-form navigation)
+        from goes_navigation import grid_to_lonlat
+        subset = ctx['subset']
+        ctx['subset']['lons'],ctx['subset']['lats'] = grid_to_lonlat(subset['projection'],subset['x'],subset['y'])
+        return ctx
+
+class PointStage(object):
+    name = 'points'
+    def __init__(self,lons,lats,var_name='LST'):
+        self.lons,self.lats,self.var_name = np.asarray(lons),np.asarray(lats),var_name
+        self.pixels = None # (rows, cols, grid signature), found once per worker
+
+    def __call__(self,path,ctx):
+        import h5py
+        from goes_points import point_pixels,extract_file,_grid_signature
+        if self.pixels is None:
+            with h5py.File(path,'r') as h5:
+                signature = _grid_signature(h5)
+            self.pixels = point_pixels(path,self.lons,self.lats)+(signature,)
+        rows,cols,signature = self.pixels
+        ctx['time'],ctx['points'],ctx['points_dqf'] = extract_file(path,self.lons,self.lats,rows,cols,
+                                                                   signature,self.var_name)
+        return ctx
+
+class RenderStage(object):
+    name = 'render'
+    def __init__(self,bbox,out_dir,res=0.02,var_name='LST',**renderer_kwargs):
+        self.bbox,self.out_dir,self.res,self.var_name = bbox,out_dir,res,var_name
+        self.renderer_kwargs = renderer_kwargs
+        self.source,self.renderer = None,None
+
+    def __call__(self,path,ctx):
+        from frame_renderer import FrameRenderer,GOESFrames
+        import matplotlib.image as mpimg
+        if self.renderer is None:
+            self.source = GOESFrames(self.bbox,self.res,self.var_name)
+            self.renderer = FrameRenderer(self.bbox,**self.renderer_kwargs)
+            if os.path.isdir(self.out_dir)==False:
+                os.makedirs(self.out_dir,exist_ok=True)
+        rgba = self.renderer.render(*self.source(path))
+        ctx['frame'] = os.path.join(self.out_dir,os.path.basename(path).replace('.nc','.png'))
+        mpimg.imsave(ctx['frame'],rgba)
+        return ctx
+
+class CompositeSink(object):
+    # running composite of the subsets (goes_composite.py), saved every save_every
+    # scans and when the watcher stops
+    name = 'composite'
+    def __init__(self,out_file,quality=None,save_every=12):
+        self.out_file,self.quality,self.save_every = out_file,quality,save_every
+        self.comp = None
+
+    def __call__(self,path,ctx):
+        from goes_composite import Compositor
+        vals = ctx['subset']['data'].filled(np.nan)
+        if self.quality is not None and 'dqf' in ctx['subset']:
+            vals[(ctx['subset']['dqf'] & self.quality)!=0] = np.nan # DQF bits that must be clear
+        if self.comp is None:
+            self.comp = Compositor(np.shape(vals))
+        self.comp.update(vals)
+        if self.comp.n_scans%self.save_every==0:
+            self.comp.save(self.out_file)
+
+    def close(self):
+        if self.comp is not None and self.comp.n_scans%self.save_every!=0: # last partial composite
+            self.comp.save(self.out_file)
+
+class PointSink(object):
+    # appends the point values of every scan to a .csv
+    name = 'point_file'
+    def __init__(self,csv_file,point_names):
+        self.csv_file,self.point_names = csv_file,point_names
+
+    def __call__(self,path,ctx):
+        new_file = not os.path.isfile(self.csv_file)
+        with open(self.csv_file,'a') as fp:
+            if new_file:
+                fp.write('time,'+','.join(self.point_names)+'\n')
+            fp.write('{0},'.format(ctx['time'])+','.join(['{0:2.2f}'.format(ii) for ii in ctx['points']])+'\n')
+
+def _stage_name(stage):
+    return getattr(stage,'name',getattr(stage,'__name__',type(stage).__name__))
+
+_worker = {} # per-process stage chain
+
+def _init_worker(stages):
+    _worker['stages'] = stages
+
+def _run_stages(path):
+    # worker: run the chain on one file, timing every stage
+    ctx,timings = {},[]
+    for stage in _worker['stages']:
+        t_0 = time.time()
+        ctx = stage(path,ctx)
+        timings.append((_stage_name(stage),time.time()-t_0))
+    return ctx,timings
+
+#
+########################################
+# watcher
+########################################
+#
+class GOESWatcher(object):
+    def __init__(self,watch_dir,stages,sinks=(),prefix='ABI-',n_workers=2,max_in_flight=4,
+                 max_queue=1000,drop_oldest=False,poll_interval=1.0,use_inotify=True,
+                 state_file=None,metrics_file=None,history=1000):
+        self.watch_dir,self.stages,self.sinks,self.prefix = watch_dir,list(stages),list(sinks),prefix
+        self.n_workers,self.max_in_flight = n_workers,max_in_flight
+        self.max_queue,self.drop_oldest,self.poll_interval = max_queue,drop_oldest,poll_interval
+        self.state_file = os.path.join(watch_dir,'.watcher_state.json') if state_file is None else state_file
+        self.metrics_file = os.path.join(watch_dir,'.watcher_metrics.json') if metrics_file is None else metrics_file
+        self.done = set()
+        if os.path.isfile(self.state_file):
+            with open(self.state_file,'r') as json_file:
+                self.done = set(json.load(json_file))
+        self.queue = collections.OrderedDict() # path -> time detected
+        self.claimed = set(self.done) # queued, in flight, done or dropped: never queued again
+        self.overflow = False # files were left on disk because the queue was full
+        self.latency = collections.defaultdict(lambda:collections.deque(maxlen=history))
+        self.counts = collections.Counter()
+        self.watch = None
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self.watch = InotifyWatch(watch_dir)
+            except OSError:
+                self.watch = None
+        if self.watch is None:
+            self.watch = PollingWatch(watch_dir)
+
+    def _enqueue(self,paths):
+        now = time.time()
+        for path in paths:
+            if os.path.basename(path).startswith(self.prefix) and path not in self.claimed and is_complete(path):
+                if len(self.queue)>=self.max_queue:
+                    if self.drop_oldest:
+                        self.queue.popitem(last=False) # newest scans matter most in real time (stays claimed)
+                        self.counts['dropped'] += 1
+                    else:
+                        self.overflow = True # left unclaimed, the file waits on disk for a rescan
+                        continue
+                self.queue[path] = now
+                self.claimed.add(path)
+
+    def _rescan(self):
+        # queue the files in the folder that aren't claimed yet (backlog, overflow)
+        self.overflow = False
+        self._enqueue([entry.path for entry in os.scandir(self.watch_dir) if entry.is_file()])
+
+    def _finish(self,path,detected,ctx,timings):
+        for name,seconds in timings:
+            self.latency[name].append(seconds)
+        for sink in self.sinks:
+            t_0 = time.time()
+            sink(path,ctx)
+            self.latency[_stage_name(sink)].append(time.time()-t_0)
+        self.latency['end_to_end'].append(time.time()-detected)
+        self.done.add(path)
+        self.counts['processed'] += 1
+
+    def metrics(self):
+        # per stage latency summary [s]
+        summary = {}
+        for name,vals in self.latency.items():
+            vals = np.array(vals)
+            summary[name] = {'n':len(vals),'mean':float(np.mean(vals)),'p50':float(np.percentile(vals,50)),
+                             'p95':float(np.percentile(vals,95)),'max':float(np.max(vals))}
+        return {'stages':summary,'queued':len(self.queue),'counts':dict(self.counts)}
+
+    def _save(self):
+        for filename,obj in ((self.state_file,sorted(self.done)),(self.metrics_file,self.metrics())):
+            with open(filename+'.tmp','w') as json_file:
+                json.dump(obj,json_file)
+            os.replace(filename+'.tmp',filename)
+
+    def run(self,max_files=None,idle_timeout=None):
+        # watch until max_files are processed or nothing new arrives for
+        # idle_timeout seconds (None: forever)
+        self._rescan() # backlog
+        try:
+            self._watch(max_files,idle_timeout)
+        finally:
+            self.watch.close()
+            for sink in self.sinks:
+                if hasattr(sink,'close'):
+                    sink.close() # e.g. save partial composites
+            self._save()
+        return self.metrics()
+
+    def _watch(self,max_files,idle_timeout):
+        in_flight = {}
+        last_activity = time.time()
+        with ProcessPoolExecutor(max_workers=self.n_workers,initializer=_init_worker,
+                                 initargs=(self.stages,)) as executor:
+            while True:
+                if self.overflow and len(self.queue)<=self.max_queue//2:
+                    self._rescan() # files skipped while the queue was full
+                while len(in_flight)<self.max_in_flight and len(self.queue)>0:
+                    path,detected = self.queue.popitem(last=False)
+                    in_flight[executor.submit(_run_stages,path)] = (path,detected)
+                if len(in_flight)>0:
+                    finished,_ = wait(list(in_flight),timeout=self.poll_interval,return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        path,detected = in_flight.pop(future)
+                        try:
+                            ctx,timings = future.result()
+                            self._finish(path,detected,ctx,timings)
+                        except Exception as err:
+                            print('Failed on {0}: {1}'.format(path,err))
+                            self.done.add(path) # don't retry a broken file forever
+                            self.counts['failed'] += 1
+                        last_activity = time.time()
+                    if len(finished)>0:
+                        self._save()
+                    self._enqueue(self.watch.poll(0.0))
+                else:
+                    self._enqueue(self.watch.poll(self.poll_interval))
+                if len(self.queue)>0:
+                    last_activity = time.time()
+                if max_files is not None and self.counts['processed']+self.counts['failed']>=max_files:
+                    break
+                if idle_timeout is not None and len(in_flight)==0 and len(self.queue)==0 and \
+                   time.time()-last_activity>idle_timeout:
+                    break
+
+if __name__ == '__main__':
+    watch_dir = './goes_cache/incoming/' # folder new GOES files land in
+    if os.path.isdir(watch_dir)==False:
+        os.makedirs(watch_dir)
+    nyc_bbox = [-74.2591,40.4774,-73.7004,40.9176] # New York City bounding box
+    points = {'NYC':(-74.0171,40.70202),'Central Park':(-73.9654,40.7829)}
+    stages = [SubsetStage(nyc_bbox),NavigateStage(),
+              PointStage([ii[0] for ii in points.values()],[ii[1] for ii in points.values()]),
+              RenderStage([-130.2328,21.7423,-63.6722,52.8510],'./LST_frames/',vmin=270.0,vmax=330.0,label='LST [K]')]
+    sinks = [CompositeSink('./NYC_LST_composite.npz'),PointSink('./NYC_LST_points.csv',list(points))]
+    watcher = GOESWatcher(watch_dir,stages,sinks)
+    print('watching {0} ({1})'.format(watch_dir,type(watcher.watch).__name__))
+    metrics = watcher.run()
+    for name,stats in metrics['stages'].items():
+        print('{0}: n={1:d}, p50 {2:2.3f} s, p95 {3:2.3f} s'.format(name,stats['n'],stats['p50'],stats['p95']))
@@ -0,0 +1,231 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code rechunks an on-disk (time, y, x) stack - a GOES cube
+# (goes_cube.py), a .npy memmap, an h5py/netCDF4 variable or a
+# stack of WRF time series - into pixel-major chunks:
+#
+#   (y-tile, x-tile, time chunk)
+#
+# so the time series of a pixel is read from a handful of chunks
+# instead of touching every chunk of the time-major archive.
+#
+# The work is planned against a RAM budget:
+#   - one pass, when a band of tile rows over a full output time
+#     chunk fits in memory: read the band, cut it into tiles,
+#     write the chunks
+#   - two passes, otherwise: time slabs are first cut into tiles
+#     and appended to one raw scratch file per tile, then each
+#     tile's output chunks are cut from its scratch file
+# Output chunks are byte-shuffled and zlib compressed
+#
+################################################################
+#
+#
+import json,os,shutil,sys,time,zlib
+import numpy as np
+
+STORE_JSON = 'rechunk.json'
+
+########################################
+# source access
+########################################
+#
+def _block_reader(source):
+    # read(t_sl,y_sl,x_sl) for cubes with a read() method (GOESCube),
+    # and for anything that can be sliced (memmaps, h5py/netCDF4 variables)
+    if hasattr(source,'read') and hasattr(source,'shape'):
+        return source.read
+    def _read(t_sl,y_sl,x_sl):
+        return np.asarray(source[t_sl,y_sl,x_sl])
+    return _read
+
+#
+########################################
+# compression (byte shuffle + zlib)
+########################################
+#
+def encode_chunk(arr,level=4,shuffle=True):
+    raw = np.ascontiguousarray(arr)
+    if shuffle and raw.dtype.itemsize>1:
+        raw = raw.view(np.uint8).reshape(-1,raw.dtype.itemsize).T # group bytes of equal significance
+    return zlib.compress(np.ascontiguousarray(raw).tobytes(),level)
+
+def decode_chunk(buf,shape,dtype,shuffle=True):
+    dtype = np.dtype(dtype)
+    raw = np.frombuffer(zlib.decompress(buf),dtype=np.uint8)
+    if shuffle and dtype.itemsize>1:
+        raw = np.ascontiguousarray(raw.reshape(dtype.itemsize,-1).T)
+    return raw.view(dtype).reshape(shape)
+
+#
+########################################
+# planning
+########################################
+#
+def rechunk_plan(shape,tile=(64,64),time_chunk=1024,max_mem=512*1024**2,itemsize=4):
+    # how to rechunk a (time, y, x) array of this shape within max_mem bytes
+    n_t,n_y,n_x = shape
+    time_chunk = min(time_chunk,n_t)
+    chunk_bytes = tile[0]*tile[1]*time_chunk*itemsize
+    if 2*chunk_bytes>max_mem:
+        raise ValueError('An output chunk ({0:2.1f} MB) does not fit in the memory budget ({1:2.1f} MB), '
+                         'use smaller tiles or time chunks'.format(chunk_bytes/1e6,max_mem/1e6))
+    band_bytes = time_chunk*tile[0]*n_x*itemsize # one band of tile rows over an output time chunk
+    if 2*band_bytes<=max_mem:
+        return {'n_passes':1,'time_chunk':time_chunk,'tile':list(tile),'t_slab':time_chunk}
+    # two passes: time slabs as large as the budget allows (a whole number of
+    # slabs per output time chunk keeps the pieces aligned)
+    t_slab = max(1,int(max_mem//(2*tile[0]*n_x*itemsize)))
+    while time_chunk%t_slab!=0:
+        t_slab -= 1
+    return {'n_passes':2,'time_chunk':time_chunk,'tile':list(tile),'t_slab':t_slab}
+
+#
+########################################
+# rechunking
+########################################
+#
+def _chunk_path(store_dir,y_t,x_t,t_c):
+    return os.path.join(store_dir,'{0:d}'.format(y_t),'{0:d}'.format(x_t),'{0:d}.z'.format(t_c))
+
+def _write_band(store_dir,band,y_t,t_c,plan,level,shuffle):
+    # cut a (time, tile rows, x) band into tiles and write them pixel-major
+    t_y,t_x = plan['tile']
+    for x_t in range(-(-band.shape[2]//t_x)):
+        tile_vals = np.transpose(band[:,:,x_t*t_x:(x_t+1)*t_x],(1,2,0)) # (y, x, time)
+        path = _chunk_path(store_dir,y_t,x_t,t_c)
+        if os.path.isdir(os.path.dirname(path))==False:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'wb') as fp:
+            fp.write(encode_chunk(tile_vals,level,shuffle))
+
+def rechunk(source,store_dir,tile=(64,64),time_chunk=1024,max_mem=512*1024**2,
+            times=None,level=4,shuffle=True,tmp_dir=None,verbose=False):
+    # rechunk a (time, y, x) source into a pixel-major TileStore in store_dir
+    read = _block_reader(source)
+    n_t,n_y,n_x = source.shape
+    dtype = np.dtype(getattr(source,'dtype',np.float32))
+    plan = rechunk_plan((n_t,n_y,n_x),tile,time_chunk,max_mem,dtype.itemsize)
+    t_y,t_x = plan['tile']
+    c_t = plan['time_chunk']
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+    n_bands,n_tchunks = -(-n_y//t_y),-(-n_t//c_t)
+    t_start = time.time()
+    if plan['n_passes']==1:
+        for t_c in range(n_tchunks):
+            for y_t in range(n_bands):
+                band = read(slice(t_c*c_t,(t_c+1)*c_t),slice(y_t*t_y,(y_t+1)*t_y),slice(None))
+                _write_band(store_dir,band,y_t,t_c,plan,level,shuffle)
+            if verbose:
+                print('time chunk {0:d}/{1:d} ({2:2.1f} s)'.format(t_c+1,n_tchunks,time.time()-t_start))
+    else:
+        # pass 1: time slabs appended to one raw (time, tile_y, tile_x) file per tile
+        tmp_dir = os.path.join(store_dir,'_pieces') if tmp_dir is None else tmp_dir
+        if os.path.isdir(tmp_dir)==False:
+            os.makedirs(tmp_dir)
+        t_slab = plan['t_slab']
+        n_slabs = -(-n_t//t_slab)
+        for s_i in range(n_slabs):
+            for y_t in range(n_bands):
+                band = read(slice(s_i*t_slab,(s_i+1)*t_slab),slice(y_t*t_y,(y_t+1)*t_y),slice(None))
+                for x_t in range(-(-n_x//t_x)):
+                    with open(os.path.join(tmp_dir,'{0:d}_{1:d}.raw'.format(y_t,x_t)),'wb' if s_i==0 else 'ab') as fp:
+                        fp.write(np.ascontiguousarray(band[:,:,x_t*t_x:(x_t+1)*t_x],dtype=dtype).tobytes())
+            if verbose:
+                print('pass 1: slab {0:d}/{1:d} ({2:2.1f} s)'.format(s_i+1,n_slabs,time.time()-t_start))
+        # pass 2: each tile's output chunks from its scratch file
+        for y_t in range(n_bands):
+            for x_t in range(-(-n_x//t_x)):
+                piece_file = os.path.join(tmp_dir,'{0:d}_{1:d}.raw'.format(y_t,x_t))
+                pieces = np.memmap(piece_file,dtype=dtype,mode='r',
+                                   shape=(n_t,min(t_y,n_y-y_t*t_y),min(t_x,n_x-x_t*t_x)))
+                for t_c in range(n_tchunks):
+                    path = _chunk_path(store_dir,y_t,x_t,t_c)
+                    if os.path.isdir(os.path.dirname(path))==False:
+                        os.makedirs(os.path.dirname(path))
+                    with open(path,'wb') as fp:
+                        fp.write(encode_chunk(np.transpose(pieces[t_c*c_t:(t_c+1)*c_t],(1,2,0)),level,shuffle))
+                del pieces
+                os.remove(piece_file) # free the scratch space as tiles finish
+            if verbose:
+                print('pass 2: tile row {0:d}/{1:d} ({2:2.1f} s)'.format(y_t+1,n_bands,time.time()-t_start))
+        shutil.rmtree(tmp_dir,ignore_errors=True)
+    meta = {'shape':[n_t,n_y,n_x],'dtype':dtype.str,'tile':[t_y,t_x],'time_chunk':c_t,
+            'shuffle':shuffle,'plan':plan}
+    if times is not None:
+        np.save(os.path.join(store_dir,'times.npy'),np.asarray(times))
+    with open(os.path.join(store_dir,STORE_JSON),'w') as json_file:
+        json.dump(meta,json_file)
+    return TileStore(store_dir)
+
+#
+########################################
+# pixel-major reader
+########################################
+#
+class TileStore(object):
+    def __init__(self,store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir,STORE_JSON),'r') as json_file:
+            self.meta = json.load(json_file)
+        self.shape = tuple(self.meta['shape'])
+        self.dtype = np.dtype(self.meta['dtype'])
+        times_file = os.path.join(store_dir,'times.npy')
+        self.times = np.load(times_file) if os.path.isfile(times_file) else None
+
+    def read_chunk(self,y_t,x_t,t_c):
+        # one (tile_y, tile_x, time chunk) block (edge chunks are smaller)
+        n_t,n_y,n_x = self.shape
+        t_y,t_x = self.meta['tile']
+        c_t = self.meta['time_chunk']
+        shape = (min(t_y,n_y-y_t*t_y),min(t_x,n_x-x_t*t_x),min(c_t,n_t-t_c*c_t))
+        with open(_chunk_path(self.store_dir,y_t,x_t,t_c),'rb') as fp:
+            return decode_chunk(fp.read(),shape,self.dtype,self.meta['shuffle'])
+
+    def read_tile(self,y_t,x_t,t_sl=slice(None)):
+        # (tile_y, tile_x, time) for one tile over a time slice
+        t_0,t_1,_ = t_sl.indices(self.shape[0])
+        c_t = self.meta['time_chunk']
+        if t_1<=t_0: # empty time slice, no chunk to read
+            n_t,n_y,n_x = self.shape
+            t_y,t_x = self.meta['tile']
+            return np.empty((min(t_y,n_y-y_t*t_y),min(t_x,n_x-x_t*t_x),0),dtype=self.dtype)
+        parts = [self.read_chunk(y_t,x_t,ii) for ii in range(t_0//c_t,-(-t_1//c_t))]
+        tile_vals = np.concatenate(parts,axis=2)
+        return tile_vals[:,:,t_0-(t_0//c_t)*c_t:t_1-(t_0//c_t)*c_t]
+
+    def read_pixels(self,rows,cols,t_sl=slice(None)):
+        # time series at pixels (rows, cols), shape (time, n_pixels),
+        # each tile is decompressed once for all of its pixels
+        rows,cols = np.atleast_1d(rows),np.atleast_1d(cols)
+        t_y,t_x = self.meta['tile']
+        t_0,t_1,_ = t_sl.indices(self.shape[0])
+        out = np.empty((max(t_1-t_0,0),len(rows)),dtype=self.dtype)
+        tile_ids = np.stack((rows//t_y,cols//t_x),axis=1)
+        for y_t,x_t in np.unique(tile_ids,axis=0):
+            indx = np.flatnonzero((tile_ids[:,0]==y_t) & (tile_ids[:,1]==x_t))
+            tile_vals = self.read_tile(y_t,x_t,t_sl)
+            out[:,indx] = tile_vals[rows[indx]-y_t*t_y,cols[indx]-x_t*t_x].T
+        return out
+
+if __name__ == '__main__':
+    from goes_cube import GOESCube
+    cube_dir = sys.argv[1] if len(sys.argv)>1 else './goes_cube_maps/' # time-major cube (see goes_cube.py)
+    store_dir = './goes_tiles/'
+    cube = GOESCube(cube_dir)
+    t_start = time.time()
+    tiles = rechunk(cube,store_dir,tile=(64,64),time_chunk=288,max_mem=256*1024**2,times=cube.times,verbose=True)
+    print('rechunked {0} in {1:2.1f} s ({2} pass(es))'.format(cube.shape,time.time()-t_start,tiles.meta['plan']['n_passes']))
+    t_start = time.time()
+    nyc_cube = cube.read_pixels([318],[1849])
+    t_cube = time.time()-t_start
+    t_start = time.time()
+    nyc_tiles = tiles.read_pixels([318],[1849])
+    t_tiles = time.time()-t_start
+    print('NYC time series: {0:2.4f} s from the cube, {1:2.4f} s from the tiles (identical: {2})'.\
+          format(t_cube,t_tiles,np.array_equal(nyc_cube,nyc_tiles,equal_nan=True)))
@@ -0,0 +1,118 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# Tests for asos_downloader.py against a local pyftpdlib server
+# standing in for the NCEI FTP server: pooled parallel downloads,
+# REST resume of truncated files and the SIZE check
+#
+################################################################
+#
+#
+import os,sys,threading
+import pytest
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','web_scraping'))
+from asos_downloader import FTPPool,download_file,download_files,PART_SUFFIX
+
+pyftpdlib = pytest.importorskip('pyftpdlib')
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+class RecordingHandler(FTPHandler):
+    # records REST offsets and connections; SIZE can be disabled or faked
+    rest_offsets,connections = [],[]
+    size_reply = 'real' # 'real', 'unsupported' or a fake size (int)
+
+    def on_connect(self):
+        RecordingHandler.connections.append(self.remote_port)
+
+    def ftp_REST(self,line):
+        RecordingHandler.rest_offsets.append(int(line))
+        return FTPHandler.ftp_REST(self,line)
+
+    def ftp_SIZE(self,path):
+        if RecordingHandler.size_reply=='unsupported':
+            self.respond('550 SIZE not allowed.')
+        elif RecordingHandler.size_reply!='real':
+            self.respond('213 {}'.format(RecordingHandler.size_reply))
+        else:
+            return FTPHandler.ftp_SIZE(self,path)
+
+@pytest.fixture
+def ftp_server(tmp_path):
+    # local anonymous FTP server over tmp_path/remote with a few .dat files
+    remote = tmp_path/'remote'
+    remote.mkdir()
+    contents = {}
+    for ii in range(8):
+        name = '64060KCQT2020{0:02d}.dat'.format(ii+1)
+        contents[name] = os.urandom(50000+1000*ii)
+        (remote/name).write_bytes(contents[name])
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(remote))
+    RecordingHandler.authorizer = authorizer
+    RecordingHandler.rest_offsets,RecordingHandler.connections = [],[]
+    RecordingHandler.size_reply = 'real'
+    server = ThreadedFTPServer(('127.0.0.1',0),RecordingHandler)
+    thread = threading.Thread(target=server.serve_forever,kwargs={'timeout':0.1},daemon=True)
+    thread.start()
+    local = tmp_path/'local'
+    local.mkdir()
+    yield server.address[1],contents,local
+    server.close_all()
+
+def test_parallel_pool(ftp_server):
+    port,contents,local = ftp_server
+    jobs = [('/'+ii,str(local/ii)) for ii in contents]
+    with FTPPool('127.0.0.1',size=3,port=port) as pool:
+        results = download_files(pool,jobs,retries=0,verbose=False)
+    assert all(ii=='downloaded' for ii in results.values())
+    for name,data in contents.items():
+        assert (local/name).read_bytes()==data
+    assert len(RecordingHandler.connections)<=3 # connections are reused, never more than the pool size
+    with FTPPool('127.0.0.1',size=3,port=port) as pool:
+        results = download_files(pool,jobs,retries=0,verbose=False)
+    assert all(ii=='skipped' for ii in results.values())
+
+def test_rest_resume(ftp_server):
+    port,contents,local = ftp_server
+    name = sorted(contents)[0]
+    (local/(name+PART_SUFFIX)).write_bytes(contents[name][0:20000]) # interrupted transfer
+    with FTPPool('127.0.0.1',size=1,port=port) as pool:
+        status = download_file(pool,'/'+name,str(local/name),retries=0)
+    assert status=='resumed'
+    assert RecordingHandler.rest_offsets==[20000]
+    assert (local/name).read_bytes()==contents[name]
+    assert not os.path.isfile(str(local/(name+PART_SUFFIX)))
+
+def test_size_mismatch(ftp_server):
+    port,contents,local = ftp_server
+    name = sorted(contents)[0]
+    RecordingHandler.size_reply = len(contents[name])+10 # server reports more than it sends
+    with FTPPool('127.0.0.1',size=1,port=port) as pool:
+        with pytest.raises(IOError):
+            download_file(pool,'/'+name,str(local/name),retries=0)
+    assert not os.path.isfile(str(local/name)) # never given the final name
+
+def test_truncated_file_without_size(ftp_server):
+    port,contents,local = ftp_server
+    name = sorted(contents)[1]
+    RecordingHandler.size_reply = 'unsupported'
+    (local/name).write_bytes(contents[name][0:12345]) # truncated, and SIZE can't tell
+    with FTPPool('127.0.0.1',size=1,port=port) as pool:
+        status = download_file(pool,'/'+name,str(local/name),retries=0)
+    assert status=='resumed'
+    assert RecordingHandler.rest_offsets==[12345]
+    assert (local/name).read_bytes()==contents[name]
+
+def test_complete_file_without_size(ftp_server):
+    port,contents,local = ftp_server
+    name = sorted(contents)[2]
+    RecordingHandler.size_reply = 'unsupported'
+    (local/name).write_bytes(contents[name]) # complete, but can't be verified by SIZE
+    with FTPPool('127.0.0.1',size=1,port=port) as pool:
+        download_file(pool,'/'+name,str(local/name),retries=0)
+    assert RecordingHandler.rest_offsets==[len(contents[name])] # resumed at its end, nothing re-sent
+    assert (local/name).read_bytes()==contents[name]
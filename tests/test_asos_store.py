@@ -0,0 +1,37 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# Tests for asos_store.py: empty files, and monthly files that
+# are downloaded again after they were updated
+#
+################################################################
+#
+#
+import os,sys
+import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','web_scraping'))
+from asos_reader import synthetic_6406_file
+from asos_store import ASOSStore
+
+def test_empty_file(tmp_path):
+    dat_file = tmp_path/'64060KCQT202001.dat'
+    dat_file.write_bytes(b'')
+    store = ASOSStore(str(tmp_path/'store'))
+    assert store.ingest([str(dat_file)])==[]
+    assert store.partitions=={}
+
+def test_updated_file_is_merged_again(tmp_path):
+    dat_file = str(tmp_path/'64060KCQT202001.dat')
+    synthetic_6406_file(dat_file,n_days=1)
+    store = ASOSStore(str(tmp_path/'store'))
+    keys = store.ingest([dat_file])
+    assert store.partitions[keys[0]]['n_rows']==24*60
+    assert store.ingest([dat_file])==[] # unchanged, not parsed again
+    synthetic_6406_file(dat_file,n_days=2) # the month file grew
+    assert ASOSStore(str(tmp_path/'store')).ingest([dat_file])==keys
+    store = ASOSStore(str(tmp_path/'store'))
+    assert store.partitions[keys[0]]['n_rows']==2*24*60
+    t_vec = store.read_partition(keys[0],['time'])['time']
+    assert np.all(np.diff(t_vec)>np.timedelta64(0,'m'))
@@ -10,9 +10,13 @@
 ################################################################
 #
 from ftplib import FTP
-import csv,os,datetime
+import os
 import numpy as np
 import matplotlib.pyplot as plt
+from asos_reader import read_asos_file
+from asos_downloader import FTPPool,download_files,ASOS_HOST,ASOS_ROOT
+from asos_catalog import ASOSCatalog
+from asos_stations import load_stations,StationIndex
 
 plt.style.use('ggplot')
 
@@ -22,11 +26,14 @@ plt.style.use('ggplot')
 #
 ftp =  FTP('ftp.ncdc.noaa.gov') # ftp access to ncdc.noaa.gov
 ftp.login() # anonymous ftp login
-ftp.cwd('pub/data/asos-onemin') # change directory to asos-onemin
-dirs = ftp.nlst() # list all files in directory
-# uncomment below to print out all files/folders in asos-onemin dir
-##[print(str(ii)+' '+jj) for ii,jj in enumerate(dirs)] # print dirs/files and their indices
-description_files = [ii for ii in dirs if len(ii.split('.'))>1]
+asos_catalog = ASOSCatalog('asos_catalog.json') # local catalog of the asos-onemin tree
+asos_product,asos_year = '6406',2020 # product and year of the data folder to use
+# only folders that changed on the server since the last run are re-listed
+print('Re-listed folders: {}'.format(asos_catalog.sync(ftp,products=[asos_product],years=[asos_year])))
+# uncomment below to print out all products/years in asos-onemin dir
+##print(asos_catalog.products())
+ftp.cwd(ASOS_ROOT) # change directory to asos-onemin
+description_files = asos_catalog.root_files()
 for file in description_files:
     if os.path.isfile(file):
         print('already downloaded file: '+file)
@@ -38,10 +45,8 @@ for file in description_files:
 # Accessing data files/directories
 ########################################
 #
-data_dir_indx = 41 # select index printed out in Python window
-ftp.cwd(dirs[data_dir_indx]) # 41 == 6406-2020 [in my particular case]
-print('Accessing: {} Folder'.format(dirs[data_dir_indx]))
-data_files = ftp.nlst() # list all data files for directory above
+data_dir = asos_catalog.folder_name(asos_product,asos_year) # e.g. 6406-2020
+print('Accessing: {} Folder'.format(data_dir))
 
 ########################################
 # download ASOS file with all station
@@ -56,40 +61,16 @@ else:
     with open(asos_filename, 'wb') as fp:
         ftp.retrbinary('RETR '+asos_filename, fp.write) # save non-directory files (readme, etc.)
 
-station_props,station_header,dash_header = [],[],[]
-header_bool,dash_bool = False,False
-with open(asos_filename,newline='') as txtfile:
-    csvreader = csv.reader(txtfile,delimiter='\t')
-    for row in csvreader:
-        if len(row)<1:
-            continue
-        if row[0][0:6]=='NCDCID':
-            station_header = row[0]
-            header_bool = True
-        elif header_bool:
-            if dash_bool:
-                props = []
-                props_iter = 0
-                for qq in dash_header:
-                    props.append(row[0][props_iter:props_iter+len(qq)+1])
-                    props_iter+=len(qq)+1
-                station_props.append(props)
-            else:
-                dash_header = (row[0]).split(' ')
-                dash_bool = True
-                props_iter = 0
-                props = []
-                for rr in dash_header:
-                    props.append(station_header[props_iter:props_iter+len(rr)+1])
-                    props_iter+=len(rr)+1
-                station_header = props
+stations = load_stations(asos_filename) # parsed once, then read from the asos-stations.npy cache
+station_index = StationIndex(stations) # great-circle KD-tree over the stations
 
 # now we have two variables which will help us characterize each
 # ground station:
-# - station_header - 
-#    __this variable contains the header for each station and what each row means
-# - station_props -
-#    __this variable contains the specific station information (for 900+ stations in USA)
+# - station_index.stations - 
+#    __structured array with one record per station, with fields named by the
+#      file header (NCDCID, WBAN, CALL, NAME, ST, LAT, LON, ELEV, ...)
+# - station_index -
+#    __vectorized nearest/within-radius queries (see asos_stations.py)
 
 
 ########################################
@@ -104,36 +85,29 @@ my_lat,my_lon = 34.0522,-118.2437 # LA coordinates
 ##my_lat,my_lon = 41.8781,-87.6298  # Chicago coordinates
 ##my_lat,my_lon = 21.3069,-157.8583 # Honolulu coordinates
 
-station_lats = [float(ii[9]) for ii in station_props]
-station_lons = [float(ii[10]) for ii in station_props]
-
-# find the station lat/lon nearest to the input my_lat/my_lon
-nearest_indx = np.argmin(np.abs(np.subtract(station_lats,my_lat))+np.abs(np.subtract(station_lons,my_lon)))
+# find the station nearest to the input my_lat/my_lon (great-circle distance)
+nearest_km,nearest_indx = station_index.nearest(my_lat,my_lon)
+station = station_index.stations[nearest_indx]
 print('-----------')
-print('The nearest station to {},{} is {} ({}) at {},{}'.\
-      format(my_lat,my_lon,(station_props[nearest_indx][4]).replace('  ',''),
-             'K'+station_props[nearest_indx][3].replace(' ',''),station_lats[nearest_indx],
-             station_lons[nearest_indx]))
+print('The nearest station to {},{} is {} ({}) at {},{} [{:2.1f} km away]'.\
+      format(my_lat,my_lon,station['NAME'],'K'+station['CALL'],station['LAT'],station['LON'],nearest_km))
 
 ########################################
 # finding station data and saving it locally
 ########################################
 #
-ftp.cwd('../../data/asos-onemin/'+dirs[data_dir_indx]) # change directory back to asos-onemin
 data_folder = './data/' # data where files will be saved (will be created)
 if os.path.isdir(data_folder)==False:
     os.mkdir(data_folder)
 
-sel_data_files = []
-for ss in data_files:
-    if ss[6:9]==station_props[nearest_indx][3].replace(' ','') and ss.endswith('.dat'):
-        sel_data_files.append(ss)
+sel_data_files = [ii[0] for ii in asos_catalog.files(asos_product,asos_year,
+                                                    station=station['CALL'])]
 
-for file_ii in sel_data_files:
-    if os.path.isfile(data_folder+file_ii):
-        continue
-    with open(data_folder+file_ii, 'wb') as fp:
-        ftp.retrbinary('RETR '+file_ii, fp.write) # save data files
+# parallel download over a small FTP connection pool, partial files are
+# resumed and each file is checked against the server's SIZE reply
+remote_folder = ASOS_ROOT+data_dir+'/'
+with FTPPool(ASOS_HOST,size=4) as pool:
+    download_files(pool,[(remote_folder+file_ii,data_folder+file_ii) for file_ii in sel_data_files])
 
 ########################################
 # parsing station data and visualizing it
@@ -141,64 +115,44 @@ for file_ii in sel_data_files:
 #
 file_indx = 0
 file_ii = np.sort(sel_data_files)[file_indx]
-data_ii = []
-with open(data_folder+file_ii, newline='') as dat_file:
-    csvreader = csv.reader(dat_file)
-    for row in csvreader:
-        row = row[0]
-        if dirs[data_dir_indx].split('-')[0]=='6405':
-            data_ii.append([row[0:10],row[10:33],row[33:59],row[59:70],row[70:75],
-                        row[75:80],row[80:85],row[85:90],row[90:]])
-        elif dirs[data_dir_indx].split('-')[0]=='6406':
-            data_ii.append([row[0:10],row[10:32],row[32:44],row[44:62],row[62:70],
-                            row[70:76],row[76:86],row[86:95],row[95:99],row[99:]])
+asos_cols = read_asos_file(data_folder+file_ii,layout=asos_product) # typed columns for the whole file
 
 ####
-# the data is given in data_ii as follows (for 6405):
-# row 0 - identifier for station
-# row 1 - identifier + timestamp
-# row 2 - visibility (N = night; D = day)
-# row 3 - visibility (N = night; D = day)
-# row 4 - wind direction (2-min avg)
-# row 5 - wind speed     (2-min avg)
-# row 6 - dir of max wind speed (5-sec)
-# row 7 - speed of max wind dir (5-sec)
-# row 8 - runway visual range (hundreds ft)
+# the columns in asos_cols are as follows (for 6405):
+# station         - identifier for station
+# time            - timestamp (datetime64)
+# vis_1/vis_2     - visibility (with _flag: 0 = night, 1 = day)
+# wind_dir_2min   - wind direction (2-min avg)
+# wind_speed_2min - wind speed     (2-min avg)
+# wind_dir_max    - dir of max wind speed (5-sec)
+# wind_speed_max  - speed of max wind dir (5-sec)
+# rvr             - runway visual range (hundreds ft)
 
 
 ####
-# the data is given in data_ii as follows (for 6406):
-# row 0 - identifier for station
-# row 1 - identifier + timestamp
-# row 2 - precipitation (NP=none, S = snow, R = rain)
-# row 3 - amount of precip
-# row 4 - frozen precip sensor frequency
-# row 5 - pressure 1
-# row 6 - pressure 2
-# row 7 - pressure 3
-# row 8 - Avg 1min dry bulb temp
-# row 9 - Avg 1min dew pt temp
+# the columns in asos_cols are as follows (for 6406):
+# station         - identifier for station
+# time            - timestamp (datetime64)
+# precip_type     - precipitation code (index into PRECIP_TYPES: NP=none, S = snow, R = rain)
+# precip_amount   - amount of precip
+# frozen_freq     - frozen precip sensor frequency
+# pres_1          - pressure 1
+# pres_2          - pressure 2
+# pres_3          - pressure 3
+# temp_dry        - Avg 1min dry bulb temp
+# temp_dew        - Avg 1min dew pt temp
+#
+# malformed values are NaN (NaT for times), rather than dropped rows
 
 ########################################
 # PLOTTING THE DATA
 ########################################
 #
 # Let's look at one of the pressures for a given station:
-t_strs,pres,temp_dry,temp_wet = np.array([]),np.array([]),np.array([]),np.array([])
-for dats in data_ii:
-    try:
-        t_ii = (dats[1][3:].replace(' ',''))
-        pres_ii = float(dats[5])      
-        temp_dry_ii = float(dats[8])
-        temp_wet_ii = float(dats[9])
-        t_strs = np.append(t_strs,t_ii)
-        pres = np.append(pres,pres_ii)
-        temp_dry = np.append(temp_dry,temp_dry_ii)
-        temp_wet = np.append(temp_wet,temp_wet_ii)
-    except:
-        pass
-
-t_vec = [datetime.datetime.strptime(ii[0:-4],'%Y%m%d%H%M') for ii in t_strs]
+t_vec = asos_cols['time']
+pres = asos_cols['pres_1']
+temp_dry = asos_cols['temp_dry']
+temp_wet = asos_cols['temp_dew']
 
 # relative humidity calculation:
 # equation taken from:
@@ -239,11 +193,8 @@ ax2.set_xticks([])
 ax3.tick_params(axis='x', rotation=15)
 
 ax2.legend()
-ax.set_title('Station: {}, ({},{}) [{}]'.format(station_props[nearest_indx][3].replace(' ',''),
-                                             station_props[nearest_indx][9].replace(' ',''),
-                                             station_props[nearest_indx][10].replace(' ',''),
-                                             station_props[nearest_indx][4].replace('  ','')))
-plt.savefig(station_props[nearest_indx][3].replace(' ','')+'_test_plot.png',dpi=300,facecolor=[252.0/255.0,252.0/255.0,252.0/255.0])
+ax.set_title('Station: {}, ({},{}) [{}]'.format(station['CALL'],station['LAT'],station['LON'],station['NAME']))
+plt.savefig(station['CALL']+'_test_plot.png',dpi=300,facecolor=[252.0/255.0,252.0/255.0,252.0/255.0])
 plt.show()
 
 ftp.close() # close ftp connection
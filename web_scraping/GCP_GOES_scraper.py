@@ -18,8 +18,13 @@ import cartopy.crs as ccrs
 import matplotlib.ticker as mticker
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 import cartopy.feature as cfeature
-import os,pyproj,datetime
+import os,sys,datetime
 import numpy as np
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','geostationary_satellite'))
+from goes_regrid import cached_regridder # cached fixed grid -> lat/lon regridding tables
+from goes_packed import read_packed # packed int16 data, decoded on demand
+from goes_fetch import GCSBucket,BlobCache
+from goes_catalog import GOESCatalog
 
 ##############################
 # Establishing GCP Connection
@@ -27,35 +32,23 @@ import numpy as np
 #
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "GOOGLE_AUTH_CREDS.json" # local google auth credentials
 client = storage.Client() # start the storage client
-bucket_16 = client.get_bucket('gcp-public-data-goes-16') # call the GOES-16/17 storage bucket
+bucket_16 = GCSBucket('gcp-public-data-goes-16',client=client) # call the GOES-16/17 storage bucket
 
 #########################
 # satellite functions 
 #########################
 #
-def lat_lon_reproj(netcdf_file):
+def lat_lon_regrid(netcdf_file,bbox,res=0.02):
     # list all netCDF variables in the GOES file
     print('Data Indices:')
     for ii,dats in enumerate(netcdf_file.variables): # list all variables from the sat file
         print('{0:1d} - {1}'.format(ii,dats))
 
-    h = netcdf_file.variables['goes_imager_projection'].perspective_point_height # height of satellite
-    r_eq = netcdf_file.variables['goes_imager_projection'].semi_major_axis # equator radius
-    r_pol = netcdf_file.variables['goes_imager_projection'].semi_minor_axis # polar radius
-    lambda_0 = netcdf_file.variables['goes_imager_projection'].longitude_of_projection_origin # longitude point of sat
-    lat_0 =  netcdf_file.variables['goes_imager_projection'].latitude_of_projection_origin # latitude point of sat
-
-    goes_proj = pyproj.Proj('+proj=geos +h={0:08.1f} +a= {1:08.1f} +b= {2:08.1f}'.format(h,r_eq,r_pol)+\
-                            ' +lon_0={0:08.1f} +lat_0={1:08.1f} +units=m sweep=x +no_defs'.format(lambda_0,lat_0)) # GOES projection
-    lonlat_proj = pyproj.Proj("EPSG:4326") # to lat/lon
-    xs = h*netcdf_file.variables['x'][:] # x-vals from GOES
-    ys = h*netcdf_file.variables['y'][:] # y-vals from GOES
-    rows,cols = np.meshgrid(xs,ys) # mesh for x/y vals
-    tfmr = pyproj.transformer.Transformer.from_proj(goes_proj,lonlat_proj) # the projection from GOES -> lat/lon
-    lats,lons = tfmr.transform(rows,cols) # lat/lon values from projection
-    lons[lons==np.inf] = 0.0 # must remove infinite values for plotting, otherwise an error is raised
-    lats[lats==np.inf] = 0.0 # must remove infinite values for plotting, otherwise an error is raised
-    return lons,lats
+    # table from the fixed grid to a regular lat/lon grid over the bbox (res in degrees),
+    # computed once per grid/bbox and then loaded from the local cache - each scan is
+    # regridded with one gather and drawn with imshow (no pcolormesh, no fake (0,0) cells)
+    regridder = cached_regridder(netcdf_file,bbox,res,method='nearest')
+    return regridder
 #
 ###########################
 # Grabbing actual data
@@ -65,7 +58,10 @@ def data_grabber(netcdf_file):
     print('Data Variable: {0} [{1}] ({2})'.format(goes_vars[data_indx],
                                                   netcdf_file.variables[goes_vars[data_indx]].units,
                                                   netcdf_file.variables[goes_vars[data_indx]].long_name)) # print info
-    data = (netcdf_file.variables[goes_vars[data_indx]])[:] # this grabs the data, which is a masked array
+    # the data is kept packed (int16 + DQF) and decoded to float32 only here,
+    # pass quality= (DQF bits or flag meanings) to drop flagged pixels
+    field = read_packed(netcdf_file.filepath(),goes_vars[data_indx])
+    data = np.ma.masked_invalid(field.decode(quality=None)) # masked array, as netCDF4 would return
     return data
 
 #
@@ -95,7 +91,8 @@ def geo_plotter():
     # gl.xformatter = LONGITUDE_FORMATTER
     # gl.yformatter = LATITUDE_FORMATTER
     ax.set_axis_off() # turn off the frame
-    p1 = ax.pcolormesh(lons,lats,data,transform=ccrs.PlateCarree()) # PLOT DATA - this plots the data with colormap
+    p1 = ax.imshow(regridder.regrid(data),extent=regridder.extent,origin='upper',
+                   transform=ccrs.PlateCarree(),interpolation='nearest') # PLOT DATA - this plots the data with colormap
     cbar = fig.colorbar(p1,fraction=0.025, pad=0.04)
     cbar.ax.set_ylabel('{0} [{1}]'.format(goes_vars[data_indx],
                                           netcdf_file.variables[goes_vars[data_indx]].units),fontsize=16)
@@ -115,38 +112,29 @@ def geo_plotter():
 ##############################
 #
 def GCP_data_scraper():
-    yr = '{:0004d}'.format(t_search.year) # formats the year for GCP
-    yday = '{:003d}'.format(t_search.timetuple().tm_yday) # formats the julian day (year day) for GCP
-    thour = '{:02d}'.format(t_search.hour) # formats the hour for GCP
-
-    prefix_16 = product_ID+yr+'/'+yday+'/'+thour # this is the relative folder where the GOES-16 data will be
-    blobs_16 = bucket_16.list_blobs(prefix=prefix_16) # get all files in prefix
-
-    print('Files in this repository:')
-    goes_files = []
-    for blob in blobs_16:
-        print(blob.name) # these are the files that will be downloaded locally
-        goes_files.append(blob)
-
-    selected_file = goes_files[0] # select the first file in the folder
-    selected_filename = goes_folder_local+selected_file.name.split('/')[-1]
-    if os.path.isfile(selected_filename): 
-        pass # don't re-download the file if it already exists
-    else:
-        # download the file to the local GOES-16 repository
-        selected_file.download_to_filename(selected_filename)
+    # list the hour folders around t_search once (they are cached in the
+    # scan catalog), then pick the scan that starts closest to t_search
+    goes_catalog = GOESCatalog(os.path.join(goes_folder_local,'goes_catalog.npz'))
+    goes_catalog.sync(bucket_16,product_ID,t_search-datetime.timedelta(minutes=30),
+                      t_search+datetime.timedelta(minutes=30))
+    selected_file = goes_catalog.nearest(product_ID.strip('/'),t_search) # nearest scan to the search time
+    print('Selected file: {}'.format(selected_file['name']))
+    # download (ranged, parallel, hash-verified) into the local GOES-16 cache,
+    # files already in the cache are not downloaded again
+    goes_cache = BlobCache(bucket_16,cache_dir=goes_folder_local)
+    selected_filename = goes_cache.fetch([selected_file['name']])[0]
     return selected_filename
    
 if __name__ == '__main__':
-    goes_folder_local = '' # local repository where LST files will be stored
+    goes_folder_local = './goes_cache/' # local repository (size-capped cache) where LST files will be stored
     prod = 'LST' # select product
     product_ID = 'ABI-L2-'+prod+'C/' # ABI, L2 product identifier, CONUS
     t_search = datetime.datetime(2020,7,1,17) # datetime of desired data file
     selected_filename = GCP_data_scraper() # this grabs the data from the Google cloud server
     netcdf_file = Dataset(selected_filename) # read netCDF file from GOES satellite
-    lons,lats = lat_lon_reproj(netcdf_file) # get longitude/latitude from netcdf
+    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
+    regridder = lat_lon_regrid(netcdf_file,bbox) # fixed grid -> regular lat/lon grid over the bbox
     data_indx = 0 # select variable based on printed-out index (first index, 0, is usually the data)
     goes_vars = [ii for ii in netcdf_file.variables] # get variables from netcdf file
     data = data_grabber(netcdf_file) # grab the data
-    bbox = [-130.2328,21.7423,-63.6722,52.8510] # bounding box for continental USA
     geo_plotter() # plot the data
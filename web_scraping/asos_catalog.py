@@ -0,0 +1,127 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code keeps a local catalog of the ASOS one-minute FTP
+# tree (product, year, station, file, size, modification time)
+# so that runs don't need to re-list folders with tens of
+# thousands of entries. The top-level folder is listed with
+# MLSD and only product-year folders whose modification time
+# changed since the last sync are listed again
+#
+################################################################
+#
+#
+import ftplib,json,os,time
+from asos_downloader import ASOS_ROOT
+
+CATALOG_VERSION = 1
+
+########################################
+# MLSD listings
+########################################
+#
+def mlsd_listing(ftp,path):
+    # {name: facts} for a remote folder, using MLSD when supported and
+    # falling back to NLST (without size/modify facts) otherwise
+    try:
+        return {name:facts for name,facts in ftp.mlsd(path,facts=['type','size','modify'])
+                if facts.get('type','file') not in ('cdir','pdir')}
+    except ftplib.error_perm:
+        names = [ii.split('/')[-1] for ii in ftp.nlst(path)]
+        return {name:{'type':'dir' if '.' not in name else 'file'} for name in names}
+
+def split_folder(folder):
+    # '6406-2020' -> ('6406', 2020), None for non product-year folders
+    parts = folder.split('-')
+    if len(parts)!=2 or not (parts[0].isdigit() and parts[1].isdigit()):
+        return None
+    return parts[0],int(parts[1])
+
+def file_station(filename):
+    # '64060KCQT202001.dat' -> 'KCQT'
+    return filename[5:9]
+
+#
+########################################
+# persistent catalog
+########################################
+#
+class ASOSCatalog(object):
+    # the catalog is a json file with the root listing and, for each
+    # product-year folder, its modify stamp and {file: [size, modify]}
+    def __init__(self,catalog_file='asos_catalog.json',root=ASOS_ROOT):
+        self.catalog_file,self.root = catalog_file,root
+        self.root_entries,self.folders = {},{}
+        if os.path.isfile(catalog_file):
+            with open(catalog_file,'r') as json_file:
+                saved = json.load(json_file)
+            if saved.get('version')==CATALOG_VERSION and saved.get('root')==root:
+                self.root_entries,self.folders = saved['root_entries'],saved['folders']
+
+    def save(self):
+        tmp_file = self.catalog_file+'.tmp'
+        with open(tmp_file,'w') as json_file:
+            json.dump({'version':CATALOG_VERSION,'root':self.root,
+                       'root_entries':self.root_entries,'folders':self.folders},json_file)
+        os.replace(tmp_file,self.catalog_file) # never leave a half-written catalog
+
+    def sync(self,ftp,products=None,years=None,force=False):
+        # re-list the root, then only the selected folders that changed
+        # returns the names of folders that were (re-)listed
+        self.root_entries = mlsd_listing(ftp,self.root)
+        relisted = []
+        for folder,facts in sorted(self.root_entries.items()):
+            prod_year = split_folder(folder)
+            if facts.get('type')!='dir' or prod_year is None:
+                continue
+            if products is not None and prod_year[0] not in [str(ii) for ii in products]:
+                continue
+            if years is not None and prod_year[1] not in [int(ii) for ii in years]:
+                continue
+            cached = self.folders.get(folder)
+            if not force and cached is not None and facts.get('modify') is not None \
+               and cached['modify']==facts.get('modify'):
+                continue # unchanged since the last listing
+            listing = mlsd_listing(ftp,self.root+folder)
+            self.folders[folder] = {'modify':facts.get('modify'),'listed':time.time(),
+                                    'files':{name:[int(ii['size']) if 'size' in ii else None,ii.get('modify')]
+                                             for name,ii in listing.items() if ii.get('type','file')=='file'}}
+            relisted.append(folder)
+        self.save()
+        return relisted
+
+    def root_files(self):
+        # non-directory files in asos-onemin (readme, etc.)
+        return sorted([name for name,facts in self.root_entries.items() if facts.get('type')=='file'])
+
+    def folder_name(self,product,year):
+        folder = '{0}-{1:04d}'.format(product,int(year))
+        if folder not in self.folders:
+            raise KeyError('Folder {} is not in the catalog, sync it first'.format(folder))
+        return folder
+
+    def products(self):
+        # {product: [years]} for every product-year folder on the server
+        prods = {}
+        for folder,facts in self.root_entries.items():
+            if facts.get('type')=='dir' and split_folder(folder) is not None:
+                product,year = split_folder(folder)
+                prods.setdefault(product,[]).append(year)
+        return {ii:sorted(jj) for ii,jj in prods.items()}
+
+    def files(self,product,year,station=None,suffix='.dat'):
+        # [(filename, size, modify)] in a product-year folder, optionally
+        # for a single station ('CQT' or 'KCQT')
+        folder_files = self.folders[self.folder_name(product,year)]['files']
+        station = None if station is None else station.strip().upper()
+        def _matches(name):
+            if station is None:
+                return True
+            return name[6:9]==station if len(station)==3 else file_station(name)==station
+        return [(name,size,modify) for name,(size,modify) in sorted(folder_files.items())
+                if name.endswith(suffix) and _matches(name)]
+
+    def stations(self,product,year):
+        return sorted(set([file_station(ii[0]) for ii in self.files(product,year)]))
@@ -0,0 +1,245 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code computes hourly/monthly climatologies of ASOS
+# one-minute pressure, dry-bulb, dew point and relative humidity
+# without loading the full record into memory. Files are consumed
+# one at a time into online accumulators keyed by
+# station x month x hour:
+#   - count, mean and variance (Welford/Chan updates)
+#   - min and max
+#   - fixed-bin histograms for approximate quantiles
+# Accumulators from different worker processes are merged
+# exactly, so many station-years can be reduced in parallel
+#
+################################################################
+#
+#
+import os,time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from asos_reader import read_asos_file
+from asos_store import station_key
+
+N_MONTHS,N_HOURS = 12,24
+N_KEYS = N_MONTHS*N_HOURS
+
+# variable: (source column, histogram lower edge, upper edge, bin width)
+CLIMATOLOGY_VARS = {'pres':('pres_1',25.0,32.0,0.02), # [inHg]
+                    'temp_dry':('temp_dry',-60.0,130.0,1.0), # [F]
+                    'temp_dew':('temp_dew',-60.0,130.0,1.0), # [F]
+                    'RH':(None,0.0,100.0,1.0)} # [%], derived
+
+########################################
+# derived variables
+########################################
+#
+def relative_humidity(temp_dry,temp_dew):
+    # RH [%] from dry-bulb and dew point temperatures in [F], using
+    # saturation vapor pressure e = 6.112*exp(17.502*T/(240.97+T)) [T in C]
+    t_c = (np.asarray(temp_dry,dtype=np.float32)-32.0)*(5.0/9.0)
+    td_c = (np.asarray(temp_dew,dtype=np.float32)-32.0)*(5.0/9.0)
+    e_d = 6.112*np.exp((17.502*td_c)/(240.97+td_c)) # actual vapor pressure (at dew point)
+    e_s = 6.112*np.exp((17.502*t_c)/(240.97+t_c)) # saturation vapor pressure
+    return np.clip(100.0*e_d/e_s,0.0,100.0)
+
+def climatology_columns(columns):
+    # pull the climatology variables out of read_asos_file() columns
+    values = {name:np.asarray(columns[src],dtype=np.float64) for name,(src,_,_,_) in CLIMATOLOGY_VARS.items()
+              if src is not None}
+    values['RH'] = relative_humidity(columns['temp_dry'],columns['temp_dew']).astype(np.float64)
+    return values
+
+#
+########################################
+# mergeable accumulators
+########################################
+#
+class Climatology(object):
+    # one set of accumulators per variable, each shaped (station, month, hour)
+    def __init__(self,variables=CLIMATOLOGY_VARS):
+        self.variables = variables
+        self.stations = [] # station keys, in accumulator order
+        self.count,self.mean,self.m2,self.vmin,self.vmax,self.hist = {},{},{},{},{},{}
+        for name in variables:
+            self.count[name] = np.zeros((0,N_KEYS),dtype=np.int64)
+            self.mean[name] = np.zeros((0,N_KEYS),dtype=np.float64)
+            self.m2[name] = np.zeros((0,N_KEYS),dtype=np.float64)
+            self.vmin[name] = np.zeros((0,N_KEYS),dtype=np.float32)
+            self.vmax[name] = np.zeros((0,N_KEYS),dtype=np.float32)
+            self.hist[name] = np.zeros((0,N_KEYS,self.n_bins(name)),dtype=np.uint32)
+
+    def n_bins(self,name):
+        _,lo,hi,width = self.variables[name]
+        return int(np.ceil((hi-lo)/width))
+
+    def _station_row(self,station):
+        # accumulator row for a station, growing the arrays for new stations
+        if station in self.stations:
+            return self.stations.index(station)
+        self.stations.append(station)
+        for name in self.variables:
+            self.count[name] = np.concatenate((self.count[name],np.zeros((1,N_KEYS),dtype=np.int64)))
+            self.mean[name] = np.concatenate((self.mean[name],np.zeros((1,N_KEYS))))
+            self.m2[name] = np.concatenate((self.m2[name],np.zeros((1,N_KEYS))))
+            self.vmin[name] = np.concatenate((self.vmin[name],np.full((1,N_KEYS),np.inf,dtype=np.float32)))
+            self.vmax[name] = np.concatenate((self.vmax[name],np.full((1,N_KEYS),-np.inf,dtype=np.float32)))
+            self.hist[name] = np.concatenate((self.hist[name],
+                                              np.zeros((1,N_KEYS,self.n_bins(name)),dtype=np.uint32)))
+        return len(self.stations)-1
+
+    def _combine(self,name,row,n_b,mean_b,m2_b,min_b,max_b,hist_b):
+        # Chan et al. parallel update of count/mean/M2, plus min/max/hist
+        n_a,mean_a = self.count[name][row],self.mean[name][row]
+        n_ab = n_a+n_b
+        safe_n = np.maximum(n_ab,1)
+        delta = mean_b-mean_a
+        self.mean[name][row] = mean_a+delta*(n_b/safe_n)
+        self.m2[name][row] += m2_b+(delta**2)*(n_a*n_b/safe_n)
+        self.count[name][row] = n_ab
+        self.vmin[name][row] = np.fmin(self.vmin[name][row],min_b)
+        self.vmax[name][row] = np.fmax(self.vmax[name][row],max_b)
+        self.hist[name][row] += hist_b
+
+    def update(self,station,t_vec,values):
+        # add one batch of rows (e.g. one station-month file) for a station
+        row = self._station_row(station_key(station))
+        good_t = ~np.isnat(t_vec)
+        months = (t_vec.astype('datetime64[M]').astype(np.int64)%12)
+        hours = (t_vec.astype('datetime64[h]').astype(np.int64)%24)
+        keys = np.where(good_t,months*N_HOURS+hours,0)
+        for name,(_,lo,hi,width) in self.variables.items():
+            vals = values[name]
+            good = good_t & np.isfinite(vals)
+            k_ii,v_ii = keys[good],vals[good]
+            n_b = np.bincount(k_ii,minlength=N_KEYS)
+            mean_b = np.bincount(k_ii,weights=v_ii,minlength=N_KEYS)/np.maximum(n_b,1)
+            m2_b = np.bincount(k_ii,weights=(v_ii-mean_b[k_ii])**2,minlength=N_KEYS)
+            min_b = np.full(N_KEYS,np.inf,dtype=np.float32)
+            max_b = np.full(N_KEYS,-np.inf,dtype=np.float32)
+            np.minimum.at(min_b,k_ii,v_ii.astype(np.float32))
+            np.maximum.at(max_b,k_ii,v_ii.astype(np.float32))
+            n_bins = self.n_bins(name)
+            bins = np.clip(np.floor((v_ii-lo)/width),0,n_bins-1).astype(np.int64) # out of range -> edge bins
+            hist_b = np.bincount(k_ii*n_bins+bins,minlength=N_KEYS*n_bins).reshape(N_KEYS,n_bins)
+            self._combine(name,row,n_b,mean_b,m2_b,min_b,max_b,hist_b.astype(np.uint32))
+        return self
+
+    def merge(self,other):
+        # fold another Climatology (e.g. from a worker process) into this one
+        for ii,station in enumerate(other.stations):
+            row = self._station_row(station)
+            for name in self.variables:
+                self._combine(name,row,other.count[name][ii],other.mean[name][ii],other.m2[name][ii],
+                              other.vmin[name][ii],other.vmax[name][ii],other.hist[name][ii])
+        return self
+
+    #
+    # results, each shaped (station, month, hour)
+    #
+    def _shaped(self,arr):
+        return np.reshape(arr,(len(self.stations),N_MONTHS,N_HOURS)+np.shape(arr)[2:])
+
+    def counts(self,name):
+        return self._shaped(self.count[name])
+
+    def means(self,name):
+        return self._shaped(np.where(self.count[name]>0,self.mean[name],np.nan))
+
+    def variances(self,name):
+        # sample variance (NaN where fewer than two values)
+        n = self.count[name]
+        return self._shaped(np.where(n>1,self.m2[name]/np.maximum(n-1,1),np.nan))
+
+    def minima(self,name):
+        return self._shaped(np.where(self.count[name]>0,self.vmin[name],np.nan))
+
+    def maxima(self,name):
+        return self._shaped(np.where(self.count[name]>0,self.vmax[name],np.nan))
+
+    def quantiles(self,name,q):
+        # approximate quantiles from the histograms (linear within a bin),
+        # shaped (station, month, hour, len(q))
+        _,lo,hi,width = self.variables[name]
+        q = np.atleast_1d(np.asarray(q,dtype=np.float64))
+        hist = self.hist[name].astype(np.float64)
+        cdf = np.cumsum(hist,axis=-1)
+        total = cdf[...,-1:]
+        out = np.full(np.shape(hist)[:-1]+(len(q),),np.nan)
+        for jj,q_jj in enumerate(q):
+            target = q_jj*total
+            bin_ii = np.minimum(np.sum(cdf<target,axis=-1),np.shape(hist)[-1]-1) # first bin reaching target
+            below = np.take_along_axis(cdf,bin_ii[...,None],-1)[...,0]-np.take_along_axis(hist,bin_ii[...,None],-1)[...,0]
+            in_bin = np.take_along_axis(hist,bin_ii[...,None],-1)[...,0]
+            frac = np.where(in_bin>0,(target[...,0]-below)/np.maximum(in_bin,1),0.5)
+            out[...,jj] = np.where(total[...,0]>0,lo+(bin_ii+np.clip(frac,0.0,1.0))*width,np.nan)
+        return self._shaped(out)
+
+    #
+    # saving and loading
+    #
+    def save(self,filename):
+        arrays = {'stations':np.array(self.stations)}
+        for name in self.variables:
+            for acc,acc_name in ((self.count,'count'),(self.mean,'mean'),(self.m2,'m2'),
+                                 (self.vmin,'vmin'),(self.vmax,'vmax'),(self.hist,'hist')):
+                arrays[acc_name+'__'+name] = acc[name]
+        np.savez(filename,**arrays)
+
+    @classmethod
+    def load(cls,filename,variables=CLIMATOLOGY_VARS):
+        clim = cls(variables)
+        with np.load(filename) as saved:
+            clim.stations = [str(ii) for ii in saved['stations']]
+            for name in variables:
+                clim.count[name],clim.mean[name],clim.m2[name] = saved['count__'+name],saved['mean__'+name],saved['m2__'+name]
+                clim.vmin[name],clim.vmax[name],clim.hist[name] = saved['vmin__'+name],saved['vmax__'+name],saved['hist__'+name]
+        return clim
+
+#
+########################################
+# streaming over files and workers
+########################################
+#
+def accumulate_files(filenames,clim=None):
+    # stream ASOS 6406 files into a Climatology, one file in memory at a time
+    clim = Climatology() if clim is None else clim
+    for filename in filenames:
+        columns = read_asos_file(filename,layout='6406')
+        if len(columns['time'])==0:
+            continue
+        clim.update(os.path.basename(filename)[5:9],columns['time'],climatology_columns(columns))
+    return clim
+
+def accumulate_store(store,stations=None,t_start=None,t_end=None,clim=None):
+    # same as accumulate_files(), but reading partitions from an ASOSStore
+    clim = Climatology() if clim is None else clim
+    for key in store.select('6406',stations,t_start,t_end):
+        columns = store.read_partition(key,['time','pres_1','temp_dry','temp_dew'])
+        clim.update(store.partitions[key]['station'],np.asarray(columns['time']),climatology_columns(columns))
+    return clim
+
+def climatology_parallel(filenames,n_workers=None):
+    # split the files across worker processes and merge their accumulators
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    filenames = sorted(filenames)
+    chunks = [filenames[ii::n_workers] for ii in range(n_workers) if len(filenames[ii::n_workers])>0]
+    clim = Climatology()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for partial in executor.map(accumulate_files,chunks):
+            clim.merge(partial)
+    return clim
+
+if __name__ == '__main__':
+    data_folder = './data/' # local folder with downloaded 6406 .dat files
+    dat_files = [os.path.join(data_folder,ii) for ii in os.listdir(data_folder)
+                 if ii.startswith('6406') and ii.endswith('.dat')]
+    t_start = time.time()
+    clim = climatology_parallel(dat_files)
+    print('{0:d} files, {1:d} stations in {2:2.1f} s'.format(len(dat_files),len(clim.stations),time.time()-t_start))
+    clim.save('asos_climatology.npz')
+    for ii,station in enumerate(clim.stations):
+        mean_t = clim.means('temp_dry')[ii] # (month, hour)
+        print('{0}: warmest month/hour mean dry-bulb = {1:2.1f} F'.format(station,np.nanmax(mean_t)))
@@ -0,0 +1,192 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code downloads ASOS one-minute data files from the NCEI
+# FTP server using a bounded pool of FTP connections. Files are
+# fetched in parallel, interrupted transfers are resumed with
+# REST offsets from a '.part' file, and every file is checked
+# against the server's SIZE reply before it is accepted
+#
+################################################################
+#
+#
+from ftplib import FTP
+import ftplib,os,queue,threading,time
+from concurrent.futures import ThreadPoolExecutor,as_completed
+from contextlib import contextmanager
+
+ASOS_HOST = 'ftp.ncdc.noaa.gov' # ncdc ftp server
+ASOS_ROOT = '/pub/data/asos-onemin/' # asos-onemin directory
+PART_SUFFIX = '.part' # suffix for files still being transferred
+
+########################################
+# FTP connection pool
+########################################
+#
+class FTPPool(object):
+    # bounded pool of logged-in FTP connections, each one is only
+    # ever used by a single thread at a time
+    def __init__(self,host=ASOS_HOST,size=4,user='',passwd='',port=21,timeout=60):
+        self.host,self.port,self.user,self.passwd = host,port,user,passwd
+        self.size,self.timeout = size,timeout
+        self._idle = queue.LifoQueue() # idle connections (most recent first)
+        self._slots = threading.BoundedSemaphore(size) # caps open connections
+        self._lock = threading.Lock()
+        self._open = [] # every connection created by the pool
+
+    def _connect(self):
+        ftp = FTP()
+        ftp.connect(self.host,self.port,timeout=self.timeout)
+        ftp.login(self.user,self.passwd) # anonymous login by default
+        ftp.voidcmd('TYPE I') # binary mode, needed for SIZE and REST
+        with self._lock:
+            self._open.append(ftp)
+        return ftp
+
+    def _discard(self,ftp):
+        with self._lock:
+            if ftp in self._open:
+                self._open.remove(ftp)
+        try:
+            ftp.close()
+        except ftplib.all_errors:
+            pass
+
+    @contextmanager
+    def connection(self):
+        # borrow a connection, broken ones are closed instead of returned
+        self._slots.acquire()
+        try:
+            try:
+                ftp = self._idle.get_nowait()
+            except queue.Empty:
+                ftp = self._connect()
+            try:
+                yield ftp
+            except ftplib.all_errors:
+                self._discard(ftp)
+                raise
+            else:
+                self._idle.put(ftp)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            conns,self._open = self._open,[]
+        for ftp in conns:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+        self._idle = queue.LifoQueue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+#
+########################################
+# single-file transfer with resume
+########################################
+#
+def remote_size(ftp,remote_path):
+    # size of the remote file in bytes (SIZE reply), None if unsupported
+    try:
+        return ftp.size(remote_path)
+    except ftplib.error_perm:
+        return None
+
+def download_file(pool,remote_path,local_path,retries=3,blocksize=65536):
+    # download one file, resuming any '.part' left from a previous attempt
+    # returns 'skipped', 'downloaded' or 'resumed'
+    part_path = local_path+PART_SUFFIX
+    status = 'downloaded'
+    for attempt in range(retries+1):
+        try:
+            with pool.connection() as ftp:
+                size = remote_size(ftp,remote_path)
+                if os.path.isfile(local_path):
+                    if size is not None and os.path.getsize(local_path)==size:
+                        return 'skipped' # complete file already on disk
+                    if size is None and os.path.getsize(local_path)>=(os.path.getsize(part_path)
+                                                                       if os.path.isfile(part_path) else 0):
+                        os.replace(local_path,part_path) # can't be verified: resume it from its end
+                offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+                if size is not None and offset>size:
+                    offset = 0 # stale partial file, start over
+                if offset>0:
+                    status = 'resumed'
+                if size is None or offset<size:
+                    with open(part_path,'ab' if offset>0 else 'wb') as fp:
+                        ftp.retrbinary('RETR '+remote_path,fp.write,blocksize=blocksize,
+                                       rest=offset if offset>0 else None) # REST offset resume
+            got = os.path.getsize(part_path)
+            if size is not None and got!=size:
+                raise IOError('Size mismatch for {0}: {1:d} of {2:d} bytes'.format(remote_path,got,size))
+            os.replace(part_path,local_path) # only complete files get the final name
+            return status
+        except ftplib.all_errors+(EOFError,) as err:
+            if isinstance(err,ftplib.error_perm) or attempt==retries:
+                raise # permanent errors (e.g. 550 no such file) are not retried
+            time.sleep(min(2.0**attempt,30.0)) # back off before reconnecting
+
+#
+########################################
+# parallel and batch downloads
+########################################
+#
+def download_files(pool,jobs,retries=3,verbose=True):
+    # download a list of (remote_path, local_path) pairs in parallel
+    # returns {local_path: status or exception}
+    results = {}
+    t_start = time.time()
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        futures = {executor.submit(download_file,pool,remote,local,retries):local for remote,local in jobs}
+        for future in as_completed(futures):
+            local = futures[future]
+            try:
+                results[local] = future.result()
+            except Exception as err:
+                results[local] = err
+            if verbose:
+                print('{0:10s} {1}'.format(str(results[local]) if not isinstance(results[local],Exception)
+                                           else 'FAILED',local))
+    if verbose:
+        n_failed = sum([isinstance(ii,Exception) for ii in results.values()])
+        print('{0:d} files in {1:2.1f} s ({2:d} failed)'.format(len(results),time.time()-t_start,n_failed))
+    return results
+
+def asos_filename(product,station,year,month):
+    # e.g. ('6406','CQT',2020,1) -> 64060KCQT202001.dat
+    station = station.strip().upper()
+    if len(station)==3:
+        station = 'K'+station # contiguous US stations drop the leading K
+    return '{0}0{1}{2:04d}{3:02d}.dat'.format(product,station,int(year),int(month))
+
+def asos_batch_jobs(products,stations,years,months,data_folder='./data/',root=ASOS_ROOT):
+    # build (remote, local) jobs across many products/stations/years/months
+    jobs = []
+    for product in products:
+        for year in years:
+            remote_dir = root+'{0}-{1:04d}/'.format(product,int(year))
+            for station in stations:
+                for month in months:
+                    filename = asos_filename(product,station,year,month)
+                    jobs.append((remote_dir+filename,os.path.join(data_folder,filename)))
+    return jobs
+
+if __name__ == '__main__':
+    data_folder = './data/' # data where files will be saved (will be created)
+    if os.path.isdir(data_folder)==False:
+        os.mkdir(data_folder)
+    products = ['6406'] # ASOS one-minute products
+    stations = ['CQT','LGA','JFK'] # station identifiers
+    years = [2020]
+    months = range(1,7)
+    with FTPPool(ASOS_HOST,size=4) as pool:
+        download_files(pool,asos_batch_jobs(products,stations,years,months,data_folder))
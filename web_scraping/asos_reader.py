@@ -0,0 +1,250 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code parses automated surface observing station (ASOS)
+# one-minute data files (6405 and 6406 products) into typed
+# numpy columns. The whole file is read as one byte buffer and
+# every field is cut out with fixed-width slicing, so there is
+# no per-row Python loop. Malformed fields become NaN (or NaT,
+# or -1 for codes) instead of dropping the whole row
+#
+# Run this file directly to benchmark it against the row-by-row
+# csv loop used in FTP_asos_grabber.py:
+#    python asos_reader.py [optional_6406_file.dat]
+#
+################################################################
+#
+#
+import csv,datetime,os,sys,tempfile,time
+import numpy as np
+
+########################################
+# fixed-width layouts for each product
+########################################
+#
+# each field: (name, start column, stop column, field kind)
+# a stop column of None means 'until the end of the line'
+# the column boundaries match the slices in FTP_asos_grabber.py
+#
+ASOS_LAYOUTS = {
+    '6405':[('station',0,10,'str'),
+            ('time',13,25,'time'), # local standard time, YYYYMMDDHHMM
+            ('vis_1',33,59,'vis'), # visibility (with D/N day-night flag)
+            ('vis_2',59,70,'vis'),
+            ('wind_dir_2min',70,75,'float'), # wind direction (2-min avg)
+            ('wind_speed_2min',75,80,'float'), # wind speed (2-min avg)
+            ('wind_dir_max',80,85,'float'), # dir of max wind speed (5-sec)
+            ('wind_speed_max',85,90,'float'), # speed of max wind (5-sec)
+            ('rvr',90,None,'float')], # runway visual range (hundreds ft)
+    '6406':[('station',0,10,'str'),
+            ('time',13,25,'time'), # local standard time, YYYYMMDDHHMM
+            ('precip_type',32,44,'code'), # precip identifier (NP, R, S, ...)
+            ('precip_amount',44,62,'float'), # amount of precip
+            ('frozen_freq',62,70,'float'), # frozen precip sensor frequency
+            ('pres_1',70,76,'float'), # pressure 1 [inHg]
+            ('pres_2',76,86,'float'), # pressure 2 [inHg]
+            ('pres_3',86,95,'float'), # pressure 3 [inHg]
+            ('temp_dry',95,99,'float'), # avg 1-min dry bulb temp [F]
+            ('temp_dew',99,None,'float')] # avg 1-min dew point temp [F]
+    }
+
+# precipitation identifiers, the int8 code is the index in this tuple
+# (anything blank or unrecognized is stored as -1)
+PRECIP_TYPES = ('NP','R-','R','R+','S-','S','S+','P','UP')
+
+# day/night flags trailing the 6405 visibility values (-1 = missing)
+VIS_FLAGS = {ord('N'):0,ord('D'):1}
+
+_SPACE,_NEWLINE,_CR = 32,10,13
+_POW10 = 10.0**np.arange(-40,41) # lookup for digit place values
+
+#
+########################################
+# byte-level helpers
+########################################
+#
+def _line_matrix(buf,min_width):
+    buf = buf[buf!=_CR] # drop windows line endings
+    ends = np.flatnonzero(buf==_NEWLINE)
+    if len(buf)>0 and buf[-1]!=_NEWLINE:
+        ends = np.append(ends,len(buf)) # last line without newline
+    starts = np.concatenate(([0],ends[:-1]+1)).astype(np.int64)
+    lengths = ends-starts
+    starts,lengths = starts[lengths>0],lengths[lengths>0] # skip blank lines
+    width = int(max(min_width,lengths.max() if len(lengths)>0 else 0))
+    cols = np.arange(width)
+    inside = cols[None,:]<lengths[:,None]
+    indx = np.where(inside,starts[:,None]+cols[None,:],0)
+    lines = np.where(inside,buf[indx] if len(buf)>0 else _SPACE,_SPACE).astype(np.uint8) # pad short lines with blanks
+    return lines
+
+def _parse_numeric(block):
+    # vectorized float parser for right/left padded numeric text:
+    # [blanks][sign]digits[.digits][blanks], anything else -> NaN
+    n_rows,width = np.shape(block)
+    if n_rows==0 or width==0:
+        return np.full(n_rows,np.nan)
+    cols = np.arange(width)
+    is_digit = (block>=48) & (block<=57)
+    is_dot = block==46
+    is_sign = (block==45) | (block==43)
+    nonspace = block!=_SPACE
+    has_chars = nonspace.any(axis=1)
+    first = np.argmax(nonspace,axis=1) # first non-blank column
+    last = width-1-np.argmax(nonspace[:,::-1],axis=1) # last non-blank column
+    inside = (cols[None,:]>=first[:,None]) & (cols[None,:]<=last[:,None])
+
+    valid = has_chars & is_digit.any(axis=1)
+    valid &= ~(inside & ~nonspace).any(axis=1) # no blanks inside the number
+    valid &= ~(nonspace & ~(is_digit | is_dot | is_sign)).any(axis=1) # only numeric characters
+    valid &= ~(is_sign & (cols[None,:]!=first[:,None])).any(axis=1) # sign must lead
+    valid &= is_dot.sum(axis=1)<=1 # at most one decimal point
+
+    dot_col = np.where(is_dot.any(axis=1),np.argmax(is_dot,axis=1),last+1)
+    expo = dot_col[:,None]-cols[None,:]-(cols[None,:]<dot_col[:,None]) # place value of each column
+    place = _POW10[np.clip(expo,-40,40)+40]
+    vals = np.where(is_digit,(block-48)*place,0.0).sum(axis=1)
+    vals = np.where(block[np.arange(n_rows),first]==45,-vals,vals) # apply leading minus
+    vals[~valid] = np.nan
+    return vals
+
+def _parse_time(block):
+    # YYYYMMDDHHMM digits -> datetime64[m], malformed -> NaT
+    is_digit = (block>=48) & (block<=57)
+    valid = is_digit.all(axis=1)
+    digits = np.where(is_digit,block-48,0).astype(np.int64)
+    def _num(c0,c1):
+        return digits[:,c0:c1] @ (10**np.arange(c1-c0-1,-1,-1))
+    yr,mon,day,hr,mn = _num(0,4),_num(4,6),_num(6,8),_num(8,10),_num(10,12)
+    valid &= (mon>=1) & (mon<=12) & (day>=1) & (day<=31) & (hr<=23) & (mn<=59)
+    months = np.where(valid,(yr-1970)*12+(mon-1),0).astype('datetime64[M]')
+    t_vec = months.astype('datetime64[D]')+np.where(valid,day-1,0)
+    t_vec = t_vec.astype('datetime64[m]')+np.where(valid,hr*60+mn,0)
+    valid &= t_vec.astype('datetime64[M]')==months # catch days past the end of the month
+    t_vec[~valid] = np.datetime64('NaT')
+    return t_vec
+
+def _parse_code(block,names):
+    # map blank-stripped text fields onto small integer codes
+    block = np.ascontiguousarray(block)
+    if np.size(block)==0:
+        return np.full(len(block),-1,dtype=np.int8)
+    keys,inverse = np.unique(block.view('S{}'.format(np.shape(block)[1])).ravel(),return_inverse=True)
+    lookup = {name.encode():ii for ii,name in enumerate(names)}
+    key_codes = np.array([lookup.get(ii.strip(),-1) for ii in keys],dtype=np.int8)
+    return key_codes[inverse]
+
+def _parse_vis(block):
+    # visibility values carry a trailing D/N flag, split it off first
+    block = block.copy()
+    nonspace = block!=_SPACE
+    last = np.shape(block)[1]-1-np.argmax(nonspace[:,::-1],axis=1)
+    rows = np.arange(len(block))
+    last_char = np.where(nonspace.any(axis=1),block[rows,last],_SPACE)
+    flags = np.full(len(block),-1,dtype=np.int8)
+    for char,flag in VIS_FLAGS.items():
+        flags[last_char==char] = flag
+    has_flag = flags>=0
+    block[rows[has_flag],last[has_flag]] = _SPACE # blank out the flag
+    return _parse_numeric(block).astype(np.float32),flags
+
+#
+########################################
+# public readers
+########################################
+#
+def asos_layout(filename):
+    # product number is the first four characters, e.g. 64060KCQT202001.dat
+    layout = os.path.basename(filename)[0:4]
+    if layout not in ASOS_LAYOUTS:
+        raise ValueError('Unknown ASOS product for file: {}'.format(filename))
+    return layout
+
+def parse_asos_buffer(buf,layout):
+    # parse raw bytes of a 6405/6406 file into a dict of numpy columns
+    if layout not in ASOS_LAYOUTS:
+        raise ValueError('Unknown ASOS layout: {}'.format(layout))
+    fields = ASOS_LAYOUTS[layout]
+    buf = np.frombuffer(buf,dtype=np.uint8) if isinstance(buf,(bytes,bytearray,memoryview)) else buf
+    min_width = max([ii[2] if ii[2] is not None else ii[1]+1 for ii in fields])
+    lines = _line_matrix(buf,min_width)
+    columns = {}
+    for name,start,stop,kind in fields:
+        block = lines[:,start:stop]
+        if kind=='str':
+            columns[name] = np.char.strip(np.ascontiguousarray(block).view('S{}'.format(np.shape(block)[1])).ravel()).astype('U')
+        elif kind=='time':
+            columns[name] = _parse_time(block)
+        elif kind=='code':
+            columns[name] = _parse_code(block,PRECIP_TYPES)
+        elif kind=='vis':
+            columns[name],columns[name+'_flag'] = _parse_vis(block)
+        else:
+            columns[name] = _parse_numeric(block).astype(np.float32)
+    return columns
+
+def read_asos_file(filename,layout=None):
+    # read an entire ASOS one-minute file into typed numpy columns
+    layout = asos_layout(filename) if layout is None else layout
+    buf = np.fromfile(filename,dtype=np.uint8)
+    return parse_asos_buffer(buf,layout)
+
+#
+########################################
+# benchmark vs. the csv/np.append loop
+########################################
+#
+def legacy_parse_6406(filename):
+    # the original parsing loop from FTP_asos_grabber.py (for benchmarking)
+    data_ii = []
+    with open(filename, newline='') as dat_file:
+        csvreader = csv.reader(dat_file)
+        for row in csvreader:
+            row = row[0]
+            data_ii.append([row[0:10],row[10:32],row[32:44],row[44:62],row[62:70],
+                            row[70:76],row[76:86],row[86:95],row[95:99],row[99:]])
+    t_strs,pres,temp_dry,temp_wet = np.array([]),np.array([]),np.array([]),np.array([])
+    for dats in data_ii:
+        try:
+            t_ii = (dats[1][3:].replace(' ',''))
+            pres_ii = float(dats[5])
+            temp_dry_ii = float(dats[8])
+            temp_wet_ii = float(dats[9])
+            t_strs = np.append(t_strs,t_ii)
+            pres = np.append(pres,pres_ii)
+            temp_dry = np.append(temp_dry,temp_dry_ii)
+            temp_wet = np.append(temp_wet,temp_wet_ii)
+        except:
+            pass
+    t_vec = [datetime.datetime.strptime(ii[0:-4],'%Y%m%d%H%M') for ii in t_strs]
+    return t_vec,pres,temp_dry,temp_wet
+
+def synthetic_6406_file(filename,n_days=31):
+    # write a month of one-minute lines in the 6406 column layout
+    t_0 = datetime.datetime(2020,1,1)
+    rng = np.random.default_rng(0)
+    with open(filename,'w') as out_file:
+        for ii in range(n_days*24*60):
+            t_ii = t_0+datetime.timedelta(minutes=ii)
+            pres = 29.9+0.1*rng.random()
+            out_file.write('{0:10s}{1:3s}{2:12s}{3:4s}{4:3s}{5:12s}{6:18s}{7:8s}{8:6.3f}{9:10.3f}{10:9.3f}{11:4d}{12:4d}\n'.\
+                           format('23129KCQT','CQT',t_ii.strftime('%Y%m%d%H%M'),'0800','','   NP','     0.00','    0',
+                                  pres,pres+0.005,pres-0.002,int(60+10*rng.random()),int(40+10*rng.random())))
+    return filename
+
+if __name__ == '__main__':
+    if len(sys.argv)>1:
+        bench_file = sys.argv[1] # user-supplied 6406 file
+    else:
+        bench_file = synthetic_6406_file(os.path.join(tempfile.mkdtemp(),'64060KCQT202001.dat'))
+    t_start = time.perf_counter()
+    t_vec,pres,temp_dry,temp_wet = legacy_parse_6406(bench_file)
+    t_legacy = time.perf_counter()-t_start
+    t_start = time.perf_counter()
+    columns = read_asos_file(bench_file,layout='6406')
+    t_new = time.perf_counter()-t_start
+    print('Rows parsed: {0:d} (legacy loop kept {1:d})'.format(len(columns['time']),len(t_vec)))
+    print('csv + np.append loop: {0:8.3f} s'.format(t_legacy))
+    print('vectorized reader:    {0:8.3f} s ({1:2.1f}x faster)'.format(t_new,t_legacy/t_new))
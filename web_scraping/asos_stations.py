@@ -0,0 +1,127 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code parses the ASOS station table (asos-stations.txt)
+# once into a compact numpy structured array, caches it next
+# to the text file, and builds a KD-tree over the stations for
+# great-circle nearest-station and radius queries. Stations are
+# indexed as unit vectors on the sphere, where straight-line
+# (chord) distance is monotonic with great-circle distance, so
+# the queries are correct near the poles and the antimeridian
+#
+################################################################
+#
+#
+import os
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius
+FLOAT_COLUMNS = ('LAT','LON','ELEV') # numeric columns in the station table
+
+########################################
+# parsing and caching the station table
+########################################
+#
+def _column_spans(dash_line):
+    # the dashed line under the header gives each column's width
+    spans,start = [],0
+    for dashes in dash_line.split(' '):
+        spans.append((start,start+len(dashes)+1))
+        start += len(dashes)+1
+    return spans
+
+def _float_or_nan(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan # blank or malformed entries
+
+def parse_station_table(asos_filename):
+    # asos-stations.txt -> structured array (one record per station)
+    with open(asos_filename,'r') as txtfile:
+        lines = txtfile.read().splitlines()
+    header_indx = [ii for ii,line in enumerate(lines) if line[0:6]=='NCDCID'][0]
+    spans = _column_spans(lines[header_indx+1].rstrip())
+    names = [lines[header_indx][s0:s1].strip() for s0,s1 in spans]
+    rows = [line for line in lines[header_indx+2:] if line.strip()!='']
+    dtype,columns = [],[]
+    for name,(s0,s1) in zip(names,spans):
+        text = np.array([row[s0:s1].strip() for row in rows])
+        if name in FLOAT_COLUMNS:
+            vals = np.array([_float_or_nan(ii) for ii in text],
+                            dtype=np.float64 if name in ('LAT','LON') else np.float32)
+            columns.append(vals)
+            dtype.append((name,vals.dtype))
+        else:
+            columns.append(text)
+            dtype.append((name,'U{}'.format(max(1,np.char.str_len(text).max() if len(text)>0 else 1))))
+    stations = np.empty(len(rows),dtype=dtype)
+    for (name,_),col in zip(dtype,columns):
+        stations[name] = col
+    return stations
+
+def load_stations(asos_filename='asos-stations.txt',cache_file=None):
+    # load the station table, re-parsing only when the text file is newer
+    cache_file = os.path.splitext(asos_filename)[0]+'.npy' if cache_file is None else cache_file
+    if os.path.isfile(cache_file) and os.path.getmtime(cache_file)>=os.path.getmtime(asos_filename):
+        return np.load(cache_file,allow_pickle=False)
+    stations = parse_station_table(asos_filename)
+    np.save(cache_file,stations,allow_pickle=False)
+    return stations
+
+#
+########################################
+# great-circle station index
+########################################
+#
+def lonlat_to_xyz(lats,lons):
+    # degrees -> unit vectors on the sphere (..., 3)
+    lats,lons = np.radians(np.asarray(lats,dtype=np.float64)),np.radians(np.asarray(lons,dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.stack((cos_lat*np.cos(lons),cos_lat*np.sin(lons),np.sin(lats)),axis=-1)
+
+def chord_to_km(chord):
+    return 2.0*EARTH_RADIUS_KM*np.arcsin(np.clip(chord/2.0,0.0,1.0))
+
+def km_to_chord(dist_km):
+    return 2.0*np.sin(np.minimum(np.asarray(dist_km,dtype=np.float64)/(2.0*EARTH_RADIUS_KM),np.pi/2.0))
+
+class StationIndex(object):
+    # KD-tree over station unit vectors, queries take arrays of any shape
+    def __init__(self,stations):
+        good = np.isfinite(stations['LAT']) & np.isfinite(stations['LON'])
+        self.stations = stations[good] # drop stations without coordinates
+        self.tree = cKDTree(lonlat_to_xyz(self.stations['LAT'],self.stations['LON']))
+
+    def nearest(self,lats,lons,k=1):
+        # k nearest stations to every point -> (distances [km], station indices)
+        # output shapes are np.shape(lats) (k=1) or np.shape(lats)+(k,)
+        xyz = lonlat_to_xyz(lats,lons)
+        chord,indx = self.tree.query(xyz.reshape(-1,3),k=k)
+        out_shape = np.shape(lats) if k==1 else np.shape(lats)+(k,)
+        return chord_to_km(chord).reshape(out_shape),indx.reshape(out_shape)
+
+    def within(self,lats,lons,radius_km):
+        # station indices within radius_km of every point (one array per point)
+        xyz = lonlat_to_xyz(lats,lons).reshape(-1,3)
+        hits = self.tree.query_ball_point(xyz,km_to_chord(radius_km))
+        return [np.array(sorted(ii),dtype=np.intp) for ii in hits]
+
+    def count_within(self,lats,lons,radius_km):
+        # number of stations within radius_km of every point
+        xyz = lonlat_to_xyz(lats,lons).reshape(-1,3)
+        return self.tree.query_ball_point(xyz,km_to_chord(radius_km),return_length=True).reshape(np.shape(lats))
+
+if __name__ == '__main__':
+    stations = load_stations('asos-stations.txt') # parsed once, then read from the .npy cache
+    station_index = StationIndex(stations)
+    my_lats = np.array([34.0522,40.7128,41.8781,21.3069]) # LA, NYC, Chicago, Honolulu
+    my_lons = np.array([-118.2437,-74.0060,-87.6298,-157.8583])
+    dists,indx = station_index.nearest(my_lats,my_lons,k=3)
+    for ii in range(len(my_lats)):
+        print('({0:2.4f},{1:2.4f}): '.format(my_lats[ii],my_lons[ii])+\
+              ', '.join(['{0} ({1:2.1f} km)'.format(station_index.stations['CALL'][jj],dd)
+                         for jj,dd in zip(indx[ii],dists[ii])]))
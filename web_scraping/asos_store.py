@@ -0,0 +1,187 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code stores parsed ASOS one-minute data on disk in a
+# partitioned columnar layout, so files are parsed only once
+# (until they change on disk):
+#
+#   store_root/6406/KCQT/2020/01/time.npy
+#   store_root/6406/KCQT/2020/01/pres_1.npy ...
+#   store_root/manifest.json
+#
+# Every partition is one station-month with one .npy file per
+# variable (opened memory-mapped on read), and the manifest lists
+# each partition's row count and time range. Queries only open
+# the partitions that overlap the requested stations and times,
+# and writing a new month only rewrites the partitions it has rows
+# in (merged with the rows already stored there)
+#
+################################################################
+#
+#
+import json,os,shutil,uuid
+import numpy as np
+from asos_reader import read_asos_file,asos_layout
+
+MANIFEST_NAME = 'manifest.json'
+
+########################################
+# partition helpers
+########################################
+#
+def station_key(station):
+    # '23129KCQT' or 'KCQT' -> 'KCQT', 'CQT' -> 'KCQT'
+    station = station.strip().upper()
+    if len(station)==3:
+        return 'K'+station
+    return station[-4:]
+
+def _station_matches(key,stations):
+    if stations is None:
+        return True
+    for station in stations:
+        station = station.strip().upper()
+        if key==station or (len(station)==3 and key[1:]==station):
+            return True # 3-letter ids match any 4-letter prefix (e.g. HNL -> PHNL)
+    return False
+
+#
+########################################
+# the columnar store
+########################################
+#
+class ASOSStore(object):
+    def __init__(self,store_root='./asos_store/'):
+        self.store_root = store_root
+        if os.path.isdir(store_root)==False:
+            os.makedirs(store_root)
+        self.manifest_file = os.path.join(store_root,MANIFEST_NAME)
+        self.partitions = {} # 'layout/station/yyyy/mm' -> partition info
+        self.files = {} # raw files already ingested: basename -> [size, mtime_ns]
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file,'r') as json_file:
+                manifest = json.load(json_file)
+            self.partitions,self.files = manifest['partitions'],manifest.get('files',{})
+            if isinstance(self.files,list): # older manifests kept basenames only
+                self.files = {ii:None for ii in self.files}
+
+    def _save_manifest(self):
+        tmp_file = self.manifest_file+'.tmp'
+        with open(tmp_file,'w') as json_file:
+            json.dump({'partitions':self.partitions,'files':self.files},json_file,indent=1,sort_keys=True)
+        os.replace(tmp_file,self.manifest_file)
+
+    def _write_partition(self,key,columns):
+        # write every column into a temporary folder, then swap it in
+        final_dir = os.path.join(self.store_root,*key.split('/'))
+        tmp_dir = final_dir+'.tmp-'+uuid.uuid4().hex[0:8]
+        os.makedirs(tmp_dir)
+        for name,col in columns.items():
+            np.save(os.path.join(tmp_dir,name+'.npy'),np.ascontiguousarray(col),allow_pickle=False)
+        if os.path.isdir(final_dir):
+            old_dir = final_dir+'.old-'+uuid.uuid4().hex[0:8]
+            os.replace(final_dir,old_dir)
+            os.replace(tmp_dir,final_dir)
+            shutil.rmtree(old_dir) # only this partition is ever rewritten
+        else:
+            os.replace(tmp_dir,final_dir)
+
+    def _merge_partition(self,key,part_cols):
+        # new rows merged with the partition already stored under key:
+        # sorted by time, with new rows replacing stored rows at the same time
+        if key not in self.partitions:
+            return part_cols
+        stored = self.read_partition(key)
+        if set(stored)!=set(part_cols):
+            raise ValueError('Columns of {0} differ from the stored partition {1}'.format(sorted(part_cols),key))
+        merged = {name:np.concatenate((part_cols[name],np.array(stored[name]))) for name in part_cols}
+        order = np.argsort(merged['time'],kind='stable') # new rows first among equal times
+        t_vec = merged['time'][order]
+        keep = order[np.concatenate(([True],t_vec[1:]!=t_vec[:-1]))]
+        return {name:col[keep] for name,col in merged.items()}
+
+    def write(self,columns,layout,station=None):
+        # add parsed columns (from read_asos_file) to the store, split into
+        # station-month partitions, returns the partition keys written
+        t_vec = columns['time']
+        good = ~np.isnat(t_vec) # rows without a timestamp can't be partitioned
+        if not np.any(good):
+            return [] # empty file, or nothing with a valid timestamp
+        station = station_key(columns['station'][0] if station is None else station)
+        months = t_vec[good].astype('datetime64[M]')
+        keys = []
+        for month in np.unique(months):
+            year,mon = int(str(month)[0:4]),int(str(month)[5:7])
+            in_month = np.flatnonzero(good)[months==month]
+            in_month = in_month[np.argsort(t_vec[in_month],kind='stable')] # time-sorted partitions
+            part_cols = {name:col[in_month] for name,col in columns.items() if name!='station'}
+            key = '{0}/{1}/{2:04d}/{3:02d}'.format(layout,station,year,mon)
+            part_cols = self._merge_partition(key,part_cols) # e.g. a few rows from a neighbouring month's file
+            self._write_partition(key,part_cols)
+            self.partitions[key] = {'layout':layout,'station':station,'year':year,'month':mon,
+                                    'n_rows':int(len(part_cols['time'])),
+                                    't_min':str(part_cols['time'][0]),'t_max':str(part_cols['time'][-1]),
+                                    'columns':{name:col.dtype.str for name,col in part_cols.items()}}
+            keys.append(key)
+        self._save_manifest()
+        return keys
+
+    def ingest(self,filenames,layout=None):
+        # parse and store raw .dat files, skipping files already ingested
+        # unless their size or modification time changed (e.g. a monthly
+        # file downloaded again after NCEI updated it), which are merged again
+        written = []
+        for filename in filenames:
+            file_layout = asos_layout(filename) if layout is None else layout
+            base = os.path.basename(filename)
+            stat = os.stat(filename)
+            stamp = [stat.st_size,stat.st_mtime_ns]
+            if self.files.get(base)==stamp:
+                continue
+            written += self.write(read_asos_file(filename,file_layout),file_layout)
+            self.files[base] = stamp
+            self._save_manifest()
+        return written
+
+    def select(self,layout,stations=None,t_start=None,t_end=None):
+        # partition keys overlapping the stations and [t_start, t_end)
+        t_start = None if t_start is None else np.datetime64(t_start,'m')
+        t_end = None if t_end is None else np.datetime64(t_end,'m')
+        keys = []
+        for key,part in sorted(self.partitions.items()):
+            if part['layout']!=layout or not _station_matches(part['station'],stations):
+                continue
+            if t_start is not None and np.datetime64(part['t_max'],'m')<t_start:
+                continue
+            if t_end is not None and np.datetime64(part['t_min'],'m')>=t_end:
+                continue
+            keys.append(key)
+        return keys
+
+    def read_partition(self,key,columns=None):
+        # memory-mapped columns of a single partition
+        part = self.partitions[key]
+        part_dir = os.path.join(self.store_root,*key.split('/'))
+        names = list(part['columns']) if columns is None else list(columns)
+        return {name:np.load(os.path.join(part_dir,name+'.npy'),mmap_mode='r') for name in names}
+
+    def query(self,layout,stations=None,t_start=None,t_end=None,columns=None):
+        # read [t_start, t_end) for the stations, touching only the overlapping
+        # partitions, returns a dict of columns plus a 'station' column
+        t_start = None if t_start is None else np.datetime64(t_start,'m')
+        t_end = None if t_end is None else np.datetime64(t_end,'m')
+        columns = None if columns is None else ['time']+[ii for ii in columns if ii!='time']
+        pieces = []
+        for key in self.select(layout,stations,t_start,t_end):
+            part = self.read_partition(key,columns)
+            t_vec = part['time']
+            i_0 = 0 if t_start is None else np.searchsorted(t_vec,t_start,side='left')
+            i_1 = len(t_vec) if t_end is None else np.searchsorted(t_vec,t_end,side='left')
+            piece = {name:np.array(col[i_0:i_1]) for name,col in part.items()} # copy out of the memmap
+            piece['station'] = np.full(i_1-i_0,self.partitions[key]['station'])
+            pieces.append(piece)
+        if len(pieces)==0:
+            return {}
+        return {name:np.concatenate([ii[name] for ii in pieces]) for name in pieces[0]}
@@ -0,0 +1,221 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code keeps a persistent, time-indexed catalog of GOES-16/17
+# scans in the GCP buckets. Blob names such as:
+#
+#  ABI-L2-LSTC/2020/153/17/OR_ABI-L2-LSTC-M6_G16_s20201531701133_e20201531703506_c20201531704438.nc
+#
+# are parsed in bulk (start/end/creation times, product, scan mode,
+# channel and satellite) with numpy byte operations, indexed by
+# product, satellite, channel and start time, and saved to disk. Hour prefixes are
+# only listed once, so queries such as 'nearest scan to T', 'every
+# N minutes between T0 and T1' and 'latest scan' are answered from
+# sorted arrays without re-listing the bucket
+#
+################################################################
+#
+#
+import datetime,os
+import numpy as np
+
+########################################
+# vectorized blob-name parsing
+########################################
+#
+def _stamp_to_datetime64(chars,offsets):
+    # 'YYYYJJJHHMMSSt' digits at each offset -> datetime64[ms] (NaT if malformed)
+    n_rows = len(chars)
+    cols = offsets[:,None]+np.arange(14)[None,:]
+    in_range = (offsets>=0)[:,None] & (cols<np.shape(chars)[1])
+    digits = np.where(in_range,chars[np.arange(n_rows)[:,None],np.clip(cols,0,np.shape(chars)[1]-1)],0).astype(np.int64)-48
+    valid = np.all(in_range & (digits>=0) & (digits<=9),axis=1)
+    def _num(c0,c1):
+        return digits[:,c0:c1] @ (10**np.arange(c1-c0-1,-1,-1))
+    yr,doy,hr,mn,sec,tenth = _num(0,4),_num(4,7),_num(7,9),_num(9,11),_num(11,13),_num(13,14)
+    valid &= (doy>=1) & (doy<=366) & (hr<=23) & (mn<=59) & (sec<=60)
+    t_vec = np.where(valid,yr-1970,0).astype('datetime64[Y]').astype('datetime64[D]')+np.where(valid,doy-1,0)
+    t_vec = t_vec.astype('datetime64[ms]')+np.where(valid,((hr*60+mn)*60+sec)*1000+tenth*100,0)
+    t_vec[~valid] = np.datetime64('NaT')
+    return t_vec
+
+def parse_goes_names(names):
+    # parse many blob names at once, returns a dict of arrays:
+    # name, product (e.g. ABI-L2-LSTC), mode (e.g. M6), channel (e.g. C13,
+    # '' for products without bands), satellite (e.g. G16), start, end,
+    # created (datetime64[ms])
+    names = np.asarray(names,dtype='U')
+    basenames = np.char.rpartition(names,'/')[:,2]
+    encoded = np.char.encode(basenames,'ascii')
+    width = encoded.dtype.itemsize
+    chars = np.frombuffer(encoded.tobytes(),dtype=np.uint8).reshape(len(names),width) if len(names)>0 \
+            else np.zeros((0,1),dtype=np.uint8)
+    s_pos = np.char.find(encoded,b'_s')
+    e_pos = np.char.find(encoded,b'_e',np.maximum(s_pos,0)) # each stamp follows the previous one
+    c_pos = np.char.find(encoded,b'_c',np.maximum(e_pos,0))
+    parsed = {'name':names,
+              'start':_stamp_to_datetime64(chars,np.where(s_pos>=0,s_pos+2,-1)),
+              'end':_stamp_to_datetime64(chars,np.where(e_pos>=0,e_pos+2,-1)),
+              'created':_stamp_to_datetime64(chars,np.where(c_pos>=0,c_pos+2,-1))}
+    # the head ('OR_ABI-L2-LSTC-M6_G16') only takes a handful of distinct
+    # values, so only the unique heads are split in python
+    head_len = np.where(s_pos>=0,s_pos,0)
+    heads = np.where(np.arange(width)[None,:]<head_len[:,None],chars,0).astype(np.uint8)
+    unique_heads,inverse = np.unique(np.ascontiguousarray(heads).view('S{}'.format(width)).ravel(),return_inverse=True)
+    split_heads = [_split_head(ii.decode()) for ii in unique_heads.tolist()]
+    for jj,field in enumerate(('product','mode','channel','satellite')):
+        parsed[field] = np.array([ii[jj] for ii in split_heads],dtype='U')[inverse] if len(names)>0 \
+                        else np.array([],dtype='U1')
+    return parsed
+
+def _split_head(head):
+    # 'OR_ABI-L2-LSTC-M6_G16' -> ('ABI-L2-LSTC', 'M6', '', 'G16')
+    # 'OR_ABI-L1b-RadC-M6C13_G16' -> ('ABI-L1b-RadC', 'M6', 'C13', 'G16')
+    parts = head.split('_')
+    if len(parts)<3:
+        return ('','','','')
+    product = parts[1]
+    mode,channel = '',''
+    if len(product.split('-'))>3 and product.split('-')[-1][0:1]=='M':
+        product,mode = product.rsplit('-',1) # scan mode (M3, M4, M6)
+        if 'C' in mode:
+            mode,channel = mode.split('C',1)
+            channel = 'C'+channel # band (C01-C16)
+    return (product,mode,channel,parts[2])
+
+def hour_prefixes(product_ID,t_start,t_end):
+    # GCP hour folders between two datetimes, e.g. ABI-L2-LSTC/2020/153/17
+    t_hour = datetime.datetime(t_start.year,t_start.month,t_start.day,t_start.hour)
+    prefixes = []
+    while t_hour<=t_end:
+        prefixes.append('{0}/{1:04d}/{2:03d}/{3:02d}'.format(product_ID.strip('/'),t_hour.year,
+                                                            t_hour.timetuple().tm_yday,t_hour.hour))
+        t_hour += datetime.timedelta(hours=1)
+    return prefixes
+
+#
+########################################
+# persistent scan catalog
+########################################
+#
+_FIELDS = ('name','product','mode','channel','satellite','start','end','created')
+
+class GOESCatalog(object):
+    def __init__(self,catalog_file='goes_catalog.npz'):
+        self.catalog_file = catalog_file
+        if os.path.dirname(catalog_file)!='' and os.path.isdir(os.path.dirname(catalog_file))==False:
+            os.makedirs(os.path.dirname(catalog_file))
+        self.scans = {ii:np.array([],dtype='datetime64[ms]' if ii in ('start','end','created') else 'U1')
+                      for ii in _FIELDS}
+        self.listed = {} # hour prefix -> time it was listed
+        if os.path.isfile(catalog_file):
+            with np.load(catalog_file) as saved:
+                self.scans = {ii:saved[ii] for ii in _FIELDS if ii in saved.files}
+                self.listed = dict(zip(saved['listed_prefixes'].tolist(),saved['listed_times']))
+            if 'channel' not in self.scans: # catalogs saved before channels were split from modes
+                self.scans['mode'],_,channel = np.char.partition(self.scans['mode'],'C').T
+                self.scans['channel'] = np.where(np.char.str_len(channel)>0,np.char.add('C',channel),'')
+                self.listed = {} # bands were collapsed into one scan, so list every hour again
+        self._build_index()
+
+    def _build_index(self):
+        # one start-time sorted view per (product, satellite, channel)
+        self._groups = {}
+        keys = np.char.add(np.char.add(np.char.add(np.char.add(self.scans['product'],'|'),self.scans['satellite']),'|'),
+                           self.scans['channel'])
+        for key in np.unique(keys):
+            indx = np.flatnonzero(keys==key)
+            indx = indx[np.argsort(self.scans['start'][indx],kind='stable')]
+            self._groups[tuple(key.split('|'))] = (self.scans['start'][indx].astype(np.int64),indx)
+
+    def save(self):
+        tmp_file = self.catalog_file+'.tmp.npz'
+        np.savez(tmp_file,listed_prefixes=np.array(list(self.listed),dtype='U'),
+                 listed_times=np.array(list(self.listed.values()),dtype='datetime64[s]'),**self.scans)
+        os.replace(tmp_file,self.catalog_file)
+
+    def add_names(self,names):
+        # parse and add blob names, keeping the newest creation of each scan
+        parsed = parse_goes_names(names)
+        good = ~np.isnat(parsed['start'])
+        merged = {ii:np.concatenate((self.scans[ii],parsed[ii][good])) for ii in _FIELDS}
+        scan_key = np.char.add(np.char.add(np.char.add(merged['product'],merged['satellite']),merged['channel']),
+                               merged['start'].astype(np.int64).astype('U'))
+        created = np.where(np.isnat(merged['created']),-2**62,merged['created'].astype(np.int64))
+        order = np.lexsort((-created,scan_key)) # newest creation first per scan
+        _,first = np.unique(scan_key[order],return_index=True)
+        keep = order[first]
+        self.scans = {ii:merged[ii][keep] for ii in _FIELDS}
+        self._build_index()
+        return int(np.sum(good))
+
+    def sync(self,bucket,product_ID,t_start,t_end,relist_recent=datetime.timedelta(hours=2)):
+        # list the hour prefixes between t_start and t_end that haven't been listed,
+        # re-listing only hours that were still recent when they were last listed
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # naive UTC, like the prefix hours
+        new_names = []
+        for prefix in hour_prefixes(product_ID,t_start,t_end):
+            listed_at = self.listed.get(prefix)
+            prefix_hour = datetime.datetime.strptime('/'.join(prefix.split('/')[-3:]),'%Y/%j/%H')
+            if listed_at is not None and listed_at.astype(datetime.datetime)-prefix_hour>=\
+               datetime.timedelta(hours=1)+relist_recent:
+                continue # hour was complete when listed
+            new_names += [ii['name'] for ii in bucket.list_blobs(prefix)]
+            self.listed[prefix] = np.datetime64(now,'s')
+        if len(new_names)>0:
+            self.add_names(new_names)
+        self.save()
+        return len(new_names)
+
+    #
+    # queries (times as datetime.datetime or numpy.datetime64)
+    #
+    def _group(self,product,satellite=None,channel=None):
+        # satellite and channel default to the first one in the catalog
+        if satellite is None:
+            sats = [ii[1] for ii in self._groups if ii[0]==product]
+            if len(sats)==0:
+                raise KeyError('No scans for product {}'.format(product))
+            satellite = sorted(sats)[0]
+        if channel is None:
+            channels = [ii[2] for ii in self._groups if ii[0:2]==(product,satellite)]
+            channel = sorted(channels)[0] if len(channels)>0 else ''
+        if (product,satellite,channel) not in self._groups:
+            raise KeyError('No scans for product {} {} on {}'.format(product,channel,satellite))
+        return self._groups[(product,satellite,channel)]
+
+    def _records(self,indx):
+        return [{ii:self.scans[ii][jj] for ii in _FIELDS} for jj in np.atleast_1d(indx)]
+
+    def nearest(self,product,t_query,satellite=None,channel=None):
+        # scan whose start time is closest to t_query (arrays of times allowed)
+        starts,indx = self._group(product,satellite,channel)
+        t_ms = np.atleast_1d(np.asarray(t_query,dtype='datetime64[ms]')).astype(np.int64)
+        right = np.clip(np.searchsorted(starts,t_ms),1,len(starts)-1) if len(starts)>1 else np.zeros(len(t_ms),int)
+        left = np.maximum(right-1,0)
+        pick = np.where(np.abs(starts[left]-t_ms)<=np.abs(starts[right]-t_ms),left,right)
+        records = self._records(indx[pick])
+        return records[0] if np.ndim(t_query)==0 else records
+
+    def between(self,product,t_start,t_end,every=None,satellite=None,channel=None):
+        # scans starting in [t_start, t_end], or the scan nearest every
+        # 'every' (datetime.timedelta) step when given
+        starts,indx = self._group(product,satellite,channel)
+        t_0 = np.datetime64(t_start,'ms').astype(np.int64)
+        t_1 = np.datetime64(t_end,'ms').astype(np.int64)
+        i_0,i_1 = np.searchsorted(starts,t_0,side='left'),np.searchsorted(starts,t_1,side='right')
+        if every is None or i_1<=i_0:
+            return self._records(indx[i_0:i_1]) if i_1>i_0 else []
+        step = int(every.total_seconds()*1000)
+        targets = np.arange(t_0,t_1+1,step)
+        window = starts[i_0:i_1]
+        right = np.clip(np.searchsorted(window,targets),0,len(window)-1)
+        left = np.maximum(right-1,0)
+        pick = np.where(np.abs(window[left]-targets)<=np.abs(window[right]-targets),left,right)
+        return self._records(indx[i_0:i_1][np.unique(pick)])
+
+    def latest(self,product,satellite=None,channel=None):
+        starts,indx = self._group(product,satellite,channel)
+        return self._records(indx[-1])[0]
@@ -0,0 +1,252 @@
+################################################################
+# Copyright (c) 2020
+# Author: Joshua Hrisko
+################################################################
+#
+# This code fetches GOES-16/17 blobs from the Google Cloud
+# Platform (GCP) bucket into a local, size-capped cache:
+#   - many blobs are downloaded at once with a thread pool, and
+#     large blobs are split into ranged reads
+#   - every blob is verified against its MD5 (or CRC32C) hash
+#   - the cache is content-addressed (one file per hash, shared
+#     by every blob name with that content) and evicts the least
+#     recently used files when it grows past its cap
+# A local folder can stand in for the bucket (LocalBucket), so
+# the whole layer can be used without network access
+#
+################################################################
+#
+#
+import base64,hashlib,json,os,shutil,threading,time,uuid
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 8*1024*1024 # bytes per ranged read
+INDEX_NAME = 'cache_index.json'
+
+########################################
+# buckets (GCP and local stand-in)
+########################################
+#
+# both bucket types provide:
+#   list_blobs(prefix) -> [{'name','size','md5','crc32c'}] (hashes base64, or None)
+#   read_range(name,start,end) -> bytes [start, end)
+#
+class GCSBucket(object):
+    def __init__(self,bucket_name='gcp-public-data-goes-16',client=None):
+        from google.cloud import storage # only needed when talking to GCP
+        self.client = storage.Client.create_anonymous_client() if client is None else client
+        self.bucket = self.client.bucket(bucket_name)
+
+    def list_blobs(self,prefix):
+        return [{'name':blob.name,'size':blob.size,'md5':blob.md5_hash,'crc32c':blob.crc32c}
+                for blob in self.client.list_blobs(self.bucket,prefix=prefix)]
+
+    def read_range(self,name,start,end):
+        return self.bucket.blob(name).download_as_bytes(start=start,end=end-1) # GCS end is inclusive
+
+class LocalBucket(object):
+    # a folder laid out like the bucket (e.g. ABI-L2-LSTC/2020/153/17/...nc)
+    def __init__(self,root):
+        self.root = root
+
+    def _path(self,name):
+        return os.path.join(self.root,*name.split('/'))
+
+    def list_blobs(self,prefix):
+        # only the folder the prefix points into is walked
+        folder_prefix = prefix[0:prefix.rfind('/')+1]
+        blobs = []
+        for folder,_,files in os.walk(self._path(folder_prefix) if folder_prefix!='' else self.root):
+            for filename in files:
+                name = os.path.relpath(os.path.join(folder,filename),self.root).replace(os.sep,'/')
+                if name.startswith(prefix):
+                    blobs.append({'name':name,'size':os.path.getsize(self._path(name)),
+                                  'md5':_file_md5(self._path(name)),'crc32c':None})
+        return sorted(blobs,key=lambda ii:ii['name'])
+
+    def read_range(self,name,start,end):
+        with open(self._path(name),'rb') as fp:
+            fp.seek(start)
+            return fp.read(end-start)
+
+#
+########################################
+# hashing
+########################################
+#
+def _file_md5(filename):
+    md5 = hashlib.md5()
+    with open(filename,'rb') as fp:
+        for block in iter(lambda:fp.read(1024*1024),b''):
+            md5.update(block)
+    return base64.b64encode(md5.digest()).decode()
+
+def _file_crc32c(filename):
+    import google_crc32c # optional, only used for blobs without an MD5
+    crc = google_crc32c.Checksum()
+    with open(filename,'rb') as fp:
+        for block in iter(lambda:fp.read(1024*1024),b''):
+            crc.update(block)
+    return base64.b64encode(crc.digest()).decode()
+
+def verify_blob(filename,blob):
+    # check a downloaded file against the blob's size and hash,
+    # returns the content key (hex digest) used by the cache
+    if blob.get('size') is not None and os.path.getsize(filename)!=blob['size']:
+        raise IOError('Size mismatch for {}'.format(blob['name']))
+    if blob.get('md5') is not None:
+        got = _file_md5(filename)
+        if got!=blob['md5']:
+            raise IOError('MD5 mismatch for {}'.format(blob['name']))
+        return 'md5-'+base64.b64decode(got).hex()
+    if blob.get('crc32c') is not None:
+        got = _file_crc32c(filename)
+        if got!=blob['crc32c']:
+            raise IOError('CRC32C mismatch for {}'.format(blob['name']))
+        return 'crc32c-'+base64.b64decode(got).hex()
+    return 'md5-'+base64.b64decode(_file_md5(filename)).hex() # unverifiable, key on content only
+
+#
+########################################
+# content-addressed LRU cache
+########################################
+#
+class BlobCache(object):
+    def __init__(self,bucket,cache_dir='./goes_cache/',max_bytes=20*1024**3,n_threads=8,chunk_size=CHUNK_SIZE):
+        self.bucket,self.cache_dir,self.max_bytes = bucket,cache_dir,max_bytes
+        self.n_threads,self.chunk_size = n_threads,chunk_size
+        self._lock = threading.Lock()
+        self.index_file = os.path.join(cache_dir,INDEX_NAME)
+        self.names,self.objects = {},{} # blob name -> key, key -> {'path','size','atime'}
+        if os.path.isdir(cache_dir)==False:
+            os.makedirs(cache_dir)
+        if os.path.isfile(self.index_file):
+            with open(self.index_file,'r') as json_file:
+                saved = json.load(json_file)
+            self.names,self.objects = saved['names'],saved['objects']
+        for key in list(self.objects):
+            if not os.path.isfile(self.objects[key]['path']):
+                self._forget(key) # files removed behind the cache's back
+
+    def _forget(self,key):
+        self.objects.pop(key,None)
+        for name in [ii for ii,jj in self.names.items() if jj==key]:
+            del self.names[name]
+
+    def save_index(self):
+        with self._lock:
+            saved = json.dumps({'names':self.names,'objects':self.objects})
+        tmp_file = self.index_file+'.tmp'
+        with open(tmp_file,'w') as json_file:
+            json_file.write(saved)
+        os.replace(tmp_file,self.index_file)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum([ii['size'] for ii in self.objects.values()])
+
+    def evict(self,keep=()):
+        # drop least recently used objects until the cache fits its cap
+        with self._lock:
+            total = sum([ii['size'] for ii in self.objects.values()])
+            for key in sorted(self.objects,key=lambda ii:self.objects[ii]['atime']):
+                if total<=self.max_bytes:
+                    break
+                if key in keep:
+                    continue # never evict what the current fetch returns
+                total -= self.objects[key]['size']
+                path = self.objects[key]['path']
+                self._forget(key)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def lookup(self,name):
+        # local path of a cached blob (and mark it as recently used), or None
+        with self._lock:
+            key = self.names.get(name)
+            if key is None or key not in self.objects:
+                return None
+            self.objects[key]['atime'] = time.time()
+            return self.objects[key]['path']
+
+    def _download(self,blob,pool):
+        # ranged parallel download into a temporary file
+        tmp_file = os.path.join(self.cache_dir,'tmp-'+uuid.uuid4().hex)
+        size = blob['size']
+        with open(tmp_file,'wb') as fp:
+            fp.truncate(size)
+        def _chunk(start):
+            data = self.bucket.read_range(blob['name'],start,min(start+self.chunk_size,size))
+            with open(tmp_file,'r+b') as fp:
+                fp.seek(start)
+                fp.write(data)
+            return len(data)
+        try:
+            got = sum(pool.map(_chunk,range(0,size,self.chunk_size)))
+            if got!=size:
+                raise IOError('Short read for {0} ({1:d} of {2:d} bytes)'.format(blob['name'],got,size))
+            key = verify_blob(tmp_file,blob)
+        except Exception:
+            os.remove(tmp_file)
+            raise
+        path = os.path.join(self.cache_dir,'objects',key[-2:],key) # one path per content, whatever the name
+        if os.path.isdir(os.path.dirname(path))==False:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+        os.replace(tmp_file,path) # identical content always lands on the same path
+        with self._lock:
+            self.objects[key] = {'path':path,'size':size,'atime':time.time()}
+            self.names[blob['name']] = key
+        return path
+
+    def fetch_blobs(self,blobs,retries=2):
+        # make sure every blob (from bucket.list_blobs) is cached,
+        # returns {blob name: local path}
+        paths,missing = {},[]
+        for blob in blobs:
+            path = self.lookup(blob['name'])
+            if path is not None:
+                paths[blob['name']] = path
+            else:
+                missing.append(blob)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as chunk_pool, \
+             ThreadPoolExecutor(max_workers=self.n_threads) as blob_pool:
+            def _fetch(blob):
+                for attempt in range(retries+1):
+                    try:
+                        return self._download(blob,chunk_pool)
+                    except IOError:
+                        if attempt==retries:
+                            raise
+            for blob,path in zip(missing,blob_pool.map(_fetch,missing)):
+                paths[blob['name']] = path
+        with self._lock:
+            keep = set([self.names[ii] for ii in paths if ii in self.names])
+        self.evict(keep)
+        self.save_index()
+        return paths
+
+    def fetch(self,names):
+        # fetch blobs by full name, returns local paths in the same order
+        paths,missing = {},[]
+        for name in names:
+            path = self.lookup(name)
+            if path is not None:
+                paths[name] = path # cached, no need to ask the bucket
+            else:
+                missing.append(name)
+        listed = {} # one listing per folder, not per name
+        for prefix in sorted(set([ii[0:ii.rfind('/')+1] for ii in missing])):
+            listed.update({ii['name']:ii for ii in self.bucket.list_blobs(prefix)})
+        blobs = []
+        for name in missing:
+            if name not in listed:
+                raise KeyError('No blob named {}'.format(name))
+            blobs.append(listed[name])
+        paths.update(self.fetch_blobs(blobs))
+        return [paths[ii] for ii in names]
+
+    def clear(self):
+        with self._lock:
+            self.names,self.objects = {},{}
+        shutil.rmtree(os.path.join(self.cache_dir,'objects'),ignore_errors=True)
+        self.save_index()